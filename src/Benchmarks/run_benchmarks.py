@@ -0,0 +1,352 @@
+"""
+Script used to benchmark the local backend stages on synthetic data
+For every grid size and disturbed fraction a synthetic workspace is generated (utils/synthetic_inputs.py),
+then every stage (utils/bench_stages.py) runs in its own python process so its peak memory is its own.
+Wall time, throughput and peak RSS of each run are written to a JSON file, and with --baseline the results
+are compared against an earlier results file, exiting with status 1 if a stage got slower or bigger than --tolerance
+Usage:
+    $ python run_benchmarks.py -o results.json -s 1024 4096 -p 0.01 0.1
+    $ python run_benchmarks.py -o results.json --baseline previous_results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import logging
+import resource
+import subprocess
+import tempfile
+
+# the stages live in the CreateEEFuels and CreateDistLayer script folders, their utils folders share the namespace
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[1:1] = [os.path.join(SRC_DIR, "CreateEEFuels"), os.path.join(SRC_DIR, "CreateDistLayer")]
+
+from utils.bench_stages import STAGES
+from utils.synthetic_inputs import make_workspace
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=os.path.join(os.path.dirname(__file__), 'run_benchmarks.log')
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+RESULTS_VERSION = 1
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Helper function to get the peak resident set size in MB (ru_maxrss is KB on linux, bytes on macOS)"""
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_stage(stage: str, workspace: str, workers: int) -> dict:
+    """Function to run one stage in this process and measure it, used by the child processes
+    returns:
+        dict: stage output counts plus seconds, rss_before_mb (after imports), peak_rss_mb and peak_workers_rss_mb
+    """
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    result = STAGES[stage](workspace, workers)
+    result["seconds"] = time.perf_counter() - start
+    result["rss_before_mb"] = rss_before
+    result["peak_rss_mb"] = peak_rss_mb()
+    # worker pools of the stage, largest single worker
+    result["peak_workers_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def run_stage_process(stage: str, workspace: str, workers: int) -> dict:
+    """Function to run one stage in a fresh python process and collect its measurements"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--run_stage", stage, "--workspace", workspace, "-w", str(workers)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{stage} failed on {workspace}:\n{proc.stderr}")
+    # the measurements are the last line the child prints
+    return json.loads(proc.stdout.strip().split("\n")[-1])
+
+
+def environment_info() -> dict:
+    """Helper function to describe the machine and code version the benchmarks ran on"""
+    import numpy
+    import rasterio
+    import geopandas
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "geopandas": geopandas.__version__,
+    }
+
+
+def summarize(stage: str, workspace_meta: dict, workers: int, runs: list) -> dict:
+    """Function to summarize the repeats of one stage on one workspace
+    the fastest repeat gives seconds and throughput, the largest repeat gives peak memory
+    """
+    best = min(runs, key=lambda run: run["seconds"])
+    return {
+        "stage": stage,
+        "size": workspace_meta["size"],
+        "dist_fraction": workspace_meta["dist_fraction"],
+        "disturbed_pixels": workspace_meta["disturbed_pixels"],
+        "workers": workers,
+        "items": best["items"],
+        "unit": best["unit"],
+        "seconds": best["seconds"],
+        "throughput": best["items"] / best["seconds"] if best["seconds"] > 0 else None,
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "peak_workers_rss_mb": max(run["peak_workers_rss_mb"] for run in runs),
+        "rss_before_mb": best["rss_before_mb"],
+        "runs": runs,
+    }
+
+
+def result_key(result: dict) -> tuple:
+    """Helper function to get what a result is matched on between two results files"""
+    return result["stage"], result["size"], result["dist_fraction"], result["workers"]
+
+
+def compare_results(results: list, baseline: list, tolerance: float) -> list:
+    """Function to find the results that regressed against a baseline results file
+    args:
+        results (list): summaries of this run
+        baseline (list): summaries of the baseline run
+        tolerance (float): allowed relative loss of throughput / growth of peak memory, e.g. 0.25
+    returns:
+        list: {"stage", "size", "dist_fraction", "workers", "metric", "baseline", "current", "change"} of every regression
+    """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        checks = [
+            # throughput regresses when it drops, memory when it grows
+            ("throughput", base["throughput"], result["throughput"], -1),
+            ("peak_rss_mb", base["peak_rss_mb"], result["peak_rss_mb"], 1),
+        ]
+        for metric, old, new, sign in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if sign * change > tolerance:
+                regressions.append(
+                    dict(zip(["stage", "size", "dist_fraction", "workers"], result_key(result)),
+                         metric=metric, baseline=old, current=new, change=change)
+                )
+    return regressions
+
+
+def main():
+    """Main level function for benchmarking the local backend stages"""
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for benchmarking the local backend stages on synthetic data."
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="benchmark_results.json",
+        help="results JSON file path. default = benchmark_results.json"
+    )
+
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1024, 2048],
+        help="edges of the square synthetic grids in pixels. default = 1024 2048"
+    )
+
+    parser.add_argument(
+        "-p",
+        "--dist_fractions",
+        type=float,
+        nargs="+",
+        default=[0.01, 0.1],
+        help="shares of the pixels that are disturbed. default = 0.01 0.1"
+    )
+
+    parser.add_argument(
+        "--stages",
+        type=str,
+        nargs="+",
+        choices=list(STAGES),
+        default=list(STAGES),
+        help="stages to run, in pipeline order. default = all"
+    )
+
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=1,
+        help="runs of each stage on each workspace. default = 1"
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes of every stage, the fuel stages run on grid tiles. default = 1"
+    )
+
+    parser.add_argument(
+        "--zones",
+        type=int,
+        default=4,
+        help="number of LANDFIRE zones in each grid. default = 4"
+    )
+
+    parser.add_argument(
+        "--table_rows",
+        type=int,
+        default=20000,
+        help="rows of each zone CMB table. default = 20000"
+    )
+
+    parser.add_argument(
+        "--treatments",
+        type=int,
+        default=2000,
+        help="number of treatment polygons. default = 2000"
+    )
+
+    parser.add_argument(
+        "--treatment_files",
+        type=int,
+        default=4,
+        help="number of treatment shapefiles the polygons are split over. default = 4"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed of the synthetic data. default = 0"
+    )
+
+    parser.add_argument(
+        "--workspace_dir",
+        type=str,
+        help="folder to generate the workspaces in, kept after the run. default = temporary folder, removed after the run"
+    )
+
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="optional earlier results JSON file to compare against"
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed relative throughput loss / peak memory growth against --baseline. default = 0.25"
+    )
+
+    # used by the child processes, each runs one stage
+    parser.add_argument("--run_stage", type=str, choices=list(STAGES), help=argparse.SUPPRESS)
+    parser.add_argument("--workspace", type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        print(json.dumps(run_stage(args.run_stage, args.workspace, args.workers)))
+        return
+
+    # keep pipeline order whatever order the stages were given in
+    stages = [stage for stage in STAGES if stage in args.stages]
+    workspace_dir = args.workspace_dir or tempfile.mkdtemp(prefix="optx_bench_")
+
+    results = []
+    try:
+        for size in args.sizes:
+            for dist_fraction in args.dist_fractions:
+                workspace = os.path.join(workspace_dir, f"size{size}_dist{dist_fraction:g}_seed{args.seed}")
+                start = time.time()
+                workspace_meta = make_workspace(
+                    workspace,
+                    size,
+                    dist_fraction,
+                    zones=args.zones,
+                    table_rows=args.table_rows,
+                    treatments=args.treatments,
+                    treatment_files=args.treatment_files,
+                    seed=args.seed,
+                )
+                logger.info(f"generated {workspace} in {(time.time() - start):.1f} seconds")
+
+                for stage in stages:
+                    runs = [run_stage_process(stage, workspace, args.workers) for _ in range(args.repeats)]
+                    summary = summarize(stage, workspace_meta, args.workers, runs)
+                    logger.info(
+                        f"{stage} size {size} dist {dist_fraction:g}: {summary['seconds']:.2f} s, "
+                        f"{summary['throughput']:.0f} {summary['unit']}/s, peak {summary['peak_rss_mb']:.0f} MB"
+                    )
+                    print(
+                        f"{stage:<28} size {size:>6} dist {dist_fraction:<6g} {summary['seconds']:>8.2f} s "
+                        f"{summary['throughput']:>14.0f} {summary['unit']}/s {summary['peak_rss_mb']:>8.0f} MB"
+                    )
+                    results.append(summary)
+    finally:
+        if args.workspace_dir is None:
+            shutil.rmtree(workspace_dir, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "environment": environment_info(),
+        "parameters": {
+            "zones": args.zones,
+            "table_rows": args.table_rows,
+            "treatments": args.treatments,
+            "treatment_files": args.treatment_files,
+            "seed": args.seed,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        report["regressions"] = compare_results(results, baseline["results"], args.tolerance)
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"wrote {args.output}")
+
+    for regression in report.get("regressions", []):
+        print(
+            f"REGRESSION {regression['stage']} size {regression['size']} dist {regression['dist_fraction']:g}: "
+            f"{regression['metric']} {regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['change']:+.0%})"
+        )
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
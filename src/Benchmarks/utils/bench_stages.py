@@ -0,0 +1,236 @@
+"""
+Script for defining the benchmarked stages, each one runs a stage of the local backend over a synthetic workspace
+from utils/synthetic_inputs.py the way its script would (read inputs, compute, write outputs to <workspace>/out)
+The fuel stages run in pipeline order, calc_CC_CH and calc_CBD_CBH read the outputs of the stages before them
+like the EE scripts read the exported assets
+The fuel stages are split into grid tiles run by tile_engine.run_tiles on `workers` processes, each worker opening
+the compiled table bundle of the workspace once, like calc_fuelscape_local.py
+
+Each stage function takes the workspace folder and the number of workers and returns
+{"items": number of pixels or features processed, "unit": "pixels" or "features"}
+"""
+
+import os
+import glob
+import json
+import yaml
+import functools
+import numpy as np
+from utils.local_fuels import (
+    calc_canopy_guide,
+    calc_fm40,
+    calc_cc_ch,
+    calc_cbh,
+    calc_cbd,
+    NODATA,
+    NODATA_INT16,
+    STACK_BANDS,
+)
+from utils.local_inputs import read_inputs
+from utils.key_packing import pack_arrays
+from utils.table_bundle import open_tables, fuel_lookups
+from utils.raster_io import read_window, window_bounds
+from utils.tile_engine import BLOCK_SIZE, grid_window, grid_tiles, tile_bounds, window_profile, open_output, run_tiles
+from utils.synthetic_inputs import BUNDLE_FILE
+
+# tile edge of the fuel stages, small enough that the synthetic grids split into several tiles per worker
+TILE_SIZE = 2 * BLOCK_SIZE
+
+# lookup tables of the worker process, set once by _init_worker
+_tables = None
+
+
+def _init_worker(bundle_path: str):
+    """Helper function to open the table bundle once per worker process"""
+    global _tables
+    _tables = open_tables(bundle_path)
+
+
+def _lookups(zone: np.ndarray) -> dict:
+    """Helper function to gather the lookups of the zones in a tile"""
+    return fuel_lookups(_tables, sorted(int(z) for z in np.unique(zone) if z != 0))
+
+
+def _run_stage_tiles(workspace: str, workers: int, kernel, outputs: dict, initializer=_init_worker) -> int:
+    """Helper function to run a tile kernel over the DIST extent of the workspace and stream it to the outputs
+    args:
+        workspace (str): synthetic workspace folder
+        workers (int): number of worker processes
+        kernel (callable): module level function taking (tile, workspace, geo_info, fuels_source)
+        outputs (dict): {output name: (file name, band names, dtype, nodata)} in <workspace>/out
+        initializer (callable): per-worker setup taking the bundle path. default = _init_worker
+    returns:
+        int: number of pixels computed
+    """
+    with open(os.path.join(workspace, "config.yml")) as file:
+        geo_info = yaml.full_load(file)["geo"]
+    with open(os.path.join(workspace, "synthetic.json")) as file:
+        fuels_source = json.load(file)["fuels_source"]
+    out_dir = os.path.join(workspace, "out")
+    os.makedirs(out_dir, exist_ok=True)
+
+    extent = grid_window(geo_info, window_bounds(os.path.join(workspace, "DIST.tif"))[0])
+    profile = window_profile(geo_info, extent)
+    datasets = {}
+    try:
+        for name, (file_name, band_names, dtype, nodata) in outputs.items():
+            datasets[name] = open_output(os.path.join(out_dir, file_name), profile, band_names, dtype, nodata)
+        run_tiles(
+            functools.partial(kernel, workspace=workspace, geo_info=geo_info, fuels_source=fuels_source),
+            grid_tiles(extent, TILE_SIZE),
+            datasets,
+            extent,
+            workers,
+            initializer,
+            (os.path.join(workspace, BUNDLE_FILE),),
+        )
+    finally:
+        for dst in datasets.values():
+            dst.close()
+    return int(extent.width * extent.height)
+
+
+def _read_tile(workspace: str, geo_info: dict, tile, names: list, fuels_source: str) -> tuple:
+    """Helper function to read the DIST and named inputs of a tile, returns (bounds, dist, arrays)"""
+    bounds = tile_bounds(geo_info, tile)
+    dist = read_window(os.path.join(workspace, "DIST.tif"), bounds)
+    return bounds, dist, read_inputs(os.path.join(workspace, "inputs"), names, bounds, fuels_source)
+
+
+def _cmb_tile(tile, workspace: str, geo_info: dict, fuels_source: str, baseline: str, to_col: str, kernel) -> dict:
+    """Helper function to run a CMB remap kernel (canopy guide or FM40) over one tile"""
+    _, dist, arrays = _read_tile(workspace, geo_info, tile, ["bps", "evt", "evh", "evc", "zone", baseline], fuels_source)
+    lookups = _lookups(arrays["zone"])
+    keys = pack_arrays(
+        lookups["packing"],
+        {"DIST": dist, "BPS": arrays["bps"], "EVH": arrays["evh"], "EVC": arrays["evc"], "EVT": arrays["evt"]},
+    )
+    return {"out": list(kernel(dist, keys, arrays[baseline], arrays["zone"], lookups[to_col]))}
+
+
+def _cc_ch_tile(tile, workspace: str, geo_info: dict, fuels_source: str) -> dict:
+    """Helper function to run the CC/CH kernel over one tile, reads the canopy guide stage output"""
+    bounds, dist, arrays = _read_tile(
+        workspace, geo_info, tile, ["evt", "fvh_mid", "fvc_mid", "zone", "cc", "ch"], fuels_source
+    )
+    cg = read_window(os.path.join(workspace, "out", "canopy_guide.tif"), bounds)
+    lookups = _lookups(arrays["zone"])
+    cc, ch = calc_cc_ch(
+        dist, arrays["evt"], arrays["fvh_mid"], arrays["fvc_mid"], cg,
+        arrays["cc"], arrays["ch"], arrays["zone"], lookups["Cover"], lookups["Height"],
+    )
+    return {"CC": [cc], "CH": [ch]}
+
+
+def _cbd_cbh_tile(tile, workspace: str, geo_info: dict, fuels_source: str) -> dict:
+    """Helper function to run the CBH and CBD kernels over one tile, reads the canopy guide and CC/CH stage outputs"""
+    bounds, dist, arrays = _read_tile(workspace, geo_info, tile, ["evt", "zone", "cc", "cbh", "cbd"], fuels_source)
+    # outputs are NODATA_INT16 outside of CONUS, read them back as is
+    cg, cc, ch = (
+        read_window(os.path.join(workspace, "out", name), bounds, fill_value=fill)
+        for name, fill in [("canopy_guide.tif", NODATA), ("CC.tif", NODATA_INT16), ("CH.tif", NODATA_INT16)]
+    )
+    lookups = _lookups(arrays["zone"])
+    cbh = calc_cbh(dist, arrays["evt"], cc, ch, cg, arrays["cc"], arrays["cbh"], arrays["zone"], lookups["CBH"])
+    cbd = calc_cbd(dist, arrays["evt"], cc, ch, cg, arrays["cc"], arrays["cbd"], arrays["zone"])
+    return {"CBH": [cbh], "CBD": [cbd]}
+
+
+def canopy_guide_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the canopy guide stage (create_canopy_guide.py)"""
+    kernel = functools.partial(_cmb_tile, baseline="cg", to_col="NewCanopy", kernel=calc_canopy_guide)
+    outputs = {"out": ("canopy_guide.tif", ["newCanopy", "qa_flags"], "uint16", NODATA)}
+    return {"items": _run_stage_tiles(workspace, workers, kernel, outputs), "unit": "pixels"}
+
+
+def fm40_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the FM40 stage (calc_FM40.py)"""
+    kernel = functools.partial(_cmb_tile, baseline="fm40", to_col="NewFBFM40", kernel=calc_fm40)
+    outputs = {"out": ("FM40.tif", ["new_fbfm40", "qa_flags"], "uint16", NODATA)}
+    return {"items": _run_stage_tiles(workspace, workers, kernel, outputs), "unit": "pixels"}
+
+
+def cc_ch_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the CC/CH stage (calc_CC_CH.py), reads the canopy guide stage output"""
+    outputs = {name: (f"{name}.tif", [name], "int16", NODATA_INT16) for name in ["CC", "CH"]}
+    return {"items": _run_stage_tiles(workspace, workers, _cc_ch_tile, outputs), "unit": "pixels"}
+
+
+def cbd_cbh_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the CBD/CBH stage (calc_CBD_CBH.py), reads the canopy guide and CC/CH stage outputs"""
+    outputs = {name: (f"{name}.tif", [name], "int16", NODATA_INT16) for name in ["CBH", "CBD"]}
+    return {"items": _run_stage_tiles(workspace, workers, _cbd_cbh_tile, outputs), "unit": "pixels"}
+
+
+def _fuelscape_tile(tile, workspace: str, geo_info: dict, fuels_source: str) -> dict:
+    """Helper function to run the fused kernel of calc_fuelscape_local.py over one tile"""
+    from calc_fuelscape_local import fuelscape_tile
+
+    return fuelscape_tile(
+        tile, geo_info, [os.path.join(workspace, "DIST.tif")], os.path.join(workspace, "inputs"), fuels_source
+    )
+
+
+def fuelscape_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the fused kernel of calc_fuelscape_local.py (all four fuel stages in one pass)"""
+    from calc_fuelscape_local import init_worker
+
+    # output names of a single DIST.tif scenario, the canopy guide is kept apart from the canopy guide stage output
+    outputs = {
+        "DIST/fuelscape": ("fuelscape.tif", STACK_BANDS, "int16", NODATA_INT16),
+        "DIST/canopy_guide": ("fuelscape_canopy_guide.tif", ["newCanopy"], "uint16", NODATA),
+    }
+    return {"items": _run_stage_tiles(workspace, workers, _fuelscape_tile, outputs, init_worker), "unit": "pixels"}
+
+
+def rasterize_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark rasterizing the dist_w_ranks polygons (rasterize_treatments_local.py)"""
+    import geopandas as gpd
+    from utils.local_rasterize import rasterize_ranks
+
+    with open(os.path.join(workspace, "config.yml")) as file:
+        geo_info = yaml.full_load(file)["geo"]
+    dist_w_ranks = gpd.read_file(os.path.join(workspace, "dist_w_ranks", "dist_w_ranks.shp")).to_crs(geo_info["crs"])
+    os.makedirs(os.path.join(workspace, "out"), exist_ok=True)
+    extent = rasterize_ranks(
+        dist_w_ranks.geometry.values,
+        dist_w_ranks["ranks"].astype(int).values,
+        geo_info,
+        os.path.join(workspace, "out", "DIST_rasterized.tif"),
+        bounds=window_bounds(os.path.join(workspace, "DIST.tif"))[0],
+        workers=workers,
+    )
+    return {"items": int(extent.width * extent.height), "unit": "pixels"}
+
+
+def make_full_dist_shp_stage(workspace: str, workers: int = 1) -> dict:
+    """Function to benchmark the streamed dist_w_ranks build (create_treatments_custom.py) with the cached crosswalk"""
+    from create_treatments_custom import write_full_dist_shp
+
+    with open(os.path.join(workspace, "synthetic.json")) as file:
+        meta = json.load(file)
+    files = sorted(glob.glob(os.path.join(workspace, "treatments", "*.shp")))
+    os.makedirs(os.path.join(workspace, "out"), exist_ok=True)
+    written = write_full_dist_shp(
+        os.path.join(workspace, "out", "dist_w_ranks.shp"),
+        files=files,
+        local_zones_file=os.path.join(workspace, "zones", "zones.shp"),
+        year_range=meta["year_range"],
+        eff_yr=meta["eff_yr"],
+        workers=workers,
+        xwalk_cache_dir=os.path.join(workspace, "xwalk_cache"),
+        offline=True,
+    )
+    return {"items": int(meta["treatments"]), "unit": "features", "output_features": int(written)}
+
+
+# stage name -> function, in the order they run (later fuel stages read the outputs of earlier ones)
+STAGES = {
+    "create_canopy_guide": canopy_guide_stage,
+    "calc_CC_CH": cc_ch_stage,
+    "calc_CBD_CBH": cbd_cbh_stage,
+    "calc_FM40": fm40_stage,
+    "calc_fuelscape_local": fuelscape_stage,
+    "rasterize_treatments_local": rasterize_stage,
+    "make_full_dist_shp": make_full_dist_shp_stage,
+}
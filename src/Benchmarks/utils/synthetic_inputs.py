@@ -0,0 +1,309 @@
+"""
+Script for defining functions to generate a synthetic workspace for the benchmarks
+Everything the local backend reads is generated on a small grid in the config crs from a seed:
+DIST, LANDFIRE and baseline fuel GeoTIFFs (named as in CreateEEFuels/utils/local_inputs.py), the zone CMB and
+disturbance csv tables (laid out like gs://landfire/LFTFCT_tables), the LANDFIRE zones, treatment shapefiles with
+a cached treatment crosswalk and a dist_w_ranks shapefile
+
+Workspace layout:
+    config.yml                  geo section of the synthetic grid
+    synthetic.json              generation parameters and counts
+    DIST.tif                    DIST codes, 0 where not disturbed
+    inputs/                     LANDFIRE and baseline GeoTIFFs
+    tables/                     disturbance tables + cmb_zones_wneighbors/z{NN}_CMB.csv
+    tables.bundle               the tables compiled once, see CreateEEFuels/compile_tables.py
+    zones/zones.shp             LANDFIRE zones (ZONE_NUM)
+    treatments/*.shp            treatment polygons (TREATMENT, YEAR)
+    xwalk_cache/                treatment crosswalk cache, see CreateDistLayer/utils/crosswalk_cache.py
+    dist_w_ranks/dist_w_ranks.shp  ranked treatment polygons (ranks)
+"""
+
+import os
+import csv
+import json
+import yaml
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from shapely import box
+from rasterio.transform import Affine
+from utils.local_inputs import input_path
+from utils.local_fuels import PJ_EVT
+from utils.table_bundle import DISTURBANCE_TABLES, read_source_tables, compile_bundle, write_bundle
+from utils.dist_codes import CODE_RANKS
+from utils.crosswalk_cache import XWALK_SHEET, XWALK_WORKSHEET, write_cache
+
+CRS = "EPSG:5070"
+SCALE = 30
+# upper left corner of the synthetic grid, somewhere in CONUS on the LANDFIRE grid
+ORIGIN = (-2000025.0, 2500005.0)
+FUELS_SOURCE = "pyrologix"
+# compiled lookup table bundle of the workspace
+BUNDLE_FILE = "tables.bundle"
+
+# value vocabularies the rasters and tables draw from, small enough that tables match a good share of pixels
+DIST_CODES = np.array(sorted(CODE_RANKS), dtype=np.uint16)
+BPS_CODES = np.arange(10, 90, 10, dtype=np.uint16)
+EVH_CODES = np.array([101, 102, 103, 104, 105, 106], dtype=np.uint16)
+EVC_CODES = np.array([110, 120, 130, 140, 150, 160], dtype=np.uint16)
+EVT_CODES = np.array(PJ_EVT + [3001, 3002, 3003], dtype=np.uint16)
+FM40_CODES = np.array([91, 98, 101, 102, 121, 122, 141, 142, 161, 165, 181, 183, 186, 188], dtype=np.uint16)
+
+# treatment crosswalk TYPE_SEV values, TYPE_SEV * 10 + TSD gives the DIST codes in CODE_RANKS
+TYPE_SEVS = sorted({code // 10 for code in CODE_RANKS})
+YEAR_RANGE = [2014, 2024]
+EFF_YR = 2024
+
+
+def grid_info(size: int) -> dict:
+    """Helper function to get the geo config section of a size x size synthetic grid"""
+    return {
+        "crs": CRS,
+        "crsTransform": [SCALE, 0, ORIGIN[0], 0, -SCALE, ORIGIN[1]],
+        "dimensions": [size, size],
+        "scale": SCALE,
+    }
+
+
+def _write_raster(path: str, arr: np.ndarray, geo_info: dict, nodata: int = None):
+    """Helper function to write one synthetic band as a tiled GeoTIFF on the grid"""
+    profile = {
+        "driver": "GTiff",
+        "crs": geo_info["crs"],
+        "transform": Affine(*geo_info["crsTransform"]),
+        "height": arr.shape[0],
+        "width": arr.shape[1],
+        "count": 1,
+        "dtype": arr.dtype.name,
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(arr, 1)
+
+
+def _write_csv(path: str, columns: dict):
+    """Helper function to write a table the way the LFTFCT csv tables are written, every value quoted"""
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+        writer.writerow(list(columns))
+        writer.writerows(zip(*columns.values()))
+
+
+def zone_strips(size: int, zone_nums: np.ndarray) -> np.ndarray:
+    """Function to split the grid columns into one vertical strip per zone
+    returns:
+        np.ndarray: first column of each strip plus the grid width, len(zone_nums) + 1
+    """
+    return np.linspace(0, size, zone_nums.size + 1).round().astype(int)
+
+
+def make_rasters(rng: np.random.Generator, geo_info: dict, zone_nums: np.ndarray, dist_fraction: float, out_dir: str) -> int:
+    """Function to write the DIST, LANDFIRE and baseline fuel GeoTIFFs
+    args:
+        rng (np.random.Generator): random generator
+        geo_info (dict): geo section of the synthetic config
+        zone_nums (np.ndarray): LANDFIRE zone numbers, one vertical strip each
+        dist_fraction (float): share of the pixels that are disturbed
+        out_dir (str): workspace folder
+    returns:
+        int: number of disturbed pixels
+    """
+    size = geo_info["dimensions"][0]
+    shape = (size, size)
+    inputs_dir = os.path.join(out_dir, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+
+    dist = np.where(rng.random(shape) < dist_fraction, rng.choice(DIST_CODES, shape), 0).astype(np.uint16)
+    _write_raster(os.path.join(out_dir, "DIST.tif"), dist, geo_info, nodata=0)
+
+    zone = np.zeros(shape, dtype=np.uint16)
+    edges = zone_strips(size, zone_nums)
+    for zone_num, col0, col1 in zip(zone_nums, edges[:-1], edges[1:]):
+        zone[:, col0:col1] = zone_num
+
+    landfire = {
+        "bps": rng.choice(BPS_CODES, shape),
+        "evt": rng.choice(EVT_CODES, shape),
+        "evh": rng.choice(EVH_CODES, shape),
+        "evc": rng.choice(EVC_CODES, shape),
+        "fvc_mid": rng.integers(0, 101, shape, dtype=np.uint16),
+        "fvh_mid": rng.integers(0, 52, shape, dtype=np.uint16),
+        "zone": zone,
+        "cg": rng.integers(0, 4, shape, dtype=np.uint16),
+    }
+    baseline = {
+        "cc": rng.integers(0, 96, shape, dtype=np.int16),
+        "ch": rng.integers(0, 511, shape, dtype=np.int16),
+        "cbh": rng.integers(0, 101, shape, dtype=np.int16),
+        "cbd": rng.integers(0, 46, shape, dtype=np.int16),
+        "fm40": rng.choice(FM40_CODES, shape).astype(np.int16),
+    }
+    for name, arr in list(landfire.items()) + list(baseline.items()):
+        _write_raster(input_path(inputs_dir, name, FUELS_SOURCE), arr, geo_info)
+    return int(np.count_nonzero(dist))
+
+
+def make_tables(rng: np.random.Generator, zone_nums: np.ndarray, table_rows: int, out_dir: str):
+    """Function to write the zone CMB tables and the disturbance regression tables
+    args:
+        rng (np.random.Generator): random generator
+        zone_nums (np.ndarray): LANDFIRE zone numbers to write a CMB table for
+        table_rows (int): rows of each zone CMB table, drawn without replacement from the vocabularies
+        out_dir (str): workspace folder
+    """
+    tables_dir = os.path.join(out_dir, "tables")
+    cmb_dir = os.path.join(tables_dir, "cmb_zones_wneighbors")
+    os.makedirs(cmb_dir, exist_ok=True)
+
+    vocabs = [DIST_CODES, BPS_CODES, EVH_CODES, EVC_CODES, EVT_CODES]
+    n_combos = int(np.prod([vocab.size for vocab in vocabs]))
+    for zone_num in zone_nums:
+        combos = rng.choice(n_combos, min(table_rows, n_combos), replace=False)
+        # unravel the combination index into one value of each vocabulary
+        idx = np.unravel_index(combos, [vocab.size for vocab in vocabs])
+        dist, bps, evh, evc, evt = (vocab[i] for vocab, i in zip(vocabs, idx))
+        _write_csv(
+            os.path.join(cmb_dir, f"z{int(zone_num):02d}_CMB.csv"),
+            {
+                "encoded": [f"{d}{b:04d}{h}{c}{t}" for d, b, h, c, t in zip(dist, bps, evh, evc, evt)],
+                "NewFBFM40": rng.choice(FM40_CODES, combos.size),
+                "NewCanopy": rng.integers(0, 4, combos.size),
+                "DIST": dist,
+                "BPSRF": bps,
+                "EVHR": evh,
+                "EVCR": evc,
+                "EVTR": evt,
+            },
+        )
+
+    # every DIST x EVT combination gets coefficients, in the range of the real tables
+    hdist, evt_fill = (arr.ravel() for arr in np.meshgrid(DIST_CODES, EVT_CODES))
+    for file_name in DISTURBANCE_TABLES.values():
+        _write_csv(
+            os.path.join(tables_dir, file_name),
+            {
+                "HDist": hdist,
+                "EVT_Fill": evt_fill,
+                "intercept": np.round(rng.uniform(0, 5, hdist.size), 4),
+                "HT_coef": np.round(rng.uniform(0, 1, hdist.size), 4),
+                "CC_coef": np.round(rng.uniform(0, 1, hdist.size), 4),
+            },
+        )
+
+
+def make_vectors(
+    rng: np.random.Generator,
+    geo_info: dict,
+    zone_nums: np.ndarray,
+    dist_fraction: float,
+    treatments: int,
+    treatment_files: int,
+    out_dir: str,
+):
+    """Function to write the zones, treatment shapefiles, treatment crosswalk cache and dist_w_ranks shapefile
+    treatments are squares scattered over the grid sized so they cover about dist_fraction of it
+    args:
+        rng (np.random.Generator): random generator
+        geo_info (dict): geo section of the synthetic config
+        zone_nums (np.ndarray): LANDFIRE zone numbers, one vertical strip each
+        dist_fraction (float): share of the grid the treatments cover
+        treatments (int): number of treatment polygons
+        treatment_files (int): number of shapefiles the treatments are split over
+        out_dir (str): workspace folder
+    """
+    size = geo_info["dimensions"][0]
+    x0, y0 = ORIGIN
+    extent = size * SCALE
+
+    edges = x0 + zone_strips(size, zone_nums) * SCALE
+    zones = gpd.GeoDataFrame(
+        {"ZONE_NUM": zone_nums.astype(int)},
+        geometry=[box(left, y0 - extent, right, y0) for left, right in zip(edges[:-1], edges[1:])],
+        crs=CRS,
+    )
+    os.makedirs(os.path.join(out_dir, "zones"), exist_ok=True)
+    zones.to_file(os.path.join(out_dir, "zones", "zones.shp"))
+
+    side = extent * np.sqrt(dist_fraction / treatments)
+    left = x0 + rng.uniform(0, extent - side, treatments)
+    top = y0 - rng.uniform(0, extent - side, treatments)
+    geoms = box(left, top - side, left + side, top)
+
+    crosswalk = pd.DataFrame({"TREATMENT": [f"treatment_{ts}" for ts in TYPE_SEVS], "TYPE_SEV": TYPE_SEVS})
+    write_cache(os.path.join(out_dir, "xwalk_cache"), XWALK_SHEET, XWALK_WORKSHEET, crosswalk, "synthetic", "synthetic")
+
+    treated = gpd.GeoDataFrame(
+        {
+            "TREATMENT": rng.choice(crosswalk["TREATMENT"].values, treatments),
+            "YEAR": rng.integers(YEAR_RANGE[0], YEAR_RANGE[1] + 1, treatments),
+        },
+        geometry=geoms,
+        crs=CRS,
+    )
+    os.makedirs(os.path.join(out_dir, "treatments"), exist_ok=True)
+    for i, part in enumerate(np.array_split(np.arange(treatments), treatment_files)):
+        treated.iloc[part].to_file(os.path.join(out_dir, "treatments", f"treatments_{i:02d}.shp"))
+
+    ranked = gpd.GeoDataFrame({"ranks": rng.integers(1, 37, treatments)}, geometry=geoms, crs=CRS)
+    os.makedirs(os.path.join(out_dir, "dist_w_ranks"), exist_ok=True)
+    ranked.to_file(os.path.join(out_dir, "dist_w_ranks", "dist_w_ranks.shp"))
+
+
+def make_workspace(
+    out_dir: str,
+    size: int,
+    dist_fraction: float,
+    zones: int = 4,
+    table_rows: int = 20000,
+    treatments: int = 2000,
+    treatment_files: int = 4,
+    seed: int = 0,
+) -> dict:
+    """Function to generate a complete synthetic workspace, see the module docstring for the layout
+    args:
+        out_dir (str): workspace folder, created if missing
+        size (int): edge of the square grid in pixels
+        dist_fraction (float): share of the pixels that are disturbed (and covered by treatments)
+        zones (int): number of LANDFIRE zones the grid is split over. default = 4
+        table_rows (int): rows of each zone CMB table. default = 20000
+        treatments (int): number of treatment polygons. default = 2000
+        treatment_files (int): number of treatment shapefiles. default = 4
+        seed (int): random seed, the same parameters and seed give the same workspace. default = 0
+    returns:
+        dict: generation parameters and counts, also written to synthetic.json
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    geo_info = grid_info(size)
+    with open(os.path.join(out_dir, "config.yml"), "w") as file:
+        yaml.dump({"geo": geo_info}, file)
+
+    zone_nums = np.sort(rng.choice(np.arange(1, 67), zones, replace=False))
+    disturbed = make_rasters(rng, geo_info, zone_nums, dist_fraction, out_dir)
+    make_tables(rng, zone_nums, table_rows, out_dir)
+    # compiled once here, the stages open the bundle instead of compiling the csv tables on every run
+    write_bundle(os.path.join(out_dir, BUNDLE_FILE), *compile_bundle(*read_source_tables(os.path.join(out_dir, "tables"))))
+    make_vectors(rng, geo_info, zone_nums, dist_fraction, treatments, treatment_files, out_dir)
+
+    meta = {
+        "size": size,
+        "pixels": size * size,
+        "dist_fraction": dist_fraction,
+        "disturbed_pixels": disturbed,
+        "zones": zone_nums.tolist(),
+        "table_rows": table_rows,
+        "treatments": treatments,
+        "treatment_files": treatment_files,
+        "seed": seed,
+        "fuels_source": FUELS_SOURCE,
+        "year_range": YEAR_RANGE,
+        "eff_yr": EFF_YR,
+    }
+    with open(os.path.join(out_dir, "synthetic.json"), "w") as file:
+        json.dump(meta, file, indent=2)
+    return meta
@@ -1,6 +1,7 @@
 import pandas as pd
+import numpy as np
 import os
-import gspread
+import sys
 import time
 import argparse
 import logging 
@@ -8,8 +9,22 @@ import yaml
 from pathlib import Path
 import subprocess
 import geopandas as gpd
+import shapely
 import zipfile
+import functools
 from fnmatch import fnmatch
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+# the grid tiling engine is shared with the local fuels backend, both utils folders make up the utils namespace
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CreateEEFuels"))
+
+from utils.crosswalk_cache import load_crosswalk
+from utils.dist_codes import CODE_RANKS
+from utils.treatment_reader import batch_fids, read_batch, DEFAULT_BATCH_SIZE
+from utils.dist_output import write_columnar, OUTPUT_FORMATS, SHAPEFILE_PARTS
+from utils.grid_simplify import simplify_to_grid, DEFAULT_TOLERANCE
+from utils.overlap_resolve import resolve_overlaps
+from utils.output_provenance import shapefile_hash, file_hash, table_hash, code_version, provenance_key, provenance_path, up_to_date, write_provenance
 
 '''
 Create CONUS-wide treatments shapefile containing 3-digit DIST code and ranks value for all records
@@ -29,136 +44,227 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 logger.setLevel(logging.INFO)
+logging.getLogger("utils.crosswalk_cache").setLevel(logging.INFO)
+logging.getLogger("utils.treatment_reader").setLevel(logging.INFO)
+logging.getLogger("utils.grid_simplify").setLevel(logging.INFO)
+logging.getLogger("utils.overlap_resolve").setLevel(logging.INFO)
 
 #%%
 
-def make_full_dist_shp(files:list, local_treatments_dir:str, local_zones_file:str, year_range:list, eff_yr:int) -> gpd.GeoDataFrame:
+# LANDFIRE zones that get the SE TSD rules
+SE_ZONE_NUMS = [46, 55, 56, 58, 99]
+
+# TSD remap dictionaries
+NON_SE_TSD_REMAP = {0:1, 1:1, 2:2, 3:2, 4:2, 5:2, 6:2, 7:3, 8:3, 9:3, 10:3}
+SE_TSD_REMAP = {0:1, 1:1, 2:2, 3:2, 4:2, 5:3, 6:3, 7:3, 8:3, 9:3, 10:3}
+
+# reduced field schema for custom applications, ZONE_NUM may be useful for QAing the zone join
+# OUT_COLS = ['DATE', 'TREATMENT', 'YEAR', 'source_id', 'geometry', 'TYPE_SEV', 'ZONE_NUM']
+OUT_COLS = ['TREATMENT', 'YEAR', 'geometry', 'TYPE_SEV', 'ZONE_NUM']
+
+# lookup table and zones of a worker process, set once by init_worker
+_worker_inputs = {}
+
+
+def load_zones(local_zones_file:str) -> gpd.GeoDataFrame:
+    """Function to read the LANDFIRE zones once, reproject them to WGS84 and flag the SE zones
+    args:
+        local_zones_file (str): path to the zones shapefile (shp|zip)
+    returns:
+        gpd.GeoDataFrame: zones with ZONE_NUM, SE (bool) and geometry columns
+    """
+    zones = gpd.read_file(local_zones_file).to_crs(epsg=4326)
+    zones.loc[:,'SE'] = zones['ZONE_NUM'].isin(SE_ZONE_NUMS)
+    return zones[['ZONE_NUM', 'SE', 'geometry']]
+
+
+def dist_rank_calculate(gdf:gpd.GeoDataFrame, eff_yr:int) -> gpd.GeoDataFrame:
+    """Function to calculate the TSD, DIST and ranks values of zone-joined treatment polygons
+    args:
+        gdf (gpd.GeoDataFrame): treatment polygons with TYPE_SEV, YEAR and SE columns
+        eff_yr (int): effective year of the DIST layer
+    returns:
+        gpd.GeoDataFrame: gdf with TYPE_SEV_0, diff_yr, TSD, DIST and ranks columns added
+    """
+    #make 3rd digit padded Type Severity code
+    gdf.loc[:,'TYPE_SEV_0'] = (gdf['TYPE_SEV'] * 10).astype(int)
+    gdf.loc[:,'diff_yr'] = (eff_yr - gdf['YEAR']).astype(int)
     
-    def dist_rank_calculate(gdf:gpd.GeoDataFrame, TSD_remap:dict) -> gpd.GeoDataFrame:
-        #make 3rd digit padded Type Severity code
-        gdf.loc[:,'TYPE_SEV_0'] = (gdf['TYPE_SEV'] * 10).astype(int)
-        gdf.loc[:,'diff_yr'] = (eff_yr - gdf['YEAR']).astype(int)
-        
-        #remap diff_yr value to TSD code based on zones rules
-        gdf.loc[:,'TSD'] = gdf['diff_yr'].map(TSD_remap)
-        gdf.loc[:,'DIST'] = (gdf['TYPE_SEV_0'] + gdf['TSD']).astype(int)
-        
-        # remap DIST code values to ranked values for export
-        gdf.loc[:,'ranks'] = gdf['DIST'].map(code_ranks_dict)
-        
-        return gdf
-
-    # retrieve lookup table google sheet
-    gc = gspread.service_account()
-    # going back and forth whether to use PNF LUT that we mde for pc448 or the FireFactor "super sheet" 
-    trt_xwalk = gc.open("PNF treatment dist assignments")  #pc448 sheet
-    # trt_xwalk = gc.open("Fuels-Treatments Crosswalk") # The FF super sheet
-    lookup_table = pd.DataFrame(trt_xwalk.worksheet("DIST code").get_all_records()) # pc448 sheet
-    # lookup_table = pd.DataFrame(trt_xwalk.worksheet("Lookup").get_all_records()) # The FF super sheet
-
-    # create empty gdf to place processed gdfs on each for-loop iteration
-    gdf_collection = gpd.GeoDataFrame()
+    #remap diff_yr value to TSD code based on zones rules
+    gdf.loc[:,'TSD'] = gdf['diff_yr'].map(SE_TSD_REMAP).where(gdf['SE'], gdf['diff_yr'].map(NON_SE_TSD_REMAP))
+    gdf.loc[:,'DIST'] = (gdf['TYPE_SEV_0'] + gdf['TSD']).astype(int)
     
+    # remap DIST code values to ranked values for export
+    gdf.loc[:,'ranks'] = gdf['DIST'].map(CODE_RANKS)
+    
+    return gdf
+
+
+def process_treatment_batch(file_pth:str, fids:np.ndarray, lookup_table:pd.DataFrame, zones:gpd.GeoDataFrame, year_range:list, eff_yr:int, simplify:dict=None) -> gpd.GeoDataFrame:
+    """Function to turn one batch of records of a treatment file into DIST and ranks polygons
+    args:
+        file_pth (str): path to treatment file (shp|zip)
+        fids (np.ndarray): ids of the records, from treatment_reader.batch_fids
+        lookup_table (pd.DataFrame): treatment -> TYPE_SEV lookup table
+        zones (gpd.GeoDataFrame): zones from load_zones
+        year_range (list): [first year, last year] of treatments to keep
+        eff_yr (int): effective year of the DIST layer
+        simplify (dict): {"geo": geo section of the config, "tolerance": in pixels} to project the polygons to the
+            config crs and simplify them on its grid, see utils/grid_simplify.py. default = no simplification
+    returns:
+        gpd.GeoDataFrame: processed polygons in WGS84, or in the config crs if simplified
+    """
+    start = time.time()
+    shp = read_batch(file_pth, fids)
+    
+    # try to convert YEAR to int, if it fails, then it's not a valid year value
+    try:
+        shp['YEAR'] = shp['YEAR'].astype(int)
+    except TypeError:
+        raise TypeError(f"Could not convert YEAR column in {file_pth}, contains invalid values")
+    
+    # filter for year range, already pushed down to the reader unless YEAR is stored as text
+    shp = shp[(shp['YEAR'] >= year_range[0]) & (shp['YEAR'] <= year_range[1])]
+
+    # inner join with lookup table google sheet to get TYPE_SEV values
+    shp = shp.merge(lookup_table, how='inner', left_on='TREATMENT', right_on='TREATMENT')
+    shp.loc[:,'TYPE_SEV'] = shp['TYPE_SEV'].astype(int) 
+    # filter to remove invalid TYPE_SEV values that would be over 100 
+    # (TYPE_SEV =  TYPE*100 + Severity so invalid values are 847, 968, and 1089)
+    shp = shp[shp['TYPE_SEV'] < 100]            
+    
+    # convert shp to the zones crs
+    shp_4326 = shp.to_crs(epsg=4326)
+    # create tmp index column so that you can remove duplicate records produced by sjoin()
+    shp_4326.loc[:,'tmp_idx'] = range(shp_4326.shape[0])
+    
+    # single spatial join against all zones, a polygon crossing SE and non SE zones is kept once in each subset
+    joined = gpd.sjoin(shp_4326, zones, how='inner')
+    joined = joined.drop_duplicates(subset=['tmp_idx', 'SE'])
+    joined = joined[OUT_COLS + ['SE']]
+    
+    # do the TSD -> DIST -> ranks calculations, SE and non SE rows use their own TSD remap dictionary
+    converted = dist_rank_calculate(joined, eff_yr).drop(columns='SE')
+    if simplify is not None:
+        converted = simplify_batch(converted, simplify["geo"], simplify["tolerance"])
+    logger.info(f"{file_pth}: {len(fids)} records read, {int(joined['SE'].sum())} SE and {int((~joined['SE']).sum())} non SE records processed in {time.time()-start:.1f} seconds")
+    return converted
+
+
+def simplify_batch(gdf:gpd.GeoDataFrame, geo_info:dict, tolerance:float) -> gpd.GeoDataFrame:
+    """Function to project processed polygons to the config crs and simplify them without changing the pixels they rasterize to
+    args:
+        gdf (gpd.GeoDataFrame): processed polygons
+        geo_info (dict): geo section of the config file
+        tolerance (float): simplification tolerance in pixels
+    returns:
+        gpd.GeoDataFrame: polygons in the config crs, slivers covering no pixel center dropped
+    """
+    gdf = gdf.to_crs(geo_info["crs"])
+    geoms, counts = simplify_to_grid(gdf.geometry.values, geo_info, tolerance)
+    keep = np.array([geom is not None for geom in geoms], dtype=bool)
+    vertices = (shapely.get_num_coordinates(gdf.geometry.values).sum(), shapely.get_num_coordinates(geoms[keep]).sum())
+    logger.info(f"simplified on the grid: {counts}, vertices {vertices[0]} -> {vertices[1]}")
+    gdf = gdf[keep].copy()
+    gdf.geometry = gpd.GeoSeries(geoms[keep], index=gdf.index, crs=gdf.crs)
+    return gdf
+
+
+def init_worker(lookup_table:pd.DataFrame, zones:gpd.GeoDataFrame):
+    """Function to hand the lookup table and zones to a worker process once instead of with every batch"""
+    _worker_inputs['lookup_table'] = lookup_table
+    _worker_inputs['zones'] = zones
+
+
+def _process_in_worker(batch:tuple, year_range:list, eff_yr:int, simplify:dict=None) -> gpd.GeoDataFrame:
+    """Helper function to run process_treatment_batch on a (file, fids) batch with the worker's lookup table and zones"""
+    return process_treatment_batch(*batch, _worker_inputs['lookup_table'], _worker_inputs['zones'], year_range, eff_yr, simplify)
+
+
+def iter_full_dist_shp(files:list, local_zones_file:str, year_range:list, eff_yr:int, workers:int=1, xwalk_cache_dir:str=None, offline:bool=False, batch_size:int=DEFAULT_BATCH_SIZE, simplify:dict=None):
+    """Function to stream the DIST and ranks polygons of every treatment file, one processed batch at a time
+    the year range and crosswalked treatments are pushed down to the reader, so records they drop are never loaded,
+    and at most 2 batches per worker are in flight so memory stays bounded by the batch size, not the input size
+    args:
+        files (list): paths to treatment files (shp|zip)
+        local_zones_file (str): path to the LANDFIRE zones shapefile (shp|zip)
+        year_range (list): [first year, last year] of treatments to keep
+        eff_yr (int): effective year of the DIST layer
+        workers (int): number of worker processes, 1 processes the batches in process. default = 1
+        xwalk_cache_dir (str): folder of the treatment crosswalk cache, no caching if None
+        offline (bool): use the cached crosswalk only, no google sheets calls. default = False
+        batch_size (int): treatment records per batch. default = 50000
+        simplify (dict): {"geo": geo section of the config, "tolerance": in pixels}, see process_treatment_batch.
+            default = no simplification
+    yields:
+        gpd.GeoDataFrame: processed polygons of one batch in WGS84 (config crs if simplified), in file and record order
+    """
+    # retrieve lookup table google sheet, or the cached copy if the sheet has not changed since
+    lookup_table = load_crosswalk(xwalk_cache_dir, offline=offline)
+    # Bring in LANDFIRE Zones and flag the SE and non SE zones for TSD value assignment
+    zones = load_zones(local_zones_file)
+
+    # only the record ids of the batches are held here, each batch reads its own polygons
+    batches = []
     for file in files:
-        file_pth = file #os.path.join(local_treatments_dir, os.path.basename(file))
-        logger.info(f'reading {file_pth} to geopandas, joining to treatments lookup')
+        file_batches = batch_fids(file, year_range, lookup_table['TREATMENT'].tolist(), batch_size)
+        if not file_batches:
+            raise RuntimeError(f'No records in {file} after filtering by year range and crosswalked treatments')
+        batches.extend((file, fids) for fids in file_batches)
+    logger.info(f'processing {len(batches)} batches of up to {batch_size} records from {len(files)} files')
 
-        start = time.time()
-        
-        # do the necessary wrangling and year filtering after joining to treatments lookup
-        shp = gpd.read_file(file_pth)
-        logger.info(f'total records in input shp: {shp.shape[0]}')
-        
-        # schema check
-        required_cols = ['TREATMENT','YEAR']
-        assert all([col in shp.columns for col in required_cols]), f"missing required columns in {file_pth}. Required columns: {required_cols}"
-        
-        # try to convert YEAR to int, if it fails, then it's not a valid year value
-        try:
-            shp['YEAR'] = shp['YEAR'].astype(int)
-        except TypeError:
-            raise TypeError(f"Could not convert YEAR column in {file_pth}, contains invalid values")
-        
-        # filter for year range
-        shp = shp[(shp['YEAR'] >= year_range[0]) & (shp['YEAR'] <= year_range[1])]
-        if shp.shape[0] == 0:
-            raise RuntimeError(f'No records in {file_pth} after filtering by year range')
-
-        # inner join with lookup table google sheet to get TYPE_SEV values
-        shp = shp.merge(lookup_table, how='inner', left_on='TREATMENT', right_on='TREATMENT')
-        shp.loc[:,'TYPE_SEV'] = shp['TYPE_SEV'].astype(int) 
-        # filter to remove invalid TYPE_SEV values that would be over 100 
-        # (TYPE_SEV =  TYPE*100 + Severity so invalid values are 847, 968, and 1089)
-        shp = shp[shp['TYPE_SEV'] < 100]            
-        
-        # Bring in LANDFIRE Zones and create the SE and non SE zones for TSD value assignment
-        zones = gpd.read_file(local_zones_file)
-        se_zone_nums = [46, 55, 56, 58, 99]
-        se_zones = zones[zones['ZONE_NUM'].isin(se_zone_nums)]
-        non_se_zones = zones[~zones['ZONE_NUM'].isin(se_zone_nums)]
-
-        # convert zones and shp to same crs
-        se_zones_4326 = se_zones.to_crs(epsg=4326)
-        non_se_zones_4326 = non_se_zones.to_crs(epsg=4326)
-        shp_4326 = shp.to_crs(epsg=4326)
-        
-        logger.info(f'total records in processed shp: {shp.shape[0]}')
-        logger.info('performing TSD, DIST, ranks calculations for SE and Non SE subsets')
-        
-        # create tmp index column so that you can remove duplicate records produced by sjoin()
-        shp_4326.loc[:,'tmp_idx'] = shp_4326.index
-        
-        #spatial join, drop all but ZONE_NUM column from the zones gdf
-        shp_se = gpd.sjoin(shp_4326,se_zones_4326, how='inner')
-        shp_se = shp_se.drop_duplicates(subset=['tmp_idx'])
-        # only keep ZONE_NUM column from the Zones gdf, may be useful for QAing this step
-        # shp_se = shp_se[['DATE', 'TREATMENT', 'YEAR', 'source_id', 'geometry', 'TYPE_SEV', 'ZONE_NUM']] 
-        shp_se = shp_se[['TREATMENT', 'YEAR', 'geometry', 'TYPE_SEV', 'ZONE_NUM']] # reduced field schema for custom applications 
-        logger.info(f'records in shp_se: {shp_se.shape[0]}')
-        
-        #spatial join, drop all but ZONE_NUM column from the zones gdf
-        shp_non_se = gpd.sjoin(shp_4326,non_se_zones_4326, how='inner')
-        shp_non_se = shp_non_se.drop_duplicates(subset=['tmp_idx'])
-        # only keep ZONE_NUM column from the Zones gdf, may be useful for QAing this step
-        # shp_non_se = shp_non_se[['DATE', 'TREATMENT', 'YEAR', 'source_id', 'geometry', 'TYPE_SEV', 'ZONE_NUM']]
-        shp_non_se = shp_non_se[['TREATMENT', 'YEAR', 'geometry', 'TYPE_SEV', 'ZONE_NUM']] # reduced field schema for custom applications 
-        logger.info(f'records in shp_non_se: {shp_non_se.shape[0]}')
-        
-        # TSD remap dictionaries
-        non_se_TSD_remap_dict = {0:1, 1:1, 2:2, 3:2, 4:2, 5:2, 6:2, 7:3, 8:3, 9:3, 10:3}
-        se_TSD_remap_dict = {0:1, 1:1, 2:2, 3:2, 4:2, 5:3, 6:3, 7:3, 8:3, 9:3, 10:3}
-
-        # DIST code -> ranks remap dictionary 
-        code_ranks_dict = {131:36, 132:35, 133:34, 
-                            331:33, 332:32, 333:31, 
-                            121:30, 122:29, 123:28,
-                            111:27, 112:26, 113:25,
-                            321:24, 231:23, 831:22,
-                            311:21, 221:20, 821:19,
-                            322:18, 211:17, 811:16,
-                            312:15, 232:14, 832:13,
-                            323:12, 222:11, 822:10,
-                            313:9, 212:8, 812:7,
-                            233:6, 833:5, 223:4,
-                            823:3, 213:2, 813:1}
+    if workers <= 1 or len(batches) <= 1:
+        for file, fids in batches:
+            yield process_treatment_batch(file, fids, lookup_table, zones, year_range, eff_yr, simplify)
+        return
 
-        
+    process = functools.partial(_process_in_worker, year_range=year_range, eff_yr=eff_yr, simplify=simplify)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(lookup_table, zones)) as pool:
+        pending = deque()
+        for batch in batches:
+            if len(pending) == 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(process, batch))
+        while pending:
+            yield pending.popleft().result()
 
-        # do the TSD -> DIST -> ranks calculations for each zone subset, using the two diff TSD remap dictionaries
-        se_gdf_converted = dist_rank_calculate(shp_se, se_TSD_remap_dict)
-        non_se_gdf_converted = dist_rank_calculate(shp_non_se, non_se_TSD_remap_dict)
-        
-        # then combine both subset gdfs into one gdf
-        both_converted = gpd.GeoDataFrame( pd.concat( [se_gdf_converted, non_se_gdf_converted], ignore_index=True) ) # could ignore_index be affecting the bug ?
-        
-        # add finished gdf to the full gdf_collection
-        logger.info('adding processed gdf to full gdf collection')
-        gdf_collection = gpd.GeoDataFrame(pd.concat([both_converted, gdf_collection]))
-        final_prj_collection = gdf_collection.set_crs(epsg=4326) #set crs to WGS84 
-        end = time.time()
-        logger.info(f'Time Elapsed: {(end-start)/60} minutes')
+
+def make_full_dist_shp(files:list, local_treatments_dir:str, local_zones_file:str, year_range:list, eff_yr:int, workers:int=1, xwalk_cache_dir:str=None, offline:bool=False, batch_size:int=DEFAULT_BATCH_SIZE, simplify:dict=None) -> gpd.GeoDataFrame:
+    """Function to build the DIST and ranks polygons of every treatment file in memory
+    use write_full_dist_shp to write them without holding them all, see iter_full_dist_shp for the args
+    returns:
+        gpd.GeoDataFrame: processed polygons of all files in WGS84, or in the config crs if simplified
+    """
+    start = time.time()
+    gdfs = list(iter_full_dist_shp(files, local_zones_file, year_range, eff_yr, workers, xwalk_cache_dir, offline, batch_size, simplify))
+
+    # add all processed gdfs to the full gdf collection in one concat
+    logger.info(f'adding {len(gdfs)} processed gdfs to full gdf collection')
+    final_prj_collection = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), geometry='geometry', crs=gdfs[0].crs) # WGS84, or the config crs if simplified
+    logger.info(f'Total Time Elapsed: {(time.time()-start)/60} minutes')
     return final_prj_collection
 
+
+def write_full_dist_shp(out_shp:str, files:list, local_zones_file:str, year_range:list, eff_yr:int, workers:int=1, xwalk_cache_dir:str=None, offline:bool=False, batch_size:int=DEFAULT_BATCH_SIZE, simplify:dict=None) -> int:
+    """Function to write the DIST and ranks polygons of every treatment file batch by batch
+    args:
+        out_shp (str): output shapefile, overwritten by the first batch and appended to by the next ones
+        see iter_full_dist_shp for the other args
+    returns:
+        int: number of polygons written
+    """
+    start = time.time()
+    written = 0
+    for gdf in iter_full_dist_shp(files, local_zones_file, year_range, eff_yr, workers, xwalk_cache_dir, offline, batch_size, simplify):
+        if gdf.shape[0] == 0:
+            continue
+        gdf.to_file(out_shp, mode='a' if written else 'w')
+        written += gdf.shape[0]
+    if written == 0:
+        raise RuntimeError(f'No treatment polygons left after the crosswalk and zones joins, nothing written to {out_shp}')
+    logger.info(f'{written} polygons written to {out_shp}, Total Time Elapsed: {(time.time()-start)/60} minutes')
+    return written
+
 def main():
 
     # initalize new cli parser
@@ -179,6 +285,61 @@ def main():
         type=str,
         help="file path to treatment (shp|zip)"
     )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes the batches of treatment records are processed on. default = 1"
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"treatment records read and processed at a time, bounds the memory use. default = {DEFAULT_BATCH_SIZE}"
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the cached treatment crosswalk in data/xwalk_cache only, no google sheets calls"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild and upload the dist_w_ranks output even if its provenance shows it is up to date"
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="shp",
+        choices=list(OUTPUT_FORMATS),
+        help="dist_w_ranks output format. shp is zipped and uploaded to GCS and EE, fgb (FlatGeobuf) and parquet (GeoParquet) are written once with a spatial index for rasterize_treatments_local.py, without the zip and uploads. default = shp"
+    )
+
+    parser.add_argument(
+        "--simplify",
+        action="store_true",
+        help="project the output to the config geo crs and simplify it on the config grid, dropping slivers, without changing the pixels it rasterizes to"
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"simplification tolerance in pixels of the config grid, with --simplify. default = {DEFAULT_TOLERANCE}"
+    )
+
+    parser.add_argument(
+        "--resolve_overlaps",
+        action="store_true",
+        help="keep only the highest rank where treatments overlap and dissolve adjacent polygons sharing a DIST code, the output holds the whole result in memory"
+    )
     args = parser.parse_args()
     
     # parse config file
@@ -198,6 +359,9 @@ def main():
     if not zones_dir.exists():
         zones_dir.mkdir(parents=True)
     
+    # local copy of the treatment crosswalk google sheet, refreshed when the sheet revision changes
+    xwalk_cache_dir = os.path.join(args.repo_dir, 'data', 'xwalk_cache')
+
     # copy over Landfire zones shapefile from cloud
     local_zones_file = os.path.join(zones_dir,'zones.zip')
     logger.info(f'{local_zones_file}')
@@ -214,6 +378,7 @@ def main():
     year_info = config["year_info"]
     year_range = year_info.get("range")
     eff_yr = year_info.get("effective")
+    simplify = {"geo": config["geo"], "tolerance": args.tolerance} if args.simplify else None
     
     #TODO: this could be defined in the config file if you wanted GCS location control
     gcs_output_dir = "gs://pc448-20221128/dist_outputs"
@@ -224,7 +389,7 @@ def main():
     
     ## really not sure what I was going to do with this ################
     if args.file == None: # user does not provide -f file path arg to treatments shp, case is currently not handled well
-        files = os.listdir(local_treatments_dir)
+        files = sorted(os.path.join(local_treatments_dir, i) for i in os.listdir(local_treatments_dir) if fnmatch(i, '*.shp') or fnmatch(i, '*.zip'))
     else:
         files = [args.file] # directly provide treatment shapefile path (.shp|.zip)
     ######################################################
@@ -233,43 +398,89 @@ def main():
     file_prefix = 'dist_w_ranks_'
     out_shp = os.path.join(output_dir,file_prefix+input_filename+'.shp')
     zipfile_path = out_shp.replace('.shp','.zip')
+    # the zip for the EE upload, or the columnar file
+    out_path = out_shp.replace('.shp', OUTPUT_FORMATS[args.format])
     gcs_outfile = f"{gcs_output_dir}/{file_prefix}{input_filename}.zip"
     ee_asset = f"projects/pyregence-ee/assets/{ee_subdir}/{file_prefix}{input_filename}"
     logger.info(f"input filename: {input_filename}")
     logger.info(f"output shpfile: {out_shp}")
-    logger.info(f"zipfile_path: {zipfile_path}")
-    if not os.path.exists(zipfile_path):
-        logger.info(f"Found {len(files)} files, starting DIST shp generation")
-        shp=make_full_dist_shp(files=files, local_treatments_dir=local_treatments_dir, local_zones_file=local_zones_file, year_range=year_range, eff_yr=eff_yr)
-        print(shp.head())
-        # output final shp to local storage
-        logger.info(f'Exporting {out_shp}')
-        shp.to_file(os.path.join(output_dir, out_shp))
-
-        # zip .shp and associated files 
-        list_files  = [os.path.join(output_dir,i) for i in os.listdir(output_dir) if fnmatch(i,f'*{input_filename}*')]
-        logger.info(f"Adding files to .zip archive: {list_files}")
-        with zipfile.ZipFile(zipfile_path, 'w') as zipF:
-            for file in list_files:
-                zipF.write(file,os.path.basename(file),compress_type=zipfile.ZIP_DEFLATED) # this is kind of funky, can't figure out how to get rel file path not whole directory to be added into archive file
-        
-        # upload .zip to cloud storage
-        gsutil_upload_cmd = f"gcloud alpha storage cp {zipfile_path} {gcs_outfile}"
-        logger.info(gsutil_upload_cmd)
-        proc = subprocess.run(gsutil_upload_cmd, shell=True,stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        if proc.returncode != 0:
-            logger.info(proc.stdout)
-            raise Exception('gcloud alpha storage upload failed, ensure folder exsists on GS bucket')
-            
-        # upload .zip to Earth Engine
-        ee_upload_cmd = f"earthengine upload table --asset_id={ee_asset} {gcs_outfile}"
-        logger.info(f"{ee_upload_cmd}\n")
-        proc = subprocess.run(ee_upload_cmd, shell=True,stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        if proc.returncode != 0:
-            logger.info(proc.stdout)
-            raise Exception('earthengine upload cmd failed')
+    logger.info(f"output path: {out_path}")
+
+    # the output is keyed by everything it is built from, an unchanged key means there is nothing to redo
+    # loading the crosswalk here also refreshes its cache, so write_full_dist_shp reads it offline
+    lookup_table = load_crosswalk(xwalk_cache_dir, offline=args.offline)
+    provenance = {
+        "stage": "create_treatments_custom",
+        "code": code_version(__file__),
+        "treatments": {os.path.basename(file): shapefile_hash(file) for file in files},
+        "zones": file_hash(local_zones_file),
+        "crosswalk": table_hash(lookup_table),
+        "params": {"year_range": year_range, "eff_yr": eff_yr},
+    }
+    if simplify is not None:
+        provenance["params"]["simplify"] = simplify
+    if args.resolve_overlaps:
+        provenance["params"]["resolve_overlaps"] = True
+    key = provenance_key(provenance)
+    if up_to_date(out_path, key) and not args.force:
+        logger.info(f"{out_path} is up to date ({key}), skipping")
+        return
+
+    # drop the stale output so a failure part way leaves nothing that looks complete
+    for path in (out_path, provenance_path(out_path)):
+        if os.path.exists(path):
+            logger.info(f"removing stale {path}")
+            os.remove(path)
+
+    logger.info(f"Found {len(files)} files, starting DIST shp generation")
+    if args.format != "shp" or args.resolve_overlaps:
+        shp = make_full_dist_shp(files=files, local_treatments_dir=local_treatments_dir, local_zones_file=local_zones_file, year_range=year_range, eff_yr=eff_yr, workers=args.workers, xwalk_cache_dir=xwalk_cache_dir, offline=True, batch_size=args.batch_size, simplify=simplify)
+        if args.resolve_overlaps:
+            # overlaps span batches and files, so they are resolved over the whole output
+            shp = resolve_overlaps(shp)
+
+    if args.format != "shp":
+        # one write of the columnar file, the local rasterizer reads it as is so there is nothing to zip or upload
+        logger.info(f'Exporting {out_path}')
+        write_columnar(shp, out_path)
+        write_provenance(out_path, key, provenance)
+        return
+
+    # output final shp to local storage, streamed batch by batch unless the overlaps were resolved in memory
+    logger.info(f'Exporting {out_shp}')
+    if args.resolve_overlaps:
+        shp.to_file(out_shp)
     else:
-        raise Exception(f'{zipfile_path} already exists')
+        write_full_dist_shp(out_shp, files=files, local_zones_file=local_zones_file, year_range=year_range, eff_yr=eff_yr, workers=args.workers, xwalk_cache_dir=xwalk_cache_dir, offline=True, batch_size=args.batch_size, simplify=simplify)
+
+    # zip .shp and associated files, not the columnar outputs or provenance sidecars sharing the name
+    list_files = [out_shp.replace('.shp', ext) for ext in SHAPEFILE_PARTS if os.path.exists(out_shp.replace('.shp', ext))]
+    logger.info(f"Adding files to .zip archive: {list_files}")
+    with zipfile.ZipFile(zipfile_path, 'w') as zipF:
+        for file in list_files:
+            zipF.write(file,os.path.basename(file),compress_type=zipfile.ZIP_DEFLATED) # this is kind of funky, can't figure out how to get rel file path not whole directory to be added into archive file
+    
+    # upload .zip to cloud storage
+    gsutil_upload_cmd = f"gcloud alpha storage cp {zipfile_path} {gcs_outfile}"
+    logger.info(gsutil_upload_cmd)
+    proc = subprocess.run(gsutil_upload_cmd, shell=True,stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        logger.info(proc.stdout)
+        raise Exception('gcloud alpha storage upload failed, ensure folder exsists on GS bucket')
+        
+    # an asset can not be uploaded over, remove the stale one (fails harmlessly when there is none)
+    subprocess.run(f"earthengine rm {ee_asset}", shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    # upload .zip to Earth Engine, tagged with the content key
+    ee_upload_cmd = f"earthengine upload table --asset_id={ee_asset} -p '(string)optx_key={key}' {gcs_outfile}"
+    logger.info(f"{ee_upload_cmd}\n")
+    proc = subprocess.run(ee_upload_cmd, shell=True,stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        logger.info(proc.stdout)
+        raise Exception('earthengine upload cmd failed')
+
+    # written last, only a complete run marks the output up to date
+    write_provenance(zipfile_path, key, provenance)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
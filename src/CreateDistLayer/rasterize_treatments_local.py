@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import yaml
+import argparse
+import logging
+import rasterio
+import geopandas as gpd
+from rasterio.warp import transform_bounds
+from rasterio.windows import bounds as window_bounds
+from rasterio.transform import Affine
+# the grid tiling engine is shared with the local fuels backend, both utils folders make up the utils namespace
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CreateEEFuels"))
+
+from utils.dist_output import read_dist_w_ranks
+from utils.local_rasterize import rasterize_ranks
+from utils.tile_engine import grid_window
+
+'''
+Rasterize a local dist_w_ranks file (shp|zip|fgb|parquet) onto the config grid, keeping the max rank where treatments overlap
+Local replacement of rasterize_treatments_ee_custom.py, no GCS upload / EE table ingest needed
+With an aoi only the polygons over it are read, through the spatial index of the FlatGeobuf/GeoParquet outputs
+
+Usage: python rasterize_treatments_local.py -c path/to/config.yml -i path/to/dist_w_ranks.fgb -o path/to/DIST.tif -r DIST -a path/to/aoi.tif
+
+'''
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=os.path.join(os.path.dirname(__file__),'rasterize_treatments_local.log')
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.getLogger("utils.local_rasterize").setLevel(logging.INFO)
+
+
+def aoi_bounds(aoi_path:str, crs:str) -> tuple:
+    """Function to get the bounds of a local template raster or aoi vector file in the config crs"""
+    if aoi_path.lower().endswith(('.tif', '.tiff')):
+        with rasterio.open(aoi_path) as src:
+            return transform_bounds(src.crs, crs, *src.bounds)
+    return tuple(gpd.read_file(aoi_path).to_crs(crs).total_bounds)
+
+
+def main():
+    """rasterize local dist FC on ranks or DIST property"""
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="rasterize local dist FC on ranks or DIST property"
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        help="local path to dist w ranks file (shp|zip|fgb|parquet)"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="local output GeoTIFF path"
+    )
+
+    parser.add_argument(
+        "-r",
+        "--rasterize_on",
+        type=str,
+        default="DIST",
+        help="property to rasterize on, one of DIST or ranks. default = DIST"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="local path to an aoi vector file or template raster with desired boundaries, default = extent of the treatments"
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes. default = number of cores"
+    )
+
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=4096,
+        help="tile edge in pixels. default = 4096"
+    )
+    args = parser.parse_args()
+
+    # parse config file
+    with open(args.config) as file:
+        config = yaml.full_load(file)
+
+    geo_info = config["geo"]
+    crs = geo_info["crs"]
+
+    start = time.time()
+    bounds = None if args.aoi is None else aoi_bounds(args.aoi, crs)
+    read_bounds = None
+    if bounds is not None:
+        # polygons over the snapped grid window, with a pixel of margin for the reprojection of its bounds
+        transform = Affine(*geo_info["crsTransform"])
+        window = grid_window(geo_info, bounds)
+        read_bounds = window_bounds(window, transform)
+        pad = abs(transform.a)
+        read_bounds = (read_bounds[0] - pad, read_bounds[1] - pad, read_bounds[2] + pad, read_bounds[3] + pad)
+    dist_w_ranks = read_dist_w_ranks(args.input, read_bounds, crs).to_crs(crs)
+    # records without a rank (DIST codes missing from the ranks lookup) are skipped by reduceToImage too
+    dist_w_ranks = dist_w_ranks[dist_w_ranks['ranks'].notna() & ~dist_w_ranks.geometry.is_empty]
+    logger.info(f'{dist_w_ranks.shape[0]} ranked records in {args.input}')
+
+    rasterize_ranks(
+        dist_w_ranks.geometry.values,
+        dist_w_ranks['ranks'].astype(int).values,
+        geo_info,
+        args.output,
+        rasterize_on=args.rasterize_on,
+        bounds=bounds,
+        tile_size=args.tile_size,
+        workers=args.workers,
+    )
+    logger.info(f'Exported {args.output}')
+    logger.info(f'Time Elapsed: {(time.time()-start):.1f} seconds')
+
+if __name__ =="__main__":
+    main()
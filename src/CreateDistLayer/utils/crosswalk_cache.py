@@ -0,0 +1,124 @@
+"""
+Script for defining functions to keep a local, revision-aware cache of the treatment crosswalk google sheet
+The worksheet is stored as a csv with a json sidecar holding the sheet id, the sheet revision (Drive modifiedTime)
+and the column dtypes, so it reads back with the same types get_all_records gave.
+A run only re-downloads the worksheet when the sheet id or revision changed; offline runs never touch the network.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# going back and forth whether to use PNF LUT that we made for pc448 or the FireFactor "super sheet"
+XWALK_SHEET = "PNF treatment dist assignments"  # pc448 sheet
+XWALK_WORKSHEET = "DIST code"  # pc448 sheet
+# XWALK_SHEET = "Fuels-Treatments Crosswalk"  # The FF super sheet
+# XWALK_WORKSHEET = "Lookup"  # The FF super sheet
+
+
+def cache_paths(cache_dir: str, sheet: str, worksheet: str) -> tuple:
+    """Helper function to get the (csv, json) cache file paths of a worksheet"""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{sheet}__{worksheet}").strip("_")
+    base = os.path.join(cache_dir, slug)
+    return f"{base}.csv", f"{base}.json"
+
+
+def read_cache(cache_dir: str, sheet: str, worksheet: str) -> tuple:
+    """Function to read a cached worksheet
+    args:
+        cache_dir (str): folder holding the cache files
+        sheet (str): google sheet title
+        worksheet (str): worksheet title
+    returns:
+        tuple: (pd.DataFrame, meta dict), (None, None) if nothing is cached
+    """
+    csv_path, meta_path = cache_paths(cache_dir, sheet, worksheet)
+    if not (os.path.exists(csv_path) and os.path.exists(meta_path)):
+        return None, None
+    with open(meta_path) as file:
+        meta = json.load(file)
+    # text columns keep empty cells as "" like get_all_records does
+    table = pd.read_csv(csv_path, dtype=meta["dtypes"], keep_default_na=False)
+    return table, meta
+
+
+def write_cache(cache_dir: str, sheet: str, worksheet: str, table: pd.DataFrame, sheet_id: str, revision: str):
+    """Function to write a worksheet to the cache
+    args:
+        cache_dir (str): folder holding the cache files
+        sheet (str): google sheet title
+        worksheet (str): worksheet title
+        table (pd.DataFrame): worksheet records
+        sheet_id (str): google sheet id
+        revision (str): Drive modifiedTime of the sheet when it was read
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    csv_path, meta_path = cache_paths(cache_dir, sheet, worksheet)
+    meta = {
+        "sheet": sheet,
+        "worksheet": worksheet,
+        "sheet_id": sheet_id,
+        "revision": revision,
+        "fetched": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "dtypes": {col: str(dtype) for col, dtype in table.dtypes.items()},
+    }
+    # write the table before the sidecar so a partial write never looks like a valid cache
+    table.to_csv(csv_path, index=False)
+    with open(meta_path, "w") as file:
+        json.dump(meta, file, indent=2)
+
+
+def sheet_revision(spreadsheet) -> str:
+    """Helper function to get the Drive modifiedTime of a gspread Spreadsheet
+    gc.open already fetched it with the file listing, so this is normally free
+    """
+    try:
+        revision = spreadsheet.lastUpdateTime
+    except (AttributeError, KeyError):
+        revision = None
+    return revision or spreadsheet.get_lastUpdateTime()
+
+
+def load_crosswalk(
+    cache_dir: str = None,
+    sheet: str = XWALK_SHEET,
+    worksheet: str = XWALK_WORKSHEET,
+    offline: bool = False,
+) -> pd.DataFrame:
+    """Function to get the treatment crosswalk, from the cache when it is still current
+    args:
+        cache_dir (str): folder holding the cache files, no caching if None
+        sheet (str): google sheet title. default = XWALK_SHEET
+        worksheet (str): worksheet title. default = XWALK_WORKSHEET
+        offline (bool): only use the cache, never call the Sheets/Drive APIs. default = False
+    returns:
+        pd.DataFrame: worksheet records
+    """
+    cached, meta = (None, None) if cache_dir is None else read_cache(cache_dir, sheet, worksheet)
+
+    if offline:
+        if cached is None:
+            raise RuntimeError(f"no cached copy of {sheet}/{worksheet} in {cache_dir}, run once without offline mode")
+        logger.info(f"offline, using cached {sheet}/{worksheet} revision {meta['revision']}")
+        return cached
+
+    # imported here so offline runs work without gspread credentials
+    import gspread
+
+    gc = gspread.service_account()
+    spreadsheet = gc.open(sheet)
+    revision = sheet_revision(spreadsheet)
+    if cached is not None and meta["sheet_id"] == spreadsheet.id and meta["revision"] == revision:
+        logger.info(f"using cached {sheet}/{worksheet} revision {revision}")
+        return cached
+
+    logger.info(f"downloading {sheet}/{worksheet} revision {revision}")
+    table = pd.DataFrame(spreadsheet.worksheet(worksheet).get_all_records())
+    if cache_dir is not None:
+        write_cache(cache_dir, sheet, worksheet, table, spreadsheet.id, revision)
+    return table
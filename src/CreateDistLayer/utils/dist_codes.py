@@ -0,0 +1,27 @@
+"""
+Script for defining the DIST code <-> ranks lookups shared by the treatment scripts
+Ranks order the DIST codes by impact (fire high sev, most recent first = 36) so overlapping
+treatments can be resolved by keeping the max rank
+"""
+
+import numpy as np
+
+# DIST code -> ranks remap dictionary 
+CODE_RANKS = {131:36, 132:35, 133:34, 
+              331:33, 332:32, 333:31, 
+              121:30, 122:29, 123:28,
+              111:27, 112:26, 113:25,
+              321:24, 231:23, 831:22,
+              311:21, 221:20, 821:19,
+              322:18, 211:17, 811:16,
+              312:15, 232:14, 832:13,
+              323:12, 222:11, 822:10,
+              313:9, 212:8, 812:7,
+              233:6, 833:5, 223:4,
+              823:3, 213:2, 813:1}
+
+# ranks -> DIST code lookup array indexed by rank, rank 0 (no treatment) -> DIST 0
+# DIST codes go up to 833 so the lookup is uint16, the ranks themselves fit in uint8
+RANKS_TO_DIST = np.zeros(max(CODE_RANKS.values()) + 1, dtype=np.uint16)
+for code, rank in CODE_RANKS.items():
+    RANKS_TO_DIST[rank] = code
@@ -0,0 +1,66 @@
+"""
+Script for defining functions to write and read the dist_w_ranks polygons in the columnar formats
+FlatGeobuf (.fgb) is written with its packed Hilbert R-tree and GeoParquet (.parquet) with a bbox covering column,
+each in a single write with no zip step. Readers can then pull only the polygons over an AOI from either file,
+and the local rasterizer reads them directly without a GCS upload or EE table ingest
+GeoParquet needs pyarrow, FlatGeobuf only the GDAL that geopandas already reads the shapefiles with
+"""
+
+import os
+import json
+import pyogrio
+import geopandas as gpd
+from pyproj import CRS, Transformer
+
+# --format value -> output file extension, shp is zipped for the EE table upload
+OUTPUT_FORMATS = {"shp": ".zip", "fgb": ".fgb", "parquet": ".parquet"}
+
+# shapefile parts zipped for the EE table upload
+SHAPEFILE_PARTS = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+
+def write_columnar(gdf: gpd.GeoDataFrame, path: str):
+    """Function to write the dist_w_ranks polygons to a FlatGeobuf or GeoParquet file in one pass
+    args:
+        gdf (gpd.GeoDataFrame): dist_w_ranks polygons
+        path (str): output path, the format is taken from the .fgb or .parquet extension
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".fgb":
+        gdf.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    elif ext == ".parquet":
+        # the bbox columns let readers skip the row groups outside their AOI
+        gdf.to_parquet(path, write_covering_bbox=True)
+    else:
+        raise ValueError(f"{path} is not a columnar output. Valid extensions: .fgb, .parquet")
+
+
+def file_crs(path: str) -> CRS:
+    """Helper function to get the crs of a dist_w_ranks file without reading its features"""
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+        column = geo["columns"][geo["primary_column"]]
+        # GeoParquet coordinates are OGC:CRS84 when the crs is left out
+        return CRS.from_json_dict(column["crs"]) if column.get("crs") else CRS("OGC:CRS84")
+    return CRS(pyogrio.read_info(path)["crs"])
+
+
+def read_dist_w_ranks(path: str, bounds: tuple = None, crs: str = None) -> gpd.GeoDataFrame:
+    """Function to read dist_w_ranks polygons from a shapefile (shp|zip), FlatGeobuf or GeoParquet file
+    args:
+        path (str): dist_w_ranks file
+        bounds (tuple): (left, bottom, right, top) in crs, only polygons whose bounding box intersects them are read.
+            default = all polygons
+        crs (str): crs of bounds, e.g. the config crs
+    returns:
+        gpd.GeoDataFrame: polygons in the file's crs
+    """
+    bbox = None
+    if bounds is not None:
+        bbox = Transformer.from_crs(CRS(crs), file_crs(path), always_xy=True).transform_bounds(*bounds, densify_pts=21)
+    # the spatial index (fgb) or bbox covering (parquet) answers the bbox query without scanning every polygon
+    if path.lower().endswith(".parquet"):
+        return gpd.read_parquet(path, bbox=bbox)
+    return gpd.read_file(path, bbox=bbox)
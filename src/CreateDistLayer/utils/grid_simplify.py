@@ -0,0 +1,115 @@
+"""
+Script for defining functions to simplify the dist_w_ranks polygons on the config grid before they are rasterized
+Rasterizing burns the pixels whose center is inside a polygon, so any polygon covering the same pixel centers
+rasterizes the same. Each polygon (in the config crs) is replaced by the one with the fewest vertices of:
+    - the polygon simplified with a tolerance in pixels, vertices snapped to a lattice anchored at the crsTransform
+      origin, kept only if it covers the same pixel centers
+    - the outline of the pixels it covers, on the grid lines of the crsTransform (exact by construction), itself
+      simplified when that still covers the same pixel centers
+    - the polygon itself
+Polygons covering no pixel center (slivers) burn nothing and are dropped. The rasterized output is unchanged while
+detail finer than a pixel, which only costs upload size and rasterization time, is removed
+"""
+
+import logging
+import numpy as np
+import shapely
+from rasterio import features
+from rasterio.transform import Affine
+from rasterio.windows import transform as window_transform
+from utils.tile_engine import grid_window
+
+logger = logging.getLogger(__name__)
+
+# Douglas-Peucker tolerance, in pixels
+DEFAULT_TOLERANCE = 0.5
+
+# vertex lattice step, in pixels. pixel centers sit 1.5 steps off the lattice so no vertex is snapped onto one
+SNAP_STEP = 1 / 3
+
+
+def snap_to_grid(geoms, geo_info: dict, step: float = SNAP_STEP):
+    """Function to snap polygon vertices to a lattice anchored at the crsTransform origin
+    args:
+        geoms (shapely.Geometry | np.ndarray): polygons in the config crs
+        geo_info (dict): geo section of the config file
+        step (float): lattice step in pixels. default = 1/3
+    returns:
+        snapped polygons, valid (collapsed parts are removed)
+    """
+    x_scale, _, x0, _, _, y0 = geo_info["crsTransform"]
+    origin = np.array([x0, y0])
+    # set_precision snaps to multiples of the grid size from 0, so the lattice is moved to the origin and back
+    shifted = shapely.transform(geoms, lambda xy: xy - origin)
+    return shapely.transform(shapely.set_precision(shifted, abs(x_scale) * step), lambda xy: xy + origin)
+
+
+def center_mask(geom, geo_info: dict, bounds: tuple) -> tuple:
+    """Function to get the pixel centers of the config grid a polygon covers, like burn_ranks
+    args:
+        geom (shapely.Geometry): polygon in the config crs
+        geo_info (dict): geo section of the config file
+        bounds (tuple): (left, bottom, right, top) of the pixels to check
+    returns:
+        tuple: (uint8 mask over the grid window of bounds, Affine of the mask), (None, None) if bounds are off the grid
+    """
+    try:
+        window = grid_window(geo_info, bounds)
+    except ValueError:
+        return None, None
+    shape = (int(window.height), int(window.width))
+    transform = window_transform(window, Affine(*geo_info["crsTransform"]))
+    if geom is None or geom.is_empty:
+        return np.zeros(shape, dtype=np.uint8), transform
+    return features.rasterize([(geom, 1)], out_shape=shape, transform=transform, fill=0, dtype="uint8"), transform
+
+
+def pixel_outline(mask: np.ndarray, transform: Affine):
+    """Function to get the outline of the pixels of a mask, it covers exactly their centers
+    returns:
+        shapely.Geometry: polygon or multipolygon with vertices on the pixel corners
+    """
+    parts = [shapely.geometry.shape(geom) for geom, _ in features.shapes(mask, mask=mask.astype(bool), transform=transform)]
+    return parts[0] if len(parts) == 1 else shapely.MultiPolygon(parts)
+
+
+def simplify_to_grid(geoms: np.ndarray, geo_info: dict, tolerance: float = DEFAULT_TOLERANCE) -> tuple:
+    """Function to simplify polygons in the config crs without changing the pixels they rasterize to
+    pixels off the config grid are never rasterized, so only the centers on the grid are kept
+    args:
+        geoms (np.ndarray): polygons in the config crs
+        geo_info (dict): geo section of the config file
+        tolerance (float): simplification tolerance in pixels. default = 0.5
+    returns:
+        tuple: (np.ndarray of polygons with None for the dropped slivers, {outcome: number of polygons})
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    tolerance = tolerance * abs(geo_info["crsTransform"][0])
+    simplified = snap_to_grid(shapely.simplify(geoms, tolerance, preserve_topology=True), geo_info)
+    # simplified vertices are original ones moved by less than a snap step, a pixel of margin covers them
+    pad = abs(geo_info["crsTransform"][0])
+    bounds = shapely.bounds(geoms) + np.array([-pad, -pad, pad, pad])
+
+    out = np.empty(len(geoms), dtype=object)
+    counts = {"simplified": 0, "outline": 0, "original": 0, "dropped": 0}
+    for i, geom in enumerate(geoms):
+        reference, transform = (None, None) if geom is None or geom.is_empty else center_mask(geom, geo_info, tuple(bounds[i]))
+        if reference is None or not reference.any():
+            counts["dropped"] += 1
+            continue
+
+        def covers_same(candidate):
+            return np.array_equal(center_mask(candidate, geo_info, tuple(bounds[i]))[0], reference)
+
+        outline = pixel_outline(reference, transform)
+        simplified_outline = shapely.simplify(outline, tolerance, preserve_topology=True)
+        candidates = {}
+        if covers_same(simplified[i]):
+            candidates["simplified"] = simplified[i]
+        candidates["outline"] = simplified_outline if covers_same(simplified_outline) else outline
+        candidates["original"] = geom
+        # fewest vertices wins, ties go to the first candidate
+        outcome = min(candidates, key=lambda name: shapely.get_num_coordinates(candidates[name]))
+        out[i] = candidates[outcome]
+        counts[outcome] += 1
+    return out, counts
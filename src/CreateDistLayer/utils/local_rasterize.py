@@ -0,0 +1,126 @@
+"""
+Script for defining functions to rasterize the dist_w_ranks polygons locally onto the config geo grid
+Local replacement of FeatureCollection.reduceToImage(['ranks'], ee.Reducer.max()) followed by ranks_to_dist:
+polygons are burned in ascending rank order so the max rank wins where treatments overlap,
+then ranks are turned into DIST codes with the RANKS_TO_DIST lookup array.
+The grid is processed in tiles aligned to the grid origin on a process pool (CreateEEFuels/utils/tile_engine.py),
+each tile only burns the polygons its spatial index query returns, so no full extent array or mask is ever built.
+"""
+
+import logging
+import functools
+import numpy as np
+import rasterio
+from rasterio import features
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from shapely import STRtree, box, total_bounds
+from utils.dist_codes import RANKS_TO_DIST
+from utils.tile_engine import BLOCK_SIZE, grid_window, grid_tiles, window_profile, open_output, run_tiles
+
+logger = logging.getLogger(__name__)
+
+# polygons, ranks and spatial index of a worker process, set once by init_worker
+_worker_inputs = {}
+
+
+def burn_ranks(geoms: list, ranks: np.ndarray, transform: Affine, shape: tuple) -> np.ndarray:
+    """Function to burn polygons into a ranks array keeping the max rank where they overlap
+    pixels are burned when their center is inside a polygon, same as reduceToImage
+    args:
+        geoms (list): shapely polygons in the grid crs
+        ranks (np.ndarray): rank of each polygon, 1-36
+        transform (Affine): transform of the output array
+        shape (tuple): (rows, cols) of the output array
+    returns:
+        np.ndarray: uint8 ranks array, 0 where no polygon
+    """
+    if len(geoms) == 0:
+        return np.zeros(shape, dtype=np.uint8)
+    # later shapes overwrite earlier ones, so burning in ascending rank order leaves the max
+    order = np.argsort(ranks, kind="stable")
+    return features.rasterize(
+        ((geoms[i], int(ranks[i])) for i in order),
+        out_shape=shape,
+        transform=transform,
+        fill=0,
+        dtype="uint8",
+    )
+
+
+def init_worker(geoms: np.ndarray, ranks: np.ndarray, geo_info: dict):
+    """Function to hand the polygons to a worker process once and build its spatial index"""
+    _worker_inputs["geoms"] = geoms
+    _worker_inputs["ranks"] = ranks
+    _worker_inputs["tree"] = STRtree(geoms)
+    _worker_inputs["transform"] = Affine(*geo_info["crsTransform"])
+
+
+def rasterize_tile(tile: Window, rasterize_on: str = "DIST") -> dict:
+    """Function to burn the ranks of one grid tile with the worker's polygons, a tile_engine.run_tiles kernel
+    args:
+        tile (Window): tile in config grid pixel coordinates
+        rasterize_on (str): output values, one of DIST or ranks. default = DIST
+    returns:
+        dict: {rasterize_on: [2D array]}, empty if no polygon touches the tile
+    """
+    transform = rasterio.windows.transform(tile, _worker_inputs["transform"])
+    bounds = rasterio.windows.bounds(tile, _worker_inputs["transform"])
+    idx = _worker_inputs["tree"].query(box(*bounds))
+    if idx.size == 0:
+        return {}
+    shape = (int(tile.height), int(tile.width))
+    tile_ranks = burn_ranks(list(_worker_inputs["geoms"][idx]), _worker_inputs["ranks"][idx], transform, shape)
+    return {rasterize_on: [RANKS_TO_DIST[tile_ranks] if rasterize_on == "DIST" else tile_ranks]}
+
+
+def rasterize_ranks(
+    geoms: np.ndarray,
+    ranks: np.ndarray,
+    geo_info: dict,
+    out_path: str,
+    rasterize_on: str = "DIST",
+    bounds: tuple = None,
+    tile_size: int = 4096,
+    workers: int = 1,
+) -> Window:
+    """Function to rasterize ranked polygons onto the config grid as a ranks or DIST GeoTIFF
+    args:
+        geoms (np.ndarray): shapely polygons in the config crs
+        ranks (np.ndarray): rank of each polygon, 1-36
+        geo_info (dict): geo section of the config file
+        out_path (str): local output GeoTIFF path
+        rasterize_on (str): output values, one of DIST or ranks. default = DIST
+        bounds (tuple): (left, bottom, right, top) of the output in the config crs. default = polygon extent
+        tile_size (int): tile edge in pixels, rounded down to a multiple of BLOCK_SIZE. default = 4096
+        workers (int): number of worker processes, 1 runs in process. default = 1
+    returns:
+        Window: grid window the output covers
+    """
+    if rasterize_on not in ["DIST", "ranks"]:
+        raise ValueError(f"{rasterize_on} is not a valid property to rasterize on. Valid properties: ranks, DIST ")
+
+    if bounds is None:
+        bounds = tuple(total_bounds(geoms))
+    extent = grid_window(geo_info, bounds)
+    tile_size = max(tile_size // BLOCK_SIZE, 1) * BLOCK_SIZE
+    tiles = grid_tiles(extent, tile_size)
+    logger.info(f"rasterizing {len(geoms)} polygons over {int(extent.width)} x {int(extent.height)} px in {len(tiles)} tiles")
+
+    dtype = "uint16" if rasterize_on == "DIST" else "uint8"
+    dst = open_output(out_path, window_profile(geo_info, extent), [rasterize_on], dtype, 0)
+    try:
+        # tiles without polygons are left unwritten, GDAL fills them with nodata (0)
+        # run_tiles keeps at most 2 tiles per worker in flight, so finished tiles never pile up in memory
+        run_tiles(
+            functools.partial(rasterize_tile, rasterize_on=rasterize_on),
+            tiles,
+            {rasterize_on: dst},
+            extent,
+            min(workers, len(tiles)),
+            init_worker,
+            (np.asarray(geoms), np.asarray(ranks), geo_info),
+        )
+    finally:
+        dst.close()
+    return extent
@@ -0,0 +1,83 @@
+"""
+Script for defining functions to memoize the local outputs of the DIST layer scripts by content
+An output is keyed by a hash of what it is computed from (input file hashes, crosswalk content, parameters and the
+code of the script). The key and that provenance are kept in a json sidecar next to the output, so a rerun skips an
+output whose key is unchanged and rebuilds it otherwise.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import pandas as pd
+
+# modules of the CreateEEFuels utils the scripts import (grid tiling), relative to the script folder
+SHARED_UTILS = [os.path.join("..", "CreateEEFuels", "utils", "tile_engine.py")]
+
+
+def file_hash(path: str) -> str:
+    """Helper function to get the sha256 of a file"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def shapefile_hash(path: str) -> str:
+    """Helper function to get the sha256 of a treatment file, .shp files are hashed with their sidecar files"""
+    if not path.endswith(".shp"):
+        return file_hash(path)
+    base = os.path.splitext(path)[0]
+    sha = hashlib.sha256()
+    for part in sorted(glob.glob(f"{glob.escape(base)}.*")):
+        sha.update(f"{os.path.splitext(part)[1]}:{file_hash(part)}\n".encode())
+    return sha.hexdigest()
+
+
+def table_hash(table: pd.DataFrame) -> str:
+    """Helper function to get the sha256 of the content of a table, e.g. the treatment crosswalk"""
+    return hashlib.sha256(table.to_csv(index=False).encode()).hexdigest()
+
+
+def code_version(script_path: str) -> str:
+    """Function to hash the code of a script, the script, every utils module next to it and the SHARED_UTILS
+    args:
+        script_path (str): path of the script, i.e. __file__
+    returns:
+        str: sha256 of the source files
+    """
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    paths = [os.path.abspath(script_path)] + sorted(glob.glob(os.path.join(script_dir, "utils", "*.py")))
+    paths += [os.path.normpath(os.path.join(script_dir, path)) for path in SHARED_UTILS]
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.relpath(path, script_dir).encode())
+        sha.update(file_hash(path).encode())
+    return sha.hexdigest()
+
+
+def provenance_key(provenance: dict) -> str:
+    """Function to get the content key of a provenance dict"""
+    content = json.dumps(provenance, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def provenance_path(output_path: str) -> str:
+    """Helper function to get the sidecar file of an output"""
+    return f"{os.path.splitext(output_path)[0]}.provenance.json"
+
+
+def up_to_date(output_path: str, key: str) -> bool:
+    """Function to check whether an output exists and was built with the key"""
+    sidecar = provenance_path(output_path)
+    if not (os.path.exists(output_path) and os.path.exists(sidecar)):
+        return False
+    with open(sidecar) as file:
+        return json.load(file).get("key") == key
+
+
+def write_provenance(output_path: str, key: str, provenance: dict):
+    """Function to write the sidecar of an output once it is complete"""
+    with open(provenance_path(output_path), "w") as file:
+        json.dump({"key": key, "provenance": provenance}, file, indent=2, sort_keys=True, default=str)
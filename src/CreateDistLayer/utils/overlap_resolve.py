@@ -0,0 +1,70 @@
+"""
+Script for defining functions to resolve overlapping dist_w_ranks polygons by rank in vector space
+Vector counterpart of reduceToImage(['ranks'], ee.Reducer.max()): the polygons of each rank are dissolved (ranks map
+one to one to DIST codes, so adjacent polygons sharing a DIST code merge) and each part keeps only what no higher
+ranked part covers. The output polygons do not overlap, so rasterizing them is a plain paint with no max reduction,
+and there are fewer of them to upload and rasterize
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+logger = logging.getLogger(__name__)
+
+# columns that are the same for every polygon of a rank, the others (TREATMENT, YEAR, ZONE_NUM, ...) are dissolved away
+RANK_COLS = ["TYPE_SEV", "TYPE_SEV_0", "TSD", "DIST", "ranks"]
+
+
+def _polygon_parts(geom) -> np.ndarray:
+    """Helper function to split a geometry into its polygons, dropping the lines and points a difference can leave"""
+    parts = shapely.get_parts(geom)
+    return parts[(shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)]
+
+
+def resolve_overlaps(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Function to turn ranked polygons into non overlapping ones, the highest rank wins where they overlap
+    args:
+        gdf (gpd.GeoDataFrame): polygons with the RANK_COLS columns, e.g. from dist_rank_calculate
+    returns:
+        gpd.GeoDataFrame: one row per polygon with the RANK_COLS columns, highest rank first, in the crs of gdf
+    """
+    ranked = gdf[gdf["ranks"].notna()]
+    if ranked.shape[0] < gdf.shape[0]:
+        # DIST codes missing from the ranks lookup are skipped by reduceToImage too
+        logger.info(f"dropping {gdf.shape[0] - ranked.shape[0]} polygons without a rank")
+    cols = [col for col in RANK_COLS if col in ranked.columns]
+
+    # dissolve each rank and split it into its polygons
+    rows, parts = [], []
+    for _, group in sorted(ranked.groupby("ranks"), key=lambda item: -item[0]):
+        dissolved = _polygon_parts(shapely.union_all(shapely.make_valid(group.geometry.values)))
+        if len(dissolved) == 0:
+            continue
+        parts.append(dissolved)
+        rows.append(pd.DataFrame([group[cols].iloc[0]] * len(dissolved)))
+    if not parts:
+        return gpd.GeoDataFrame(columns=cols, geometry=[], crs=gdf.crs)
+    parts = np.concatenate(parts)
+    attrs = pd.concat(rows, ignore_index=True)
+    part_ranks = attrs["ranks"].values
+
+    # each part loses what the higher ranked parts it intersects cover
+    tree = shapely.STRtree(parts)
+    pieces, piece_rows = [], []
+    for i, part in enumerate(parts):
+        higher = [j for j in tree.query(part, predicate="intersects") if part_ranks[j] > part_ranks[i]]
+        piece = shapely.difference(part, shapely.union_all(parts[higher])) if higher else part
+        piece = _polygon_parts(piece)
+        pieces.append(piece)
+        piece_rows.extend([i] * len(piece))
+
+    resolved = gpd.GeoDataFrame(
+        attrs.iloc[piece_rows].reset_index(drop=True), geometry=np.concatenate(pieces), crs=gdf.crs
+    )
+    for col in cols:
+        resolved[col] = resolved[col].astype(gdf[col].dtype)
+    logger.info(f"resolved {gdf.shape[0]} overlapping polygons into {resolved.shape[0]} non overlapping ones")
+    return resolved
@@ -0,0 +1,75 @@
+"""
+Script for defining functions to stream the records of a treatment file that pass the year and crosswalk filters
+The YEAR range and the crosswalked TREATMENT values are pushed down to OGR as an attribute filter. One pass over
+the filter fields (no geometries) finds the ids of the matching records, which are then read by id in batches,
+so only kept polygons are ever loaded and never more than one batch of them at a time
+"""
+
+import logging
+import numpy as np
+import pyogrio
+import geopandas as gpd
+from pyogrio.raw import read
+
+logger = logging.getLogger(__name__)
+
+# columns every treatment file needs, the only ones read
+REQUIRED_COLS = ["TREATMENT", "YEAR"]
+
+# records read and processed at a time
+DEFAULT_BATCH_SIZE = 50000
+
+
+def _quote(value) -> str:
+    """Helper function to quote a value as an OGR SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def treatment_filter(dtypes: dict, year_range: list, treatments: list = None) -> str:
+    """Function to build the OGR SQL attribute filter of a treatment file
+    args:
+        dtypes (dict): {field name: dtype name} of the file, as in pyogrio.read_info
+        year_range (list): [first year, last year] of treatments to keep
+        treatments (list): TREATMENT values of the crosswalk. default = no TREATMENT filter
+    returns:
+        str: where clause, None if nothing can be pushed down
+    """
+    clauses = []
+    # a text YEAR is filtered after the int cast instead, so invalid values still raise
+    if np.issubdtype(np.dtype(dtypes["YEAR"]), np.number):
+        clauses.append(f"YEAR >= {int(year_range[0])} AND YEAR <= {int(year_range[1])}")
+    if treatments is not None and len(treatments) and dtypes["TREATMENT"] == "object":
+        clauses.append(f"TREATMENT IN ({', '.join(_quote(t) for t in sorted(set(treatments)))})")
+    return " AND ".join(clauses) or None
+
+
+def batch_fids(file_pth: str, year_range: list, treatments: list = None, batch_size: int = DEFAULT_BATCH_SIZE) -> list:
+    """Function to check the schema of a treatment file and split the ids of its matching records into batches
+    args:
+        file_pth (str): path to treatment file (shp|zip)
+        year_range (list): [first year, last year] of treatments to keep
+        treatments (list): TREATMENT values of the crosswalk. default = no TREATMENT filter
+        batch_size (int): records per batch. default = 50000
+    returns:
+        list: np.ndarray of record ids per batch, empty if no record matches
+    """
+    info = pyogrio.read_info(file_pth)
+    dtypes = dict(zip(info["fields"], info["dtypes"]))
+    assert all([col in dtypes for col in REQUIRED_COLS]), f"missing required columns in {file_pth}. Required columns: {REQUIRED_COLS}"
+
+    where = treatment_filter(dtypes, year_range, treatments)
+    # OGR only evaluates the filter on fields that are read, the geometries are skipped
+    _, fids, _, _ = read(file_pth, columns=REQUIRED_COLS, read_geometry=False, where=where, return_fids=True)
+    logger.info(f"total records in {file_pth}: {info['features']}, matching {where}: {len(fids)}")
+    return [fids[i:i + batch_size] for i in range(0, len(fids), batch_size)]
+
+
+def read_batch(file_pth: str, fids: np.ndarray) -> gpd.GeoDataFrame:
+    """Function to read the required columns and geometries of the given records of a treatment file
+    args:
+        file_pth (str): path to treatment file (shp|zip)
+        fids (np.ndarray): record ids, from batch_fids
+    returns:
+        gpd.GeoDataFrame: TREATMENT, YEAR and geometry of the records, in the file's crs
+    """
+    return pyogrio.read_dataframe(file_pth, columns=REQUIRED_COLS, fids=fids)
@@ -0,0 +1,162 @@
+"""
+Script used to fill the local baseline cache (see utils/baseline_cache.py) for an AOI
+Every baseline layer the local scripts read (version 200 LANDFIRE, zones, canopy guide and the baseline fuels
+of each fuels source) is clipped to the AOI window of the config grid and stored as a memory-mappable .npy file.
+Layers come from Earth Engine (computePixels) or, with -i, from a folder of exported GeoTIFFs.
+A layer already cached over the same window at the same source version is skipped, so rerunning is cheap.
+The cache folder can then be passed as the inputs folder (-i) of calc_fuelscape_local.py and calc_FM40_local.py
+Usage:
+    $ python cache_baselines.py -c path/to/config -a path/to/dist.tif -o path/to/cache -f firefactor pyrologix
+"""
+import os
+import time
+import argparse
+import logging
+from utils.yml_params import load_config
+from utils.local_inputs import LANDFIRE_INPUTS, BASELINE_INPUTS, FUELS_SOURCES, input_path, file_version
+from utils.baseline_cache import cached_version, cache_layer, ee_layer, fetch_ee_layer
+from utils.raster_io import read_window, window_bounds
+from utils.tile_engine import grid_window, tile_bounds
+from utils.ee_session import initialize
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'cache_baselines.log')
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=LOG_FILE
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def main(argv: list = None):
+    """Main level function for filling the local baseline cache"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for caching the baseline layers of an AOI for the local backend."
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="GeoTIFF whose extent is the AOI, e.g. the DIST GeoTIFF"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--cache_dir",
+        type=str,
+        help="cache folder, created if it does not exist"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fuels_sources",
+        type=str,
+        nargs="+",
+        default=FUELS_SOURCES,
+        help="sources of baseline fuels datasets to cache. default = firefactor pyrologix"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--inputs_dir",
+        type=str,
+        help="optional folder of exported GeoTIFFs (named as in utils/local_inputs.py) to cache instead of Earth Engine"
+    )
+
+    parser.add_argument(
+        "--layers",
+        type=str,
+        nargs="+",
+        help="only cache these layers (keys of utils/local_inputs.py). default = all"
+    )
+
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=2048,
+        help="edge in pixels of each computePixels request. default = 2048"
+    )
+
+    parser.add_argument(
+        "--full_grid",
+        action="store_true",
+        help="cache the whole config grid instead of the AOI extent"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="fetch every layer again even if it is cached at the current version"
+    )
+
+    args = parser.parse_args(argv)
+
+    for fuels_source in args.fuels_sources:
+        if fuels_source not in FUELS_SOURCES:
+            raise ValueError(f"{fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+
+    # parse config file
+    config = load_config(args.config)
+    geo_info = config["geo"]
+
+    start = time.time()
+
+    # the AOI snapped outward to the config grid, every layer is cached over this same window
+    window = grid_window(geo_info, None if args.full_grid else window_bounds(args.aoi)[0])
+    bounds = tile_bounds(geo_info, window)
+    logger.info(f"caching {int(window.width)} x {int(window.height)} px at {window} into {args.cache_dir}")
+
+    # (name, fuels source) of every layer to cache, the LANDFIRE layers do not depend on the fuels source
+    layers = [(name, None) for name in LANDFIRE_INPUTS]
+    layers += [(name, fuels_source) for fuels_source in args.fuels_sources for name in BASELINE_INPUTS]
+    if args.layers:
+        layers = [(name, fuels_source) for name, fuels_source in layers if name in args.layers]
+
+    if args.inputs_dir is None:
+        import ee
+
+        initialize()
+
+    for name, fuels_source in layers:
+        label = name if fuels_source is None else f"{name} ({fuels_source})"
+        if args.inputs_dir is None:
+            image, source = ee_layer(name, fuels_source)
+            version = ee.data.getAsset(source)["updateTime"]
+        else:
+            source = input_path(args.inputs_dir, name, fuels_source)
+            version = file_version(source)
+
+        if not args.force and cached_version(args.cache_dir, name, source, window, fuels_source) == version:
+            logger.info(f"{label} is cached at {version}, skipping")
+            continue
+
+        layer_start = time.time()
+        if args.inputs_dir is None:
+            array = fetch_ee_layer(image, geo_info, window, args.chunk_size)
+        else:
+            array = read_window(source, bounds)
+        cache_layer(args.cache_dir, name, array, geo_info, window, source, version, fuels_source)
+        logger.info(f"cached {label} from {source} ({array.dtype}, {array.nbytes / 1e6:.1f} MB) in {(time.time() - layer_start):.1f} seconds")
+
+    logger.info(f"Time Elapsed: {(time.time() - start):.1f} seconds")
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
@@ -6,27 +6,30 @@ Usage:
 """
 import os 
 import ee
-import math
-import yaml
 import argparse
 import logging
+from utils.yml_params import load_config
 from utils.ee_csv_parser import parse_txt, to_numeric
-
+from utils.table_bundle import load_bundle, disturbance_lookup
+from utils.stage_assets import read_canopy_guide, canopy_guide_source
+from utils.fuel_graph import disturbance_encoding, cbh_image, cbd_image
+from utils.aoi import export_region
+from utils.stage_cache import stage_provenance, output_key, up_to_date, with_provenance
+from utils.stage_scheduler import stage_report, print_report
+from utils.ee_session import initialize
+from utils.tracing import init_tracing, span, traced, current_span
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__),'calc_CBH_CBD.log')
 logging.basicConfig(
     format="%(asctime)s %(message)s",
     datefmt="%Y-%m-%d %I:%M:%S %p",
     level=logging.WARNING,
-    filename=os.path.join(os.path.dirname(__file__),'calc_CBH_CBD.log')
+    filename=LOG_FILE
 )
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-try:
-    credentials = ee.ServiceAccountCredentials(email=None,key_file='/home/private-key.json')
-    ee.Initialize(credentials)
-except:
-    ee.Initialize()
-
 def encode_table(table):
     """Function to take dictionary representation of CSV and
     encode the DIST and EVT values into a unique code
@@ -74,8 +77,12 @@ def encode_table(table):
 
     return encoded
 
-def main():
+@traced("calc_CBD_CBH")
+def main(argv: list = None):
     """Main level function for generating new CBH and CBD"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
     
     # initalize new cli parser
     parser = argparse.ArgumentParser(
@@ -111,14 +118,43 @@ def main():
         help="source of baseline fuels dataset. One of: firefactor, pyrologix"
     
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-t",
+        "--tables_bundle",
+        type=str,
+        help="optional local path of a table bundle from compile_tables.py, used instead of parsing the csv tables on cloud storage"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="optional Earth Engine asset path of a template image or feature collection to bound the computation/export, default = DIST image footprint"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="export every output again, even the ones whose content key shows they are up to date"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the stage and sub-step timing spans are appended to, default = OPTX_TRACE environment variable"
+    )
+    args = parser.parse_args(argv)
+    # authenticates on the first stage of the process only
+    initialize()
 
     dist_img_path = args.dist_img_path
     out_folder_path = args.out_folder_path
 
+    init_tracing(args.trace)
+    current_span().set(scenario=os.path.basename(dist_img_path), fuels_source=args.fuels_source)
+
     # parse config file
-    with open(args.config) as file:
-        config = yaml.full_load(file)
+    config = load_config(args.config)
 
     geo_info = config["geo"]
     #version = config["version"].get('latest')
@@ -135,6 +171,13 @@ def main():
     base_uri = "gs://landfire/LFTFCT_tables/{0}_Disturbance_Tbl.csv"
     base_uri2 = "gs://landfire/LFTFCT_tables/{0}_Disturbance_Tbl_filled.csv"
 
+    # compiled bundle holds the sorted DIST/EVT keys and coefficients of the disturbance tables
+    bundle = None
+    if args.tables_bundle is not None:
+        with span("load_tables", source="bundle"):
+            bundle = load_bundle(args.tables_bundle)
+            logger.info(f"using table bundle {bundle['content_hash']}")
+
     # define the image collections for the raster data needed for calculations
     evt_ic = ee.ImageCollection("projects/pyregence-ee/assets/conus/landfire/fvt")
     fvc_mid_ic = ee.ImageCollection("projects/pyregence-ee/assets/conus/fuels/Midpoint_CC")
@@ -182,184 +225,149 @@ def main():
     dist_img = ee.Image(
         f"{dist_img_path}"
     )
+    # grid-snapped bounding rectangle of the AOI (or DIST footprint) every export is limited to
+    with span("export_region", aoi=args.aoi):
+        region = export_region(args.aoi, dist_img, geo_t, crs)
 
     # to mask regression outputs for post-processing
     dist_mask = dist_img.mask() # this creates 1's everywhere include outside disturbed areas. not using
 
-    #canopy guide collection for post-processing ruleset
-    # create cg collection path from the dist_img_path
-    cg_path = f"{out_folder_path}/canopy_guide_collection"    
-    canopy_guide = ee.ImageCollection(f"{cg_path}").select('newCanopy').mosaic()
+    #canopy guide for post-processing ruleset
+    # merged canopy guide image if create_canopy_guide was run with --merge_zones, else mosaic of the zone collection
+    with span("read_canopy_guide"):
+        canopy_guide = read_canopy_guide(out_folder_path)
     
     # Here we are using the newly generated CC and CH as the midpoint images instead of FVH/C_Midpoint images
     # CC and CH are already binned to midpoint values during their calculation, only need to divide CH by 10 to get unscaled midpoint
     # Post-Disturbance Cover midpoint 
     post_cover_mid_img = ee.Image(f"{out_folder_path}/CC")
 
-    # Post-Disturbance Height midpoint 
+    # Post-Disturbance Height (x10), fuel_graph divides it by 10 for the midpoint
     new_ch = ee.Image(f"{out_folder_path}/CH")
-    post_height_mid_img = new_ch.divide(10)
+
+    # content key of every output, outputs already exported with the same key are skipped on reruns
+    with span("provenance"):
+        provenance = stage_provenance(
+            "calc_CBD_CBH",
+            __file__,
+            {
+                "dist": dist_img,
+                "evt": evt_img,
+                "cc_baseline": cc_img,
+                "cbh_baseline": cbh_img,
+                "cbd_baseline": cbd_img,
+                "zones": zone_img,
+                "canopy_guide": canopy_guide_source(out_folder_path),
+                "cc": post_cover_mid_img,
+                "ch": new_ch,
+            },
+            region,
+            tables=bundle["content_hash"] if bundle is not None else base_uri2,
+            grid=geo_info,
+            fuels_source=args.fuels_source,
+        )
     
     # encode the images into unique codes
     # code will be a 7 digit value where each group of values
     # are the individual values from the images
-    encoded_img = dist_img.expression(
-        "a*as + b*bs",
-        {
-            "a": dist_img,
-            "as": 1e4,
-            "b": evt_img,
-            "bs": 1e0,
-        },
-    )
+    encoded_img = disturbance_encoding(dist_img, evt_img)
 
     # CBH #######################################################################################
     # define the collection to dump data to
     # each output will be an individual image so can be folder
     output_folder = out_folder_path
+    task_ids, skipped = [], []
 
-    uri = base_uri2.format("CBH")
-    
-    # read in the table from cloud storage
-    blob = ee.Blob(uri)
-
-    # parse the table as an ee.Dictionary
-    table = parse_txt(blob)
-
-    # apply encoding process to table (in-memory)
-    from_codes = ee.List(encode_table(table))
-
-    # extract out the individual coefficients for the EVT/DIST combinations
-    intercept_codes = to_numeric(ee.List(table.get("intercept")))
-    hgt_scale_codes = to_numeric(ee.List(table.get("HT_coef")))
-    cc_scale_codes = to_numeric(ee.List(table.get("CC_coef")))
-
-    # apply remapping process to get images of coefficients for regression
-    intercept = encoded_img.remap(from_codes, intercept_codes)
-    hgt_scale = encoded_img.remap(from_codes, hgt_scale_codes)
-    cc_scale = encoded_img.remap(from_codes, cc_scale_codes)
-
-    # apply the regression equation for the variable
-    # and fill in areas not disturbed with original variable image
-    cbh = (
-        intercept.expression(
-            "b+(m1*x1)+(m2*x2)",
-            {
-                "b": intercept,
-                "m1": hgt_scale,
-                "x1": post_height_mid_img,
-                "m2": cc_scale,
-                "x2": post_cover_mid_img,
-            }
-        )
-        .updateMask(dist_img)
-        .multiply(10) #scale decimal regress output
-        .toInt16()
-        .clamp(0,100)
-        .where(canopy_guide.eq(0), 0) # 0 where CG is 0
-        .where(canopy_guide.eq(2), 100) # 100 (10m) where CG is 2
-        .where(cc_img.eq(0), 0) # 0 where CG is 0
-        .rename('CBH')
-        )
-    cbh = cbh.where(cbh.gt(new_ch), new_ch.multiply(0.7).toInt16()).rename('CBH') # CBH can't be larger than CH; where it is, reduce CBH to 2/3 of CH
-    cbh = (cbh.unmask(cbh_img) # fill un-disturbed pixels with baseline fuel value
-        .updateMask(zone_img) # cleans up CONUS-wide boundaries
-        )
-
-    # define where to export image
     output_asset = f"{output_folder}/CBH"
-
-    # set up export task
-    # export has specific CONUS projection/spatial extent
-    task = ee.batch.Export.image.toAsset(
-        image=cbh,
-        description=f"export_CBH_{os.path.basename(dist_img_path)}",
-        assetId=output_asset,
-        region=cc_img.geometry(),
-        crsTransform=geo_t,
-        crs=crs,
-        maxPixels=1e12,
-    )
-    task.start()  # kick of export task
-    logger.info(f"Exporting {output_asset}")
+    key = output_key(provenance, output_asset)
+    if not up_to_date(output_asset, key, args.force):
+        with span("build_graph", var="CBH"):
+            if bundle is not None:
+                # table keys are pre-encoded with the same DIST*1e4 + EVT code as the image
+                lookup = disturbance_lookup(bundle, "CBH")
+                from_codes = lookup["keys"].tolist()
+                intercept_codes = lookup["intercept"].tolist()
+                hgt_scale_codes = lookup["HT_coef"].tolist()
+                cc_scale_codes = lookup["CC_coef"].tolist()
+            else:
+                uri = base_uri2.format("CBH")
+
+                # read in the table from cloud storage
+                blob = ee.Blob(uri)
+
+                # parse the table as an ee.Dictionary
+                table = parse_txt(blob)
+
+                # apply encoding process to table (in-memory)
+                from_codes = ee.List(encode_table(table))
+
+                # extract out the individual coefficients for the EVT/DIST combinations
+                intercept_codes = to_numeric(ee.List(table.get("intercept")))
+                hgt_scale_codes = to_numeric(ee.List(table.get("HT_coef")))
+                cc_scale_codes = to_numeric(ee.List(table.get("CC_coef")))
+
+            # regression on the new CC and CH, CBH is capped by CH and filled with the baseline outside of DIST
+            cbh = cbh_image(
+                encoded_img,
+                (from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes),
+                dist_img,
+                post_cover_mid_img,
+                new_ch,
+                canopy_guide,
+                cc_img,
+                cbh_img,
+                zone_img,
+            )
+
+            # set up export task
+            # export has specific CONUS projection/spatial extent
+            task = ee.batch.Export.image.toAsset(
+                image=with_provenance(cbh, key, provenance),
+                description=f"export_CBH_{os.path.basename(dist_img_path)}",
+                assetId=output_asset,
+                region=region,
+                crsTransform=geo_t,
+                crs=crs,
+                maxPixels=1e12,
+            )
+        with span("submit_export", asset_id=output_asset):
+            task.start()  # kick of export task
+            task_ids.append(task.id)
+        logger.info(f"Exporting {output_asset}")
+    else:
+        skipped.append(output_asset)
     # logger.info(f"would export {output_asset}")
 
     # CBD #########################################################################################
-    # get coefficients if pinion/juniper by conditional equation
-    # 2017, 2019, 2025, 2059, 2115, 2116, 2119 values are 1
-    pj = evt_img.expression(
-        "(b('FVT') == 2017) ? 1 : "
-        + "(b('FVT') == 2019) ? 1 : "
-        + "(b('FVT') == 2025) ? 1 : "
-        + "(b('FVT') == 2059) ? 1 : "
-        + "(b('FVT') == 2115) ? 1 : "
-        + "(b('FVT') == 2116) ? 1 : "
-        + "(b('FVT') == 2119) ? 1 : 0"
-    )
-
-    # NOTES: here we use the original Canopy Height layer for coefficients calulation
-    #   should this be the FVH midpoint or FVH image???
-    # image -> band: ch_img -> CH
-    # image -> band: fvh_img ->
-    # image -> band: fvh_mid_img -> FVH_MIDPOINT
+    output_asset = f"{output_folder}/CBD"
+    key = output_key(provenance, output_asset)
+    if not up_to_date(output_asset, key, args.force):
+        with span("build_graph", var="CBD"):
+            # NOTES: here we use the newly calculated CH layer/10 for the coefficients, which is already binned to midpoints
+            cbd = cbd_image(evt_img, dist_img, post_cover_mid_img, new_ch, canopy_guide, cc_img, cbd_img, zone_img)
     
-    ## this has been solved ^ we are using the newly calculated CH layer/10 which is already binned to midpoints
+            # set up export task
+            # export has specific CONUS projection/spatial extent (same as other images)
+            task = ee.batch.Export.image.toAsset(
+                image=with_provenance(cbd, key, provenance),
+                description=f"export_CBD_{os.path.basename(dist_img_path)}",
+                assetId=output_asset,
+                region=region,
+                crsTransform=geo_t,
+                crs=crs,
+                maxPixels=1e12,
+            )
+        with span("submit_export", asset_id=output_asset):
+            task.start()  # kick off export
+            task_ids.append(task.id)
+        logger.info(f"Exporting {output_asset}")
+    else:
+        skipped.append(output_asset)
+    # logger.info(f"would export {output_asset}")
 
-    # calculate the sh coefficients based on canopy height
-    # uses conditional equation to check different levels
-    sh1 = post_height_mid_img.expression(
-        "(b('height') < 15) ? 0 : (b('height') < 30) ? 1 : 0"
-    )
-    sh2 = post_height_mid_img.expression(
-        "(b('height') < 15) ? 0 : (b('height')) < 30 ? 0 : 1"
-    )
+    return stage_report(task_ids, skipped)
 
-    # apply CBD equation
-    cbd = (
-        ee.Image()
-        .expression(
-            " e ** (-2.4887057 + (0.0335917 * cov) + "
-            "(-0.356861 * sh1) + -(0.6006381 * sh2) + "
-            "(-1.10691 * pj) + (-0.0010804 * (cov * sh1)) "
-            "+ (-0.0018324 * (cov * sh2)))",
-            {
-                "e": ee.Image.constant(math.e),
-                "cov": post_cover_mid_img,
-                "pj": pj,
-                "sh1": sh1,
-                "sh2": sh2,
-            },
-        )
-        .updateMask(dist_img) 
-        .multiply(100)
-        .clamp(0,45)
-        .toInt16()
-        .where(canopy_guide.eq(0), 0) # 0 where CG is 0
-        .where(canopy_guide.eq(2), 1) # 1 (0.012kg/m^3) where CG is 2
-        .where(canopy_guide.eq(3), 1) # 1 (0.012kg/m^3) where CG is 3
-        .where(cc_img.eq(0), 0) # 0 where CC 2019 is 0
-        .unmask(cbd_img) # fill un-disturbed pixels with pre- fuel value
-        .updateMask(zone_img)
-        .rename("CBD")
-    )
-    
-    # define where to export image
-    output_asset = f"{output_folder}/CBD"
 
-    # set up export task
-    # export has specific CONUS projection/spatial extent (same as other images)
-    task = ee.batch.Export.image.toAsset(
-        image=cbd,
-        description=f"export_CBD_{os.path.basename(dist_img_path)}",
-        assetId=output_asset,
-        region=cc_img.geometry(),
-        crsTransform=geo_t,
-        crs=crs,
-        maxPixels=1e12,
-    )
-    task.start()  # kick off export
-    logger.info(f"Exporting {output_asset}")
-    # logger.info(f"would export {output_asset}")
 # main level process if running as script
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    print_report(main())
\ No newline at end of file
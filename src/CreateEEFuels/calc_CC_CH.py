@@ -6,27 +6,30 @@ Usage:
 """
 import os
 import ee
-import math
-import yaml
 import argparse
 import logging
+from utils.yml_params import load_config
 from utils.ee_csv_parser import parse_txt, to_numeric
-
+from utils.table_bundle import load_bundle, disturbance_lookup
+from utils.stage_assets import read_canopy_guide, canopy_guide_source
+from utils.fuel_graph import disturbance_encoding, cc_ch_image
+from utils.aoi import export_region
+from utils.stage_cache import stage_provenance, output_key, up_to_date, with_provenance
+from utils.stage_scheduler import stage_report, print_report
+from utils.ee_session import initialize
+from utils.tracing import init_tracing, span, traced, current_span
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__),'calc_CC_CH.log')
 logging.basicConfig(
     format="%(asctime)s %(message)s",
     datefmt="%Y-%m-%d %I:%M:%S %p",
     level=logging.WARNING,
-    filename=os.path.join(os.path.dirname(__file__),'calc_CC_CH.log')
+    filename=LOG_FILE
 )
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-try:
-    credentials = ee.ServiceAccountCredentials(email=None,key_file='/home/private-key.json')
-    ee.Initialize(credentials)
-except:
-    ee.Initialize()
-    
 def encode_table(table):
     """Function to take dictionary representation of CSV and
     encode the DIST and EVT values into a unique code
@@ -74,8 +77,12 @@ def encode_table(table):
 
     return encoded
 
-def main():
+@traced("calc_CC_CH")
+def main(argv: list = None):
     """Main level function for generating new CC and CH"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
     
     # initalize new cli parser
     parser = argparse.ArgumentParser(
@@ -112,14 +119,43 @@ def main():
     
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "-t",
+        "--tables_bundle",
+        type=str,
+        help="optional local path of a table bundle from compile_tables.py, used instead of parsing the csv tables on cloud storage"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="optional Earth Engine asset path of a template image or feature collection to bound the computation/export, default = DIST image footprint"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="export every output again, even the ones whose content key shows they are up to date"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the stage and sub-step timing spans are appended to, default = OPTX_TRACE environment variable"
+    )
+    args = parser.parse_args(argv)
+    # authenticates on the first stage of the process only
+    initialize()
 
     dist_img_path = args.dist_img_path
     out_folder_path = args.out_folder_path
 
+    init_tracing(args.trace)
+    current_span().set(scenario=os.path.basename(dist_img_path), fuels_source=args.fuels_source)
+
     # parse config file
-    with open(args.config) as file:
-        config = yaml.full_load(file)
+    config = load_config(args.config)
 
     geo_info = config["geo"]
     #version = config["version"].get('latest')
@@ -136,6 +172,13 @@ def main():
     base_uri = "gs://landfire/LFTFCT_tables/{0}_Disturbance_Tbl.csv"
     base_uri2 = "gs://landfire/LFTFCT_tables/{0}_Disturbance_Tbl_filled.csv"
 
+    # compiled bundle holds the sorted DIST/EVT keys and coefficients of the disturbance tables
+    bundle = None
+    if args.tables_bundle is not None:
+        with span("load_tables", source="bundle"):
+            bundle = load_bundle(args.tables_bundle)
+            logger.info(f"using table bundle {bundle['content_hash']}")
+
     # define the image collections for the raster data needed for calculations
     evt_ic = ee.ImageCollection("projects/pyregence-ee/assets/conus/landfire/fvt")
     fvc_mid_ic = ee.ImageCollection("projects/pyregence-ee/assets/conus/fuels/Midpoint_CC")
@@ -181,27 +224,43 @@ def main():
     dist_img = ee.Image(
         f"{dist_img_path}"
     )
+    # grid-snapped bounding rectangle of the AOI (or DIST footprint) every export is limited to
+    with span("export_region", aoi=args.aoi):
+        region = export_region(args.aoi, dist_img, geo_t, crs)
 
     # get binary image of where disturbance happened
     dist_mask = dist_img.mask() # this creates 1's everywhere include outside disturbed areas. not using
 
-    #canopy guide collection for post-processing ruleset
-    # create cg collection path from the dist_img_path
-    cg_path = f"{out_folder_path}/canopy_guide_collection"
-    canopy_guide = ee.ImageCollection(f"{cg_path}").select('newCanopy').mosaic()
+    #canopy guide for post-processing ruleset
+    # merged canopy guide image if create_canopy_guide was run with --merge_zones, else mosaic of the zone collection
+    with span("read_canopy_guide"):
+        canopy_guide = read_canopy_guide(out_folder_path)
+
+    # content key of every output, outputs already exported with the same key are skipped on reruns
+    with span("provenance"):
+        provenance = stage_provenance(
+            "calc_CC_CH",
+            __file__,
+            {
+                "dist": dist_img,
+                "evt": evt_img,
+                "fvc_mid": fvc_mid_img,
+                "fvh_mid": fvh_mid_img,
+                "cc_baseline": cc_img,
+                "ch_baseline": ch_img,
+                "zones": zone_img,
+                "canopy_guide": canopy_guide_source(out_folder_path),
+            },
+            region,
+            tables=bundle["content_hash"] if bundle is not None else base_uri,
+            grid=geo_info,
+            fuels_source=args.fuels_source,
+        )
     
     # encode the images into unique codes
     # code will be a 7 digit value where each group of values
     # are the individual values from the images
-    encoded_img = dist_img.expression(
-        "a*as + b*bs",
-        {
-            "a": dist_img,
-            "as": 1e4,
-            "b": evt_img,
-            "bs": 1e0,
-        },
-    )
+    encoded_img = disturbance_encoding(dist_img, evt_img)
 
     # define the variable to process in loop
     # these all have the same process for regression
@@ -219,125 +278,78 @@ def main():
     output_folder = out_folder_path
 
     # loop through the variables to run the regressions
+    task_ids, skipped = [], []
     for i, var in enumerate(vars):                    
-        # if i==2 or var == CBH use the base_uri2
-        # this was to accommodate CBH, which was removed from vars list so the else condition will be true for both now
-        if i == 2:
-            uri = base_uri2.format(var)
-        else:
-            uri = base_uri.format(var)
-
-        # read in the table from cloud storage
-        blob = ee.Blob(uri)
-
-        # parse the table as an ee.Dictionary
-        table = parse_txt(blob)
-
-        # apply encoding process to table (in-memory)
-        from_codes = ee.List(encode_table(table))
-
-        # extract out the individual coefficients for the EVT/DIST combinations
-        intercept_codes = to_numeric(ee.List(table.get("intercept")))
-        hgt_scale_codes = to_numeric(ee.List(table.get("HT_coef")))
-        cc_scale_codes = to_numeric(ee.List(table.get("CC_coef")))
-
-        # apply remapping process to get images of coefficients for regression
-        intercept = encoded_img.remap(from_codes, intercept_codes)
-        hgt_scale = encoded_img.remap(from_codes, hgt_scale_codes)
-        cc_scale = encoded_img.remap(from_codes, cc_scale_codes)
-
-        # apply the regression equation for the variable
-        # and fill in areas not disturbed with original variable image
-        regress = (
-            intercept.expression(
-                "b+(m1*x1)+(m2*x2)",
-                {
-                    "b": intercept,
-                    "m1": hgt_scale,
-                    "x1": fvh_mid_img,
-                    "m2": cc_scale,
-                    "x2": fvc_mid_img,
-                }
-            )
-            
-        )
-        
-        if var == 'Cover': # CC 
-            
-            values = ee.List.sequence(0,100)
-            bins = ee.List.repeat(0,10)\
-                .cat(ee.List.repeat(15,10))\
-                .cat(ee.List.repeat(25,10))\
-                .cat(ee.List.repeat(35,10))\
-                .cat(ee.List.repeat(45,10))\
-                .cat(ee.List.repeat(55,10))\
-                .cat(ee.List.repeat(65,10))\
-                .cat(ee.List.repeat(75,10))\
-                .cat(ee.List.repeat(85,10))\
-                .cat(ee.List.repeat(95,11))
-            
-            regress_processed = (
-                regress
-                .updateMask(dist_img)
-                .clamp(0,100)
-                .toInt16()
-                .remap(values,bins,0)
-                .where(canopy_guide.eq(0), 0) # zero out where CG is 0
-                .where(cc_img.eq(0), 0) # zero out where CC 2019 is 0
-                .unmask(fills[i]) # fill un-disturbed pixels with pre- fuel value
-                .updateMask(zone_img)
-                .rename(var.lower())
-                )
-        
-        else: # CH 
-            
-            values = ee.List.sequence(0,51)
-            bins = ee.List.repeat(0,1)\
-                .cat(ee.List.repeat(3,4))\
-                .cat(ee.List.repeat(7,4))\
-                .cat(ee.List.repeat(11,4))\
-                .cat(ee.List.repeat(15,4))\
-                .cat(ee.List.repeat(19,4))\
-                .cat(ee.List.repeat(23,4))\
-                .cat(ee.List.repeat(27,4))\
-                .cat(ee.List.repeat(31,4))\
-                .cat(ee.List.repeat(35,4))\
-                .cat(ee.List.repeat(39,4))\
-                .cat(ee.List.repeat(43,4))\
-                .cat(ee.List.repeat(47,4))\
-                .cat(ee.List.repeat(51,3))
-
-            regress_processed = (
-                regress
-                .updateMask(dist_img)
-                .toInt16()
-                .remap(values,bins,0)
-                .multiply(10)
-                .clamp(0,510)
-                .where(canopy_guide.eq(0), 0) # zero out where CG is 0
-                .where(cc_img.eq(0), 0) # zero out where CC is 0
-                .unmask(fills[i]) # fill un-disturbed pixels with pre- fuel value
-                .updateMask(zone_img)
-                .rename(var.lower()) 
-                )
-        
         # define where to export image
         output_asset = f"{output_folder}/{output_names[i]}"
-
-        # set up export task
-        # export has specific CONUS projection/spatial extent
-        task = ee.batch.Export.image.toAsset(
-            image=regress_processed,
-            description=f"export_{output_names[i]}_{os.path.basename(dist_img_path)}",
-            assetId=output_asset,
-            region=cc_img.geometry(),
-            crsTransform=geo_t,
-            crs=crs,
-            maxPixels=1e12,
-        )
-        task.start()  # kick off export task
-        logger.info(f"Exporting {output_asset}")
+        key = output_key(provenance, output_asset)
+        if up_to_date(output_asset, key, args.force):
+            skipped.append(output_asset)
+            continue
+
+        with span("build_graph", var=var):
+            if bundle is not None:
+                # table keys are pre-encoded with the same DIST*1e4 + EVT code as the image
+                lookup = disturbance_lookup(bundle, var)
+                from_codes = lookup["keys"].tolist()
+                intercept_codes = lookup["intercept"].tolist()
+                hgt_scale_codes = lookup["HT_coef"].tolist()
+                cc_scale_codes = lookup["CC_coef"].tolist()
+            else:
+                # if i==2 or var == CBH use the base_uri2
+                # this was to accommodate CBH, which was removed from vars list so the else condition will be true for both now
+                if i == 2:
+                    uri = base_uri2.format(var)
+                else:
+                    uri = base_uri.format(var)
+
+                # read in the table from cloud storage
+                blob = ee.Blob(uri)
+
+                # parse the table as an ee.Dictionary
+                table = parse_txt(blob)
+
+                # apply encoding process to table (in-memory)
+                from_codes = ee.List(encode_table(table))
+
+                # extract out the individual coefficients for the EVT/DIST combinations
+                intercept_codes = to_numeric(ee.List(table.get("intercept")))
+                hgt_scale_codes = to_numeric(ee.List(table.get("HT_coef")))
+                cc_scale_codes = to_numeric(ee.List(table.get("CC_coef")))
+
+            # regression on the FVH/FVC midpoints, binned to midpoints and filled with the baseline outside of DIST
+            regress_processed = cc_ch_image(
+                var,
+                encoded_img,
+                (from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes),
+                dist_img,
+                fvh_mid_img,
+                fvc_mid_img,
+                canopy_guide,
+                cc_img,
+                fills[i],
+                zone_img,
+            )
         
+            # set up export task
+            # export has specific CONUS projection/spatial extent
+            task = ee.batch.Export.image.toAsset(
+                image=with_provenance(regress_processed, key, provenance),
+                description=f"export_{output_names[i]}_{os.path.basename(dist_img_path)}",
+                assetId=output_asset,
+                region=region,
+                crsTransform=geo_t,
+                crs=crs,
+                maxPixels=1e12,
+            )
+        with span("submit_export", asset_id=output_asset):
+            task.start()  # kick off export task
+            task_ids.append(task.id)
+        logger.info(f"Exporting {output_asset}")
+
+    return stage_report(task_ids, skipped)
+
+
 # main level process if running as script
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    print_report(main())
\ No newline at end of file
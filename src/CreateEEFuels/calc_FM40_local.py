@@ -0,0 +1,164 @@
+"""
+Script used to calculate new FM40 values for disturbed area using
+local DIST, BPS, FVH, FVC, and FVT GeoTIFFs (NumPy backend of calc_FM40.py)
+Inputs are expected on the config geo grid, named as in utils/local_inputs.py inside the inputs folder,
+CMB tables are the same preprocessed z{NN}_CMB.csv files that live on cloud storage,
+table rows and pixels are matched with the packed integer keys from utils/key_packing.py
+Usage:
+    $ python calc_FM40_local.py -c path/to/config -d path/to/dist.tif -i path/to/inputs -t path/to/tables -o path/to/output -f pyrologix
+"""
+import os
+import time
+import argparse
+import logging
+import numpy as np
+from utils.yml_params import load_config
+from utils.local_csv_parser import parse_csv
+from utils.local_fuels import calc_fm40, NODATA
+from utils.key_packing import table_packing, pack_arrays
+from utils.table_bundle import load_bundle, bundle_packing, cmb_lookup, table_lookups
+from utils.local_inputs import read_inputs
+from utils.raster_io import read_window, window_bounds, write_geotiff
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'calc_fm40_local.log')
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=LOG_FILE
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def load_zone_tables(tables_dir: str, zones: list) -> dict:
+    """Function to read the zone CMB tables from local disk
+    args:
+        tables_dir (str): local folder holding the z{NN}_CMB.csv tables
+        zones (list): zone numbers to read tables for
+    returns:
+        dict: {zone number: parsed table}
+    """
+    tables = {}
+    for zone in zones:
+        # skip over zone 11, there is no zone 11
+        if zone == 11:
+            continue
+        tables[zone] = parse_csv(os.path.join(tables_dir, f"z{zone:02d}_CMB.csv"))
+    return tables
+
+
+def main(argv: list = None):
+    """Main level function for generating new FM40 locally"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for generating new FM40 with the local NumPy backend."
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dist_img_path",
+        type=str,
+        help="file path of input DIST GeoTIFF"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--inputs_dir",
+        type=str,
+        help="folder holding the BPS, FVT, FVH, FVC, zones and baseline FM40 GeoTIFFs"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tables_dir",
+        type=str,
+        help="folder holding the z{NN}_CMB.csv tables or a bundle from compile_tables.py"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--out_folder_path",
+        type=str,
+        help="output folder"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fuels_source",
+        type=str,
+        help="source of baseline fuels dataset. One of: firefactor, pyrologix"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.fuels_source not in ["firefactor", "pyrologix"]:
+        raise ValueError(f"{args.fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+
+    # parse config file
+    config = load_config(args.config)
+
+    crs = config["geo"]["crs"]
+
+    start = time.time()
+
+    # the DIST raster defines the window everything else gets read over
+    bounds, shape, profile = window_bounds(args.dist_img_path)
+    profile.update(crs=crs)
+    dist = read_window(args.dist_img_path, bounds)
+
+    # Use FireFactor or Pyrologix baseline FM40 to update from
+    arrays = read_inputs(args.inputs_dir, ["bps", "evt", "evh", "evc", "zone", "fm40"], bounds, args.fuels_source)
+    old_fm40 = arrays["fm40"]
+
+    # only zones that hold disturbed pixels can change
+    zones = sorted(int(z) for z in np.unique(arrays["zone"][dist != 0]) if z != 0)
+    logger.info(zones)
+
+    # pack the image values and the table rows into exact integer keys with one shared layout
+    if os.path.isfile(args.tables_dir):
+        # compiled bundle, keys are already packed and sorted
+        bundle = load_bundle(args.tables_dir)
+        logger.info(f"using table bundle {bundle['content_hash']}")
+        packing = bundle_packing(bundle)
+        lookups = {zone: cmb_lookup(bundle, zone, "NewFBFM40") for zone in zones if zone != 11}
+    else:
+        tables = load_zone_tables(args.tables_dir, zones)
+        packing = table_packing(list(tables.values()))
+        lookups = table_lookups(tables, packing, "NewFBFM40")
+    logger.info(f"packed keys use {packing['bits']} bits ({packing['dtype']})")
+    keys = pack_arrays(
+        packing,
+        {"DIST": dist, "BPS": arrays["bps"], "EVH": arrays["evh"], "EVC": arrays["evc"], "EVT": arrays["evt"]},
+    )
+
+    # every zone overlapping the DIST window gets written, not just the disturbed ones
+    for zone in np.unique(arrays["zone"]):
+        if zone != 0 and int(zone) not in lookups:
+            lookups[int(zone)] = (np.array([], dtype=keys.dtype), np.array([], dtype=np.uint16))
+
+    new_fm40, flags = calc_fm40(dist, keys, old_fm40, arrays["zone"], lookups)
+
+    if not os.path.exists(args.out_folder_path):
+        os.makedirs(args.out_folder_path)
+    out_file = os.path.join(args.out_folder_path, "FM40.tif")
+    logger.info(f"Exporting {out_file}")
+    write_geotiff(out_file, [new_fm40, flags], ["new_fbfm40", "qa_flags"], profile, "uint16", nodata=NODATA)
+    logger.info(f"Time Elapsed: {(time.time() - start):.1f} seconds")
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Script used to calculate the canopy guide and the 5 fuel layers (FM40, CC, CH, CBH, CBD) of one DIST scenario
+interactively, for small AOIs where the queue time of the chained export tasks dominates the runtime
+The 4 stages are chained as one Earth Engine graph (no intermediate assets, see utils/fuel_graph.py)
+and its pixels are pulled with parallel computePixels requests over the grid-snapped export region
+(see utils/pixel_fetch.py), then written as local GeoTIFFs with the same layout as calc_fuelscape_local.py
+Needs a table bundle from compile_tables.py
+Usage:
+    $ python calc_fuelscape_interactive.py -c path/to/config -d path/to/dist/asset -t path/to/tables.bundle -o path/to/output -f pyrologix
+"""
+import os
+import ee
+import time
+import argparse
+import logging
+from utils.yml_params import load_config
+from utils.aoi import region_bounds, bounds_region
+from utils.baseline_cache import EE_LAYERS, EE_BASELINES
+from utils.fuel_graph import (
+    v200_image,
+    merged_canopy_guide,
+    merged_fm40,
+    disturbance_encoding,
+    bundle_regression_lookup,
+    cc_ch_image,
+    cbh_image,
+    cbd_image,
+    fuel_stack,
+)
+from utils.local_fuels import NODATA, NODATA_INT16, STACK_BANDS
+from utils.pixel_fetch import fetch_window, DEFAULT_TILE_SIZE, DEFAULT_WORKERS
+from utils.raster_io import write_geotiff
+from utils.table_bundle import load_bundle, bundle_packing, cmb_lookup
+from utils.tile_engine import grid_window, window_profile
+from utils.zone_discovery import discover_zones, DEFAULT_CACHE_DIR
+from utils.ee_session import initialize
+from utils.tracing import init_tracing, span, traced, current_span
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'calc_fuelscape_interactive.log')
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=LOG_FILE
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.getLogger("utils.pixel_fetch").setLevel(logging.INFO)
+
+
+def fuelscape_graph(dist_img: ee.Image, bundle: dict, zones: list, disturbed_zones: list, fuels_source: str) -> ee.Image:
+    """Function to chain the canopy guide, FM40, CC/CH and CBH/CBD stages into one image
+    args:
+        dist_img (ee.Image): DIST image of the scenario
+        bundle (dict): table bundle from load_bundle
+        zones (list): every zone of the export region
+        disturbed_zones (list): zones holding disturbed pixels, the only ones remapped
+        fuels_source (str): firefactor or pyrologix
+    returns:
+        ee.Image: FM40, CC, CH, CBH, CBD int16 bands and the newCanopy uint16 band
+    """
+    # the actual values being used in the crosswalks are the FVH, FVC, FVT (named as in the tables)
+    lf = {name: v200_image(EE_LAYERS[name][0]) for name in ["bps", "evt", "evh", "evc", "fvc_mid", "fvh_mid"]}
+    zone_img = ee.Image(EE_LAYERS["zone"][0])
+    images = {"ZONE": zone_img, "BPS": lf["bps"], "EVH": lf["evh"], "EVC": lf["evc"], "EVT": lf["evt"]}
+    baselines = {name: ee.Image(asset_id) for name, asset_id in EE_BASELINES[fuels_source].items()}
+    old_cg = ee.ImageCollection(EE_LAYERS["cg"][0]).select("newCanopy").mosaic()
+
+    packing = bundle_packing(bundle)
+    canopy_guide = merged_canopy_guide(
+        packing,
+        {zone: cmb_lookup(bundle, zone, "NewCanopy") for zone in disturbed_zones},
+        zones,
+        dist_img.unmask(0),
+        images,
+        old_cg,
+    ).select("newCanopy")
+    fm40 = merged_fm40(
+        packing,
+        {zone: cmb_lookup(bundle, zone, "NewFBFM40") for zone in disturbed_zones},
+        zones,
+        dist_img,
+        images,
+        baselines["fm40"],
+    ).select("new_fbfm40")
+
+    # the intermediates stay in the graph, CBH and CBD read the new CC and CH directly
+    encoded_img = disturbance_encoding(dist_img, lf["evt"])
+    cc, ch = [
+        cc_ch_image(
+            var,
+            encoded_img,
+            bundle_regression_lookup(bundle, var),
+            dist_img,
+            lf["fvh_mid"],
+            lf["fvc_mid"],
+            canopy_guide,
+            baselines["cc"],
+            baselines[fill],
+            zone_img,
+        )
+        for var, fill in [("Cover", "cc"), ("Height", "ch")]
+    ]
+    cbh = cbh_image(
+        encoded_img, bundle_regression_lookup(bundle, "CBH"), dist_img, cc, ch, canopy_guide, baselines["cc"], baselines["cbh"], zone_img
+    )
+    cbd = cbd_image(lf["evt"], dist_img, cc, ch, canopy_guide, baselines["cc"], baselines["cbd"], zone_img)
+
+    # masked pixels would come back as 0, same nodata values as the local backend
+    stack = fuel_stack(fm40, cc, ch, cbh, cbd).unmask(NODATA_INT16).toInt16()
+    return stack.addBands(canopy_guide.unmask(NODATA).toUint16())
+
+
+@traced("calc_fuelscape_interactive")
+def main(argv: list = None):
+    """Main level function for generating the canopy guide and fuel stack interactively"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for generating the canopy guide and fuel stack of a small AOI without export tasks."
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dist_img_path",
+        type=str,
+        help="asset path of input DIST img"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tables_bundle",
+        type=str,
+        help="local path of a table bundle from compile_tables.py"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--out_folder_path",
+        type=str,
+        help="local output folder"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fuels_source",
+        type=str,
+        help="source of baseline fuels dataset. One of: firefactor, pyrologix"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="optional Earth Engine asset path of a template image or feature collection to bound the computation, default = DIST image footprint"
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"computePixels requests in flight. default = {DEFAULT_WORKERS}"
+    )
+
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=DEFAULT_TILE_SIZE,
+        help=f"edge in pixels of each computePixels request. default = {DEFAULT_TILE_SIZE}"
+    )
+
+    parser.add_argument(
+        "--zone_cache",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="folder caching the zones (and disturbed pixel counts) found for each DIST asset. default = data/zone_cache"
+    )
+
+    parser.add_argument(
+        "--no_zone_cache",
+        action="store_true",
+        help="always recompute the zone histogram instead of reading or writing --zone_cache"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the stage and sub-step timing spans are appended to, default = OPTX_TRACE environment variable"
+    )
+
+    args = parser.parse_args(argv)
+    # authenticates on the first stage of the process only
+    initialize()
+
+    if args.fuels_source not in EE_BASELINES:
+        raise ValueError(f"{args.fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+    if args.tables_bundle is None:
+        raise ValueError("the interactive mode needs a table bundle (-t), build one with compile_tables.py")
+
+    dist_img_path = args.dist_img_path
+    init_tracing(args.trace)
+    current_span().set(scenario=os.path.basename(dist_img_path), fuels_source=args.fuels_source)
+
+    # parse config file
+    config = load_config(args.config)
+
+    geo_info = config["geo"]
+    geo_t = geo_info["crsTransform"]
+    crs = geo_info["crs"]
+
+    start = time.time()
+
+    dist_img = ee.Image(dist_img_path)
+    # grid-snapped bounding rectangle of the AOI (or DIST footprint), the pixels are fetched over its grid window
+    with span("export_region", aoi=args.aoi):
+        bounds = region_bounds(args.aoi, dist_img, geo_t, crs)
+        region = bounds_region(bounds, crs)
+        window = grid_window(geo_info, bounds)
+
+    with span("zone_discovery") as discovery:
+        found = discover_zones(
+            dist_img_path, dist_img, ee.Image(EE_LAYERS["zone"][0]), region, geo_t, crs,
+            cache_dir=None if args.no_zone_cache else args.zone_cache,
+        )
+        zones = found["zones"]
+        # if nothing is disturbed every zone is remapped so the tables still apply, like the zone stages
+        disturbed_zones = sorted(found["disturbed"]) or zones
+        discovery.set(zones=zones, disturbed_zones=disturbed_zones, cached=found["cached"])
+    logger.info(f"zones {zones}, disturbed pixels {found['disturbed']}")
+
+    with span("load_tables", source="bundle"):
+        bundle = load_bundle(args.tables_bundle)
+        logger.info(f"using table bundle {bundle['content_hash']}")
+
+    with span("build_graph", zones=disturbed_zones):
+        image = fuelscape_graph(dist_img, bundle, zones, disturbed_zones, args.fuels_source)
+
+    band_names = STACK_BANDS + ["newCanopy"]
+    with span(
+        "fetch_pixels", pixels=int(window.width * window.height), tile_size=args.tile_size, workers=args.workers
+    ):
+        pixels = fetch_window(image, geo_info, window, band_names, tile_size=args.tile_size, workers=args.workers)
+
+    if not os.path.exists(args.out_folder_path):
+        os.makedirs(args.out_folder_path)
+    profile = window_profile(geo_info, window)
+    with span("write_outputs"):
+        # same band layout as the Drive export of the notebook and calc_fuelscape_local.py
+        out_file = os.path.join(args.out_folder_path, "fuelscape.tif")
+        write_geotiff(out_file, [pixels[band] for band in STACK_BANDS], STACK_BANDS, profile, "int16", nodata=NODATA_INT16)
+        logger.info(f"Exported {out_file}")
+        out_file = os.path.join(args.out_folder_path, "canopy_guide.tif")
+        write_geotiff(out_file, [pixels["newCanopy"]], ["newCanopy"], profile, "uint16", nodata=NODATA)
+        logger.info(f"Exported {out_file}")
+    logger.info(f"Time Elapsed: {(time.time() - start):.1f} seconds")
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
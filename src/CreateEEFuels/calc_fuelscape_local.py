@@ -0,0 +1,297 @@
+"""
+Script used to calculate the canopy guide and the 5 fuel layers (FM40, CC, CH, CBH, CBD) for disturbed areas
+in a single pass over local GeoTIFFs (NumPy backend of create_canopy_guide.py, calc_FM40.py,
+calc_CC_CH.py and calc_CBD_CBH.py run back to back)
+Each input is read once and the intermediates (canopy guide, CC, CH) never leave memory,
+so there is no export/ingest round trip between the stages
+The DIST extent (or the whole config grid with --full_grid) is split into blocks aligned to the config
+crsTransform grid that run on a process pool and stream into the outputs, see utils/tile_engine.py
+Several DIST scenarios can be given to -d, they are evaluated together against one read of the baseline inputs
+and each gets its own <output>/<DIST name> folder
+With --delta the fuel stack is stored as a sparse delta against the baseline fuels, see utils/delta_fuelscape.py
+Inputs are expected on the config geo grid, named as in utils/local_inputs.py inside the inputs folder
+Usage:
+    $ python calc_fuelscape_local.py -c path/to/config -d path/to/dist.tif [path/to/dist_b.tif ...] -i path/to/inputs -t path/to/tables -o path/to/output -f pyrologix
+"""
+import os
+import time
+import argparse
+import logging
+import functools
+import numpy as np
+from utils.yml_params import load_config
+from utils.local_fuels import calc_fuelscape, calc_fuelscape_batch, NODATA, NODATA_INT16, STACK_BANDS
+from utils.local_inputs import LANDFIRE_INPUTS, BASELINE_INPUTS, FUELS_SOURCES, read_inputs
+from utils.table_bundle import open_tables, fuel_lookups
+from utils.raster_io import read_window, window_bounds
+from utils.delta_fuelscape import DeltaWriter, baseline_reference, reference_stack, to_delta
+from utils.tile_engine import (
+    grid_window,
+    grid_tiles,
+    tile_bounds,
+    tile_size_for_budget,
+    FUELSCAPE_BYTES_PER_PIXEL,
+    window_profile,
+    open_output,
+    run_tiles,
+)
+from utils.tracing import init_tracing, span, traced, current_span
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'calc_fuelscape_local.log')
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=LOG_FILE
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.getLogger("utils.tile_engine").setLevel(logging.INFO)
+
+# lookup tables of the worker process, set once by init_worker
+_tables = None
+
+
+def init_worker(tables_path: str, trace_parent: str = None):
+    """Function to open the lookup tables once per worker process
+    args:
+        tables_path (str): tables folder or bundle, see table_bundle.open_tables
+        trace_parent (str): span id the load_tables span nests under. default = None
+    """
+    global _tables
+    with span("load_tables", parent_id=trace_parent, source=tables_path):
+        _tables = open_tables(tables_path)
+
+
+def scenario_name(dist_img_path: str) -> str:
+    """Helper function to get the scenario name (DIST file name without extension) of a DIST GeoTIFF"""
+    return os.path.splitext(os.path.basename(dist_img_path))[0]
+
+
+def fuelscape_tile(
+    tile,
+    geo_info: dict,
+    dist_img_paths: list,
+    inputs_dir: str,
+    fuels_source: str,
+    delta: bool = False,
+    trace_parent: str = None,
+) -> dict:
+    """Function to compute the canopy guide and fuel stack of one grid tile for every scenario
+    args:
+        tile (Window): tile in config grid pixel coordinates
+        geo_info (dict): geo section of the config file
+        dist_img_paths (list): file paths of the input DIST GeoTIFFs, pixels outside of them are not disturbed
+        inputs_dir (str): folder holding the input GeoTIFFs
+        fuels_source (str): firefactor or pyrologix
+        delta (bool): mark pixels equal to the baseline as unchanged and leave out the canopy guide. default = False
+        trace_parent (str): span id the tile span nests under, tiles run in worker processes. default = None
+    returns:
+        dict: {"<scenario>/fuelscape": 5 bands in STACK_BANDS order, "<scenario>/canopy_guide": 1 band}
+    """
+    with span(
+        "tile", parent_id=trace_parent, row=int(tile.row_off), col=int(tile.col_off), pixels=int(tile.width * tile.height)
+    ) as tile_span:
+        bounds = tile_bounds(geo_info, tile)
+        # the baseline inputs are read once whatever the number of scenarios
+        with span("read_inputs", scenarios=len(dist_img_paths)):
+            arrays = read_inputs(inputs_dir, list(LANDFIRE_INPUTS) + list(BASELINE_INPUTS), bounds, fuels_source)
+            dists = [read_window(path, bounds) for path in dist_img_paths]
+
+        # every zone overlapping the tile gets written, not just the disturbed ones
+        zones = sorted(int(z) for z in np.unique(arrays["zone"]) if z != 0)
+        lookups = fuel_lookups(_tables, zones)
+        disturbed = sum(int(np.count_nonzero(dist)) for dist in dists)
+        tile_span.set(zones=zones, disturbed_pixels=disturbed)
+        with span("calc_fuelscape", scenarios=len(dists), disturbed_pixels=disturbed):
+            if len(dists) == 1:
+                scenarios = [calc_fuelscape(dict(arrays, dist=dists[0]), lookups)]
+            else:
+                scenarios = calc_fuelscape_batch(arrays, dists, lookups)
+
+    results = {}
+    reference = reference_stack(arrays) if delta else None
+    for path, outputs in zip(dist_img_paths, scenarios):
+        name = scenario_name(path)
+        if delta:
+            results[f"{name}/fuelscape"] = [to_delta(outputs[band], reference[i]) for i, band in enumerate(STACK_BANDS)]
+            continue
+        results[f"{name}/fuelscape"] = [outputs[band] for band in STACK_BANDS]
+        results[f"{name}/canopy_guide"] = [outputs["canopy_guide"]]
+    return results
+
+
+@traced("calc_fuelscape_local")
+def main(argv: list = None):
+    """Main level function for generating the canopy guide and fuel stack locally"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for generating the canopy guide and fuel stack in one pass with the local NumPy backend."
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dist_img_paths",
+        type=str,
+        nargs="+",
+        help="file paths of the input DIST GeoTIFFs, one per scenario"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--inputs_dir",
+        type=str,
+        help="folder holding the LANDFIRE, canopy guide and baseline fuel GeoTIFFs"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tables_dir",
+        type=str,
+        help="local copy of gs://landfire/LFTFCT_tables or a bundle from compile_tables.py"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--out_folder_path",
+        type=str,
+        help="output folder, holds one <DIST name> subfolder per scenario when more than one DIST is given"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fuels_source",
+        type=str,
+        help="source of baseline fuels dataset. One of: firefactor, pyrologix"
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes. default = number of cores"
+    )
+
+    parser.add_argument(
+        "--memory_mb",
+        type=float,
+        default=4096,
+        help="memory budget in MB for the tiles in flight, sets the tile size. default = 4096"
+    )
+
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        help="tile edge in pixels, overrides the size derived from --memory_mb"
+    )
+
+    parser.add_argument(
+        "--full_grid",
+        action="store_true",
+        help="compute the whole config grid instead of the DIST extents"
+    )
+
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="write the fuel stack as a sparse delta against the baseline fuels (fuelscape.delta.zip) instead of GeoTIFFs"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the run, tile and sub-step timing spans are appended to, default = OPTX_TRACE environment variable"
+    )
+
+    args = parser.parse_args(argv)
+    # set before the worker pool starts so the workers write into the same trace
+    init_tracing(args.trace)
+
+    if args.fuels_source not in FUELS_SOURCES:
+        raise ValueError(f"{args.fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+
+    # parse config file
+    config = load_config(args.config)
+
+    geo_info = config["geo"]
+
+    start = time.time()
+
+    dist_img_paths = args.dist_img_paths
+    names = [scenario_name(path) for path in dist_img_paths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"DIST file names must be unique, they name the scenario output folders: {names}")
+
+    # outputs cover the union of the DIST extents snapped to the config grid, or the whole grid
+    if args.full_grid:
+        bounds = None
+    else:
+        all_bounds = np.array([window_bounds(path)[0] for path in dist_img_paths])
+        bounds = (*all_bounds[:, :2].min(axis=0), *all_bounds[:, 2:].max(axis=0))
+    extent = grid_window(geo_info, bounds)
+    # the undisturbed pass plus the stacked disturbed pixels can take up to K+1 times a single scenario
+    bytes_per_pixel = FUELSCAPE_BYTES_PER_PIXEL * (1 if len(names) == 1 else len(names) + 1)
+    tile_size = args.tile_size or tile_size_for_budget(args.memory_mb, args.workers, bytes_per_pixel)
+    tiles = grid_tiles(extent, tile_size)
+    logger.info(f"{len(names)} scenarios, {int(extent.width)} x {int(extent.height)} px in {len(tiles)} tiles of {tile_size} px on {args.workers} workers")
+    current_span().set(
+        scenarios=names, pixels=int(extent.width * extent.height), tiles=len(tiles), tile_size=tile_size, workers=args.workers
+    )
+
+    profile = window_profile(geo_info, extent)
+    # versions of the baseline layers over the extent, a delta read against changed layers raises
+    baseline = baseline_reference(args.inputs_dir, args.fuels_source, tile_bounds(geo_info, extent)) if args.delta else None
+    outputs = {}
+    try:
+        for name in names:
+            # a single scenario writes straight into the output folder like before
+            out_folder = args.out_folder_path if len(names) == 1 else os.path.join(args.out_folder_path, name)
+            if not os.path.exists(out_folder):
+                os.makedirs(out_folder)
+            if args.delta:
+                outputs[f"{name}/fuelscape"] = DeltaWriter(os.path.join(out_folder, "fuelscape.delta.zip"), profile, baseline)
+                continue
+            outputs[f"{name}/canopy_guide"] = open_output(
+                os.path.join(out_folder, "canopy_guide.tif"), profile, ["newCanopy"], "uint16", NODATA
+            )
+            # same band layout as the Drive export of the notebook
+            outputs[f"{name}/fuelscape"] = open_output(
+                os.path.join(out_folder, "fuelscape.tif"), profile, STACK_BANDS, "int16", NODATA_INT16
+            )
+
+        with span("run_tiles", tiles=len(tiles), workers=args.workers) as tiles_span:
+            kernel = functools.partial(
+                fuelscape_tile,
+                geo_info=geo_info,
+                dist_img_paths=dist_img_paths,
+                inputs_dir=args.inputs_dir,
+                fuels_source=args.fuels_source,
+                delta=args.delta,
+                trace_parent=tiles_span.span_id,
+            )
+            run_tiles(kernel, tiles, outputs, extent, args.workers, init_worker, (args.tables_dir, tiles_span.span_id))
+    finally:
+        for dst in outputs.values():
+            dst.close()
+
+    for dst in outputs.values():
+        logger.info(f"Exported {dst.name}")
+    logger.info(f"Time Elapsed: {(time.time() - start):.1f} seconds")
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
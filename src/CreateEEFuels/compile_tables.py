@@ -0,0 +1,70 @@
+"""
+Script used to compile the CMB and disturbance regression csv tables into one binary bundle
+that the EE and local backends can load (memory-mapped) instead of parsing the csv tables every run
+Expects a local copy of gs://landfire/LFTFCT_tables, i.e.
+    gsutil -m cp -r gs://landfire/LFTFCT_tables path/to/tables
+Usage:
+    $ python compile_tables.py -t path/to/LFTFCT_tables -o path/to/tables.bundle
+"""
+import os
+import time
+import argparse
+import logging
+from utils.table_bundle import read_source_tables, compile_bundle, write_bundle, load_bundle
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'compile_tables.log')
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=LOG_FILE
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def main(argv: list = None):
+    """Main level function for compiling the lookup table bundle"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for compiling the CMB and disturbance tables into a binary bundle."
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tables_dir",
+        type=str,
+        help="local copy of gs://landfire/LFTFCT_tables",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="file path of the output bundle"
+    )
+
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    cmb_tables, disturbance_tables, hashes = read_source_tables(args.tables_dir)
+    logger.info(f"read {len(cmb_tables)} CMB tables and {len(disturbance_tables)} disturbance tables")
+
+    meta, arrays = compile_bundle(cmb_tables, disturbance_tables, hashes)
+    write_bundle(args.output, meta, arrays)
+
+    # read it back so a broken bundle is caught here rather than mid-run
+    bundle = load_bundle(args.output)
+    logger.info(f"Exported {args.output} content_hash={bundle['content_hash']} cmb_bits={bundle['cmb_bits']}")
+    logger.info(f"Time Elapsed: {(time.time() - start):.1f} seconds")
+    print(bundle["content_hash"])
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
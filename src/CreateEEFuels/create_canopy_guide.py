@@ -6,26 +6,32 @@ Usage:
 """
 import os
 import ee
-import yaml
 import argparse
 import logging
-from utils.ee_csv_parser import parse_txt, to_numeric
-
+from utils.yml_params import load_config
+from utils.ee_csv_parser import fetch_table
+from utils.key_packing import table_packing, pack_image
+from utils.fuel_graph import merged_canopy_guide
+from utils.stage_assets import MERGED_CANOPY_GUIDE, CANOPY_GUIDE_COLLECTION, BASELINE_CANOPY_GUIDE, ensure_collection
+from utils.table_bundle import load_bundle, bundle_packing, cmb_lookup, table_lookups
+from utils.aoi import export_region
+from utils.zone_discovery import discover_zones, DEFAULT_CACHE_DIR
+from utils.stage_cache import stage_provenance, output_key, up_to_date, with_provenance, prune_collection, remove_output
+from utils.ee_session import initialize
+from utils.tracing import init_tracing, span, traced, current_span
+from utils.stage_scheduler import stage_report, print_report
+from utils.script_log import attach_log_file
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'create_canopy_guide.log')
 logging.basicConfig(
     format="%(asctime)s %(message)s",
     datefmt="%Y-%m-%d %I:%M:%S %p",
     level=logging.WARNING,
-    filename=os.path.join(os.path.dirname(__file__), 'create_canopy_guide.log')
+    filename=LOG_FILE
 )
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-try:
-    credentials = ee.ServiceAccountCredentials(email=None,key_file='/home/private-key.json')
-    ee.Initialize(credentials)
-except:
-    ee.Initialize()
-    
 # this function is currently not used because the encoded values are precomputed in cmb_table_qa
 # will keep just in case...
 def encode_table(table: ee.Dictionary):
@@ -84,8 +90,12 @@ def encode_table(table: ee.Dictionary):
     return encoded
 
 
-def main():
+@traced("create_canopy_guide")
+def main(argv: list = None):
     """Main level function for generating new CBH and CBD"""
+
+    # basicConfig above does nothing when optx.py or schedule_stages.py configured logging first
+    attach_log_file(logger, LOG_FILE)
     
     # initalize new cli parser
     parser = argparse.ArgumentParser(
@@ -114,14 +124,64 @@ def main():
         help="asset path of output folder"
 
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-t",
+        "--tables_bundle",
+        type=str,
+        help="optional local path of a table bundle from compile_tables.py, used instead of parsing the csv tables on cloud storage"
+    )
+
+    parser.add_argument(
+        "-m",
+        "--merge_zones",
+        action="store_true",
+        help="fold the zone number into the lookup key and export one merged image instead of one image per zone"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="optional Earth Engine asset path of a template image or feature collection to bound the computation/export, default = DIST image footprint"
+    )
+
+    parser.add_argument(
+        "--zone_cache",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="folder caching the zones (and disturbed pixel counts) found for each DIST asset. default = data/zone_cache"
+    )
+
+    parser.add_argument(
+        "--no_zone_cache",
+        action="store_true",
+        help="always recompute the zone histogram instead of reading or writing --zone_cache"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="export every output again, even the ones whose content key shows they are up to date"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the stage and sub-step timing spans are appended to, default = OPTX_TRACE environment variable"
+    )
+
+    args = parser.parse_args(argv)
+    # authenticates on the first stage of the process only
+    initialize()
 
     dist_img_path = args.dist_img_path
     out_folder_path = args.out_folder_path
+
+    init_tracing(args.trace)
+    current_span().set(scenario=os.path.basename(dist_img_path), merge_zones=args.merge_zones)
     
     # parse config file
-    with open(args.config) as file:
-        config = yaml.full_load(file)
+    config = load_config(args.config)
 
     geo_info = config["geo"]
     #version = config["version"].get('latest')
@@ -181,7 +241,7 @@ def main():
         .first()
     )
     
-    old_cg = ee.ImageCollection("projects/pyregence-ee/assets/conus/fuels/canopy_guide_2021_12_v1").select('newCanopy').mosaic()
+    old_cg = ee.ImageCollection(BASELINE_CANOPY_GUIDE).select('newCanopy').mosaic()
 
     # define disturbance image used for the DIST codes
     # this will update with new disturbance info
@@ -189,119 +249,194 @@ def main():
     dist_img = ee.Image(
         f"{dist_img_path}"
     ).unmask(0)
+    # grid-snapped bounding rectangle of the AOI (or DIST footprint) every export is limited to
+    with span("export_region", aoi=args.aoi):
+        region = export_region(args.aoi, dist_img, geo_t, crs)
 
     # define a list of zone information
     # does a skip from 67 to 98...not sure why just the zone numbers
     #zones = list(range(1, 67)) + [98, 99] # all CONUS zones used for FireFactor.. check which zones your AOI falls in and provide them as a list
     # zone image to identify which pixel belong to zone
     zone_img = ee.Image("projects/pyregence-ee/assets/conus/landfire/zones_image")
-    zones_fc = ee.FeatureCollection("projects/pyregence-ee/assets/conus/landfire/zones")
-    # instead of listing all Zone numbers in CONUS (Firefactor), we dynamically find zone numbers of zones intersecting the DIST img footprint
-    zones = zones_fc.filterBounds(dist_img.geometry()).aggregate_array('ZONE_NUM').getInfo() # spatial intersect finding Landfire zones that overlap disturbance img footprint
-    logger.info(zones)
+    # instead of listing all Zone numbers in CONUS (Firefactor), we find the zones in the export region
+    # and count their disturbed pixels with one histogram, cached by DIST asset
+    with span("zone_discovery") as discovery:
+        found = discover_zones(
+            dist_img_path, dist_img, zone_img, region, geo_t, crs, cache_dir=None if args.no_zone_cache else args.zone_cache
+        )
+        zones = found["zones"]
+        # zones without a disturbed pixel keep their baseline values, no table or export is needed for them
+        # if nothing is disturbed the baseline is still written so the downstream stages find an output
+        disturbed_zones = sorted(found["disturbed"]) or zones
+        discovery.set(zones=zones, disturbed_zones=disturbed_zones, cached=found["cached"])
+    logger.info(f"zones {zones}, disturbed pixels {found['disturbed']}, skipping {sorted(set(zones) - set(disturbed_zones))}")
     #zones = [5,6,12] # For AFF project, entire AOI falls in LF Zone 6
 
+    with span("load_tables", source="bundle" if args.tables_bundle is not None else "gcs") as load:
+        if args.tables_bundle is not None:
+            # compiled bundle holds the packed, sorted keys of every zone table
+            bundle = load_bundle(args.tables_bundle)
+            logger.info(f"using table bundle {bundle['content_hash']}")
+            packing = bundle_packing(bundle)
+            zone_lookups = {zone: cmb_lookup(bundle, zone, "NewCanopy") for zone in disturbed_zones}
+        else:
+            # read the CMB tables of every zone client-side so one key packing can be shared by all of them
+            zone_tables = {}
+            for zone in disturbed_zones:
+                # plug in the zone value into the table uri string and parse the table from cloud storage
+                with span("fetch_table", zone=zone):
+                    zone_tables[zone] = fetch_table(base_uri.format(zone))
+            packing = table_packing(list(zone_tables.values()))
+            zone_lookups = table_lookups(zone_tables, packing, "NewCanopy")
+        load.set(zones=len(zone_lookups), table_rows=sum(keys.size for keys, _ in zone_lookups.values()))
+    logger.info(f"packed keys use {packing['bits']} bits ({packing['dtype']})")
+
+    # content key of every output, outputs already exported with the same key are skipped on reruns
+    with span("provenance"):
+        provenance = stage_provenance(
+            "create_canopy_guide",
+            __file__,
+            {
+                "dist": ee.Image(dist_img_path),
+                "bps": bps_img,
+                "evt": evt_img,
+                "evh": evh_img,
+                "evc": evc_img,
+                "baseline": ee.ImageCollection(BASELINE_CANOPY_GUIDE),
+                "zones": zone_img,
+            },
+            region,
+            tables=bundle["content_hash"] if args.tables_bundle is not None else base_uri,
+            grid=geo_info,
+        )
+
     # encode the images into unique codes
-    # code will be a 16 digit value where each group of values
-    # are the individual values from the images
-    encoded_img = dist_img.expression(
-        "a*as+ b*bs + c*cs + d*ds + e*es",
-        {
-            "a": dist_img,
-            "as": 1e13,
-            "b": bps_img,
-            "bs": 1e10,
-            "c": evh_img,
-            "cs": 1e7,
-            "d": evc_img,
-            "ds": 1e4,
-            "e": evt_img,
-            "es": 1e0,
-        },
+    # each of DIST, BPS, EVH, EVC, EVT is mapped to its ordinal in the table values and bit-packed
+    # into an exact int32/int64 key (the old 16 digit float code went past 2^53)
+    encoded_img = pack_image(
+        packing,
+        {"DIST": dist_img, "BPS": bps_img, "EVH": evh_img, "EVC": evc_img, "EVT": evt_img},
     )
 
+    if args.merge_zones:
+        # a zone-wise collection left from an earlier run is not read anymore, it is removed with its images
+        remove_output(f"{out_folder_path}/{CANOPY_GUIDE_COLLECTION}")
+        asset_id = f"{out_folder_path}/{MERGED_CANOPY_GUIDE}"
+        key = output_key(provenance, asset_id)
+        if up_to_date(asset_id, key, args.force):
+            return stage_report([], [asset_id])
+
+        # fold the zone number into the lookup key so every zone is remapped in one pass
+        # and exported as a single image, no per zone tasks or mosaic downstream
+        with span("build_graph", zones=sorted(zone_lookups)):
+            merged_out = merged_canopy_guide(
+                packing,
+                zone_lookups,
+                zones,
+                dist_img,
+                {"ZONE": zone_img, "BPS": bps_img, "EVH": evh_img, "EVC": evc_img, "EVT": evt_img},
+                old_cg,
+            )
+
+            task = ee.batch.Export.image.toAsset(
+                image=with_provenance(merged_out, key, provenance),
+                description=f"canopy_guide_export_{os.path.basename(dist_img_path)}",
+                assetId=asset_id,
+                region=region,
+                scale=scale,
+                crs=crs,
+                maxPixels=1e12,
+                pyramidingPolicy={".default": "mode"},
+            )
+        logger.info(f"Exporting {asset_id}")
+        with span("submit_export", asset_id=asset_id):
+            task.start()
+        return stage_report([task.id], [])
+
     # define the collection to dump data to
     # this needs to be an image collection as each zone is exported individually
     # output_ic = f"projects/pyregence-ee/assets/conus/fuels/canopy_guide_{version}"
-    output_ic = f"{out_folder_path}/canopy_guide_collection" # canopy guide is exported as zone-wise imgs into its own imageCollection, so we need to back up one path to the parent folder and make a canopy guide imgColl
-    os.popen(f"earthengine create collection {output_ic}")
+    output_ic = f"{out_folder_path}/{CANOPY_GUIDE_COLLECTION}" # canopy guide is exported as zone-wise imgs into its own imageCollection, so we need to back up one path to the parent folder and make a canopy guide imgColl
+    # the merged image of an earlier -m run would be read instead of the collection
+    remove_output(f"{out_folder_path}/{MERGED_CANOPY_GUIDE}")
+    ensure_collection(output_ic)
     
     # loop through each zone to do the FM40 calculation
-    for zone in zones:
-        # skip over zone 11, there is no zone 11
-        if zone == 11:
+    # zones without disturbed pixels are not exported, stage_assets reads them back as the baseline
+    # so zone images left from an earlier run with other disturbed zones are removed
+    zone_assets = {zone: output_ic + f"/new_canopy_zone{zone:02d}" for zone in disturbed_zones}
+    prune_collection(output_ic, list(zone_assets.values()))
+    task_ids, skipped = [], []
+    for zone in disturbed_zones:
+        asset_id = zone_assets[zone]
+        key = output_key(provenance, asset_id)
+        if up_to_date(asset_id, key, args.force):
+            skipped.append(asset_id)
             continue
 
-        # plug in the zone value into the table uri string
-        uri = base_uri.format(zone)
-        # read in the table from cloud storage
-        blob = ee.Blob(uri)
-
-        # parse the table as an ee.Dictionary
-        table = parse_txt(blob)
-
-        # legacy code to encode the table values if not done so already
-        # from_codes = ee.List(encode_table(table))
-
-        # read in the encoded value list as numeric
-        from_codes = to_numeric(ee.List(table.get("encoded")))
-        # read the list of values to remap to as numeric
-        to_codes = to_numeric(ee.List(table.get("NewCanopy")))
-
-        # apply the remapping encoded values -> NewCanopy values
-        zone_newcanopy_remapped = encoded_img.remap(from_codes, to_codes) #non-matches return null (masked) value
-
-        dist_high_harvest = dist_img.selfMask().lte(333).bitwiseAnd(dist_img.selfMask().gte(331)) # high harvest = 1
-
-        # Initialize a CG raster of 1's and burn in actual remapped CG values overtop (CG=1 means leave fuels value as-is)
-        # then mask areas that are not current zone        
-        zone_newcanopy = (           
-            #ee.Image.constant(1) 
-            old_cg # AFF - starting with FFv1 canopy guide, not making CG from scratch
-            .where(dist_img.selfMask(), zone_newcanopy_remapped) #returns 1 if zone_newcanopy_remapped is null in disturbed area
-            .where(dist_high_harvest.eq(1),0) # zero out CG in high harvest disturbed areas
-            .updateMask(zone_img.eq(zone))
-            .rename("newCanopy")
-            .byte() #valid values are 0-3
-        )
+        with span("build_graph", zone=zone, table_rows=zone_lookups[zone][0].size):
+            # packed table keys (same layout as the image) and the values to remap to
+            from_codes, to_codes = zone_lookups[zone]
+            from_codes = from_codes.tolist()
+            to_codes = to_codes.tolist()
+
+            # apply the remapping encoded values -> NewCanopy values
+            zone_newcanopy_remapped = encoded_img.remap(from_codes, to_codes) #non-matches return null (masked) value
+
+            dist_high_harvest = dist_img.selfMask().lte(333).bitwiseAnd(dist_img.selfMask().gte(331)) # high harvest = 1
+
+            # Initialize a CG raster of 1's and burn in actual remapped CG values overtop (CG=1 means leave fuels value as-is)
+            # then mask areas that are not current zone        
+            zone_newcanopy = (           
+                #ee.Image.constant(1) 
+                old_cg # AFF - starting with FFv1 canopy guide, not making CG from scratch
+                .where(dist_img.selfMask(), zone_newcanopy_remapped) #returns 1 if zone_newcanopy_remapped is null in disturbed area
+                .where(dist_high_harvest.eq(1),0) # zero out CG in high harvest disturbed areas
+                .updateMask(zone_img.eq(zone))
+                .rename("newCanopy")
+                .byte() #valid values are 0-3
+            )
                 
-        # create an image with information of what happened where
-        # if disturbed and has new value flag = 0
-        # if not distubed (i.e. initial 1 value) flag = 1
-        # if disturbed and has no remapped code flag = 2
-        # if outside of zone flag = 3
-        flags = (
-            dist_img.Not() 
-            .where(zone_newcanopy.add(1).selfMask().eq(0), 2) # .add(1) so 0 is no longer a valid value and can be masked
-            .where(zone_img.neq(zone), 3)
-            .updateMask(zone_img.selfMask())
-            .uint8()
-            .rename("qa_flags")
-        )
-
-        # combine new CG layer and flags
-        zone_out = ee.Image.cat([zone_newcanopy, flags]).set(
-            "zone", zone
-        )  # set zone metadata
-
-        # set up export task
-        # each zone will be all of CONUS with same projection/spatial extent
-        # this is to prevent any pixel misalignment at edges of zone
-        asset_id = output_ic + f"/new_canopy_zone{zone:02d}"
-        task = ee.batch.Export.image.toAsset(
-            image=zone_out,
-            description=f"Zone{zone:02d}_canopy_guide_export_{os.path.basename(dist_img_path)}",
-            assetId=asset_id,
-            region=dist_img.geometry(),
-            scale=scale,
-            crs=crs,
-            maxPixels=1e12,
-            pyramidingPolicy={".default": "mode"},
-        )
+            # create an image with information of what happened where
+            # if disturbed and has new value flag = 0
+            # if not distubed (i.e. initial 1 value) flag = 1
+            # if disturbed and has no remapped code flag = 2
+            # if outside of zone flag = 3
+            flags = (
+                dist_img.Not() 
+                .where(dist_img.neq(0).And(zone_newcanopy_remapped.mask().Not()), 2) # remap is masked where there is no code, zone_newcanopy falls back to the old value there
+                .where(zone_img.neq(zone), 3)
+                .updateMask(zone_img.selfMask())
+                .uint8()
+                .rename("qa_flags")
+            )
+
+            # combine new CG layer and flags
+            zone_out = ee.Image.cat([zone_newcanopy, flags]).set(
+                "zone", zone
+            )  # set zone metadata
+
+            # set up export task
+            # each zone will be all of CONUS with same projection/spatial extent
+            # this is to prevent any pixel misalignment at edges of zone
+            task = ee.batch.Export.image.toAsset(
+                image=with_provenance(zone_out, key, provenance),
+                description=f"Zone{zone:02d}_canopy_guide_export_{os.path.basename(dist_img_path)}",
+                assetId=asset_id,
+                region=region,
+                scale=scale,
+                crs=crs,
+                maxPixels=1e12,
+                pyramidingPolicy={".default": "mode"},
+            )
         logger.info(f"Exporting {asset_id}")
-        task.start()
+        with span("submit_export", asset_id=asset_id, zone=zone):
+            task.start()
+            task_ids.append(task.id)
     
-        
+    return stage_report(task_ids, skipped)
+
+
 # main level process if running as script
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    print_report(main())
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Script used as the single entry point of the fuel update pipeline
+Every script is a subcommand that runs in this process: `run` schedules every stage of every scenario
+(see schedule_stages.py) and the stage scripts it launches are called in process, so a batch of scenarios
+pays for one interpreter start, one import of ee/yaml, one config parse and one Earth Engine initialization
+Usage:
+    $ python optx.py run -c path/to/config -d path/to/DIST_a path/to/DIST_b -f pyrologix -a path/to/aoi --drive_folder PC448_Fuelscapes
+    $ python optx.py canopy_guide -c path/to/config -d path/to/dist -o path/to/output -m
+    $ python optx.py <command> -h
+"""
+import os
+import sys
+import logging
+import importlib
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=os.path.join(os.path.dirname(__file__), 'optx.log')
+)
+
+# {subcommand: script module}, the module's main takes the script's own args
+COMMANDS = {
+    "run": "schedule_stages",
+    "canopy_guide": "create_canopy_guide",
+    "fm40": "calc_FM40",
+    "cc_ch": "calc_CC_CH",
+    "cbd_cbh": "calc_CBD_CBH",
+    "interactive": "calc_fuelscape_interactive",
+    "local": "calc_fuelscape_local",
+    "fm40_local": "calc_FM40_local",
+    "cache_baselines": "cache_baselines",
+    "compile_tables": "compile_tables",
+}
+
+
+def run_command(command: str, argv: list = None):
+    """Function to run a subcommand in this process
+    args:
+        command (str): key of COMMANDS
+        argv (list): args of the script, e.g. ["-c", "config.yml", ...]
+    returns:
+        whatever the script's main returns
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"{command} is not an optx command. Valid commands: {', '.join(COMMANDS)}")
+    # the scripts import their helpers as utils.*, relative to this folder
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    # imported on use, the local commands never import ee
+    module = importlib.import_module(COMMANDS[command])
+    return module.main(list(argv or []))
+
+
+def main(argv: list = None):
+    """Main level function dispatching to the subcommand scripts"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        print(f"usage: optx.py <command> [args], commands: {', '.join(COMMANDS)}")
+        sys.exit(0 if argv and argv[0] in ("-h", "--help") else 2)
+    run_command(argv[0], argv[1:])
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Script used to run every fuel update stage for 1 to MANY DIST scenarios as a dependency DAG,
+launching each stage the moment the export tasks it depends on have completed
+(replaces the manual waits between the cells of UpdateFuels.ipynb)
+The stage scripts run in this process (one interpreter, one EE initialization), --subprocess starts one per stage
+Usage:
+    $ python schedule_stages.py -c path/to/config -d path/to/DIST_a path/to/DIST_b -f pyrologix -a path/to/aoi --drive_folder PC448_Fuelscapes
+"""
+import os
+import sys
+import argparse
+import logging
+import functools
+from utils.yml_params import load_config
+from utils.stage_scheduler import scenario_stages, run_stages, EETaskBackend, LocalTaskBackend, COMPLETED
+from utils.tracing import init_tracing, traced, current_span
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s",
+    datefmt="%Y-%m-%d %I:%M:%S %p",
+    level=logging.WARNING,
+    filename=os.path.join(os.path.dirname(__file__), 'schedule_stages.log')
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logging.getLogger("utils.stage_scheduler").setLevel(logging.INFO)
+
+
+def stack_export(fuels_folder: str, dist_img_path: str, aoi: str, geo_info: dict, drive_folder: str, fuels_source: str) -> list:
+    """Function to start the Google Drive export of a scenario's fuel stack, the last stage of its DAG
+    args:
+        fuels_folder (str): asset path of the scenario fuelscape folder
+        dist_img_path (str): asset path of the scenario DIST img
+        aoi (str): asset path of the AOI the export region is snapped from
+        geo_info (dict): geo section of the config file
+        drive_folder (str): Google Drive folder
+        fuels_source (str): firefactor or pyrologix
+    returns:
+        list: id of the started export task
+    """
+    import ee
+    from utils.stage_assets import export_fuel_stack
+    from utils.aoi import export_region
+
+    region = export_region(aoi, ee.Image(dist_img_path), geo_info["crsTransform"], geo_info["crs"])
+    return [export_fuel_stack(fuels_folder, region, geo_info["crs"], geo_info["scale"], drive_folder, fuels_source)]
+
+
+@traced("schedule_stages")
+def main(argv: list = None):
+    """Main level function for running the fuel update stages of every scenario"""
+
+    # initalize new cli parser
+    parser = argparse.ArgumentParser(
+        description="CLI process for running the fuel update stages of each DIST scenario as a DAG."
+    )
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        help="path to config file",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dist_img_paths",
+        type=str,
+        nargs="+",
+        help="asset paths of the scenario DIST imgs, fuel layers go to <path>_fuelscape"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fuels_source",
+        type=str,
+        help="source of baseline fuels dataset. One of: firefactor, pyrologix"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--tables_bundle",
+        type=str,
+        help="optional local path of a table bundle from compile_tables.py"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--aoi",
+        type=str,
+        help="Earth Engine asset path of the template image or feature collection every stage computes/exports over and the fuel stack export region"
+    )
+
+    parser.add_argument(
+        "--drive_folder",
+        type=str,
+        help="Google Drive folder for the fuel stack exports, no stack export if not given"
+    )
+
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=30,
+        help="seconds between task status polls. default = 30"
+    )
+
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="run the DAG against the offline stand-in task backend instead of Earth Engine"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="pass --force to every stage script, exporting all outputs again even if their content key is unchanged"
+    )
+
+    parser.add_argument(
+        "--subprocess",
+        action="store_true",
+        help="run every stage script in its own python process instead of in this one"
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="optional JSON-lines file the spans of the scheduler, every stage script and every export task are appended to"
+    )
+
+    args = parser.parse_args(argv)
+
+    # the stage scripts inherit the trace file and run id, so one run gives one trace
+    run_id = init_tracing(args.trace)
+    current_span().set(scenarios=[os.path.basename(path) for path in args.dist_img_paths], dry_run=args.dry_run)
+    if run_id is not None:
+        logger.info(f"tracing run {run_id} to {args.trace}")
+
+    if args.fuels_source not in ["firefactor", "pyrologix"]:
+        raise ValueError(f"{args.fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+
+    if args.drive_folder is not None and args.aoi is None:
+        raise ValueError("--drive_folder needs an -a/--aoi asset for the export region")
+
+    config = load_config(args.config)
+
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    extra_args = ["-t", args.tables_bundle] if args.tables_bundle is not None else []
+    if args.aoi is not None:
+        # every stage computes and exports over the same grid-snapped AOI window
+        extra_args += ["-a", args.aoi]
+    if args.force:
+        extra_args += ["--force"]
+
+    if args.dry_run:
+        backend = LocalTaskBackend()
+    else:
+        from utils.stage_assets import ensure_folder
+        from utils.ee_session import initialize
+
+        # one initialization for the scheduler and every stage it runs in process
+        initialize()
+        backend = EETaskBackend(in_process=not args.subprocess)
+
+    stages = []
+    for dist_img_path in args.dist_img_paths:
+        fuels_folder = dist_img_path + "_fuelscape"
+        scenario = fuels_folder.split("/")[-1]
+
+        scenario_export = None
+        if args.drive_folder is not None and not args.dry_run:
+            scenario_export = functools.partial(
+                stack_export, fuels_folder, dist_img_path, args.aoi, config["geo"], args.drive_folder, args.fuels_source
+            )
+
+        if not args.dry_run:
+            # create the scenario fuelscape folder if it does not exist yet
+            if ensure_folder(fuels_folder):
+                logger.info(f"Created Folder: {fuels_folder}")
+
+        stages += scenario_stages(
+            scenario,
+            args.config,
+            dist_img_path,
+            fuels_folder,
+            args.fuels_source,
+            scripts_dir,
+            python=sys.executable,
+            extra_args=extra_args,
+            stack_export=scenario_export,
+        )
+
+    # runs in a worker thread when called from a notebook kernel, which already has an event loop
+    results = run_stages(stages, backend, poll_interval=args.poll)
+    for name, state in results.items():
+        logger.info(f"{name}: {state}")
+        print(f"{name}: {state}")
+
+    if any(state != COMPLETED for state in results.values()):
+        sys.exit(1)
+
+
+# main level process if running as script
+if __name__ == "__main__":
+    main()
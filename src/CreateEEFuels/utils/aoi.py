@@ -0,0 +1,77 @@
+"""
+Script for defining functions to get the shared area of interest every stage computes and exports over
+The AOI is either an -a asset (template image or feature collection, same as rasterize_treatments_ee_custom.py)
+or the footprint of the DIST image, as a rectangle snapped outward to the config crsTransform grid
+"""
+
+import math
+import ee
+
+
+def read_aoi(aoi_path: str) -> ee.Geometry:
+    """Function to get the geometry of an AOI asset
+    args:
+        aoi_path (str): Earth Engine asset path of a template image or feature collection
+    returns:
+        ee.Geometry: AOI geometry
+    """
+    asset_type = ee.data.getAsset(aoi_path).get('type') # determine what it is
+    if asset_type == "IMAGE":
+        return ee.Image(aoi_path).geometry()
+    elif asset_type in ("TABLE", "FEATURE_COLLECTION"):
+        return ee.FeatureCollection(aoi_path).geometry()
+    raise RuntimeError(f"{asset_type} is not one of IMAGE or TABLE")
+
+
+def snap_bounds(bounds: tuple, geo_t: list) -> tuple:
+    """Function to snap (xmin, ymin, xmax, ymax) bounds outward to the config grid
+    args:
+        bounds (tuple): (xmin, ymin, xmax, ymax) in the config crs
+        geo_t (list): config crsTransform [xScale, xShear, xTranslation, yShear, yScale, yTranslation]
+    returns:
+        tuple: snapped (xmin, ymin, xmax, ymax)
+    """
+    x_scale, _, x0, _, y_scale, y0 = geo_t
+    xmin, ymin, xmax, ymax = bounds
+    # column/row edges of the grid cells holding the bounds, yScale is negative (north up)
+    col0 = math.floor((xmin - x0) / x_scale)
+    col1 = math.ceil((xmax - x0) / x_scale)
+    row0 = math.floor((ymax - y0) / y_scale)
+    row1 = math.ceil((ymin - y0) / y_scale)
+    return (x0 + col0 * x_scale, y0 + row1 * y_scale, x0 + col1 * x_scale, y0 + row0 * y_scale)
+
+
+def region_bounds(aoi_path: str, dist_img: ee.Image, geo_t: list, crs: str) -> tuple:
+    """Function to get the grid-snapped (xmin, ymin, xmax, ymax) bounds every stage computes and exports over
+    args:
+        aoi_path (str): optional AOI asset path, the DIST image footprint is used if None
+        dist_img (ee.Image): DIST image of the scenario
+        geo_t (list): config crsTransform
+        crs (str): config crs
+    returns:
+        tuple: bounds in the config crs aligned to the config grid
+    """
+    geometry = dist_img.geometry() if aoi_path is None else read_aoi(aoi_path)
+    # one round trip for the bounds, the snapping is plain arithmetic
+    ring = geometry.bounds(maxError=1, proj=crs).coordinates().get(0).getInfo()
+    xs = [pt[0] for pt in ring]
+    ys = [pt[1] for pt in ring]
+    return snap_bounds((min(xs), min(ys), max(xs), max(ys)), geo_t)
+
+
+def bounds_region(bounds: tuple, crs: str) -> ee.Geometry:
+    """Helper function to get the rectangle of region_bounds as a geometry in the config crs"""
+    return ee.Geometry.Rectangle(list(bounds), proj=crs, geodesic=False)
+
+
+def export_region(aoi_path: str, dist_img: ee.Image, geo_t: list, crs: str) -> ee.Geometry:
+    """Function to get the grid-snapped bounding rectangle every stage computes and exports over
+    args:
+        aoi_path (str): optional AOI asset path, the DIST image footprint is used if None
+        dist_img (ee.Image): DIST image of the scenario
+        geo_t (list): config crsTransform
+        crs (str): config crs
+    returns:
+        ee.Geometry: rectangle in the config crs aligned to the config grid
+    """
+    return bounds_region(region_bounds(aoi_path, dist_img, geo_t, crs), crs)
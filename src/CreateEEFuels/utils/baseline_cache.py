@@ -0,0 +1,283 @@
+"""
+Script for defining the local baseline cache the local backend reads its inputs from
+Each baseline layer (version 200 LANDFIRE, zones, canopy guide, baseline fuels) is fetched once per AOI,
+from Earth Engine or from exported GeoTIFFs, clipped to the AOI window of the config grid and stored as a .npy file.
+registry.json describes every file (layer, fuels source, source asset or file, its version, grid window and dtype),
+so a layer is only fetched again when its source version changes or a new AOI needs it.
+Reads memory-map the files and return views of the requested window, nothing is copied or decoded
+unless the window runs past the cached extent.
+Pass the cache folder as the inputs folder (-i) of the local scripts, see local_inputs.read_inputs.
+"""
+
+import os
+import json
+import time
+import numpy as np
+from rasterio.transform import Affine
+from utils.pixel_fetch import fetch_window
+
+REGISTRY = "registry.json"
+REGISTRY_VERSION = 1
+
+# Earth Engine source of every layer, {name: (asset id, how the image is taken from it)}
+# v200: first version 200 image of a collection, image: the asset itself, mosaic: mosaic of the collection
+EE_LAYERS = {
+    "bps": ("projects/pyregence-ee/assets/conus/landfire/bps", "v200"),
+    "evt": ("projects/pyregence-ee/assets/conus/landfire/fvt", "v200"),
+    "evh": ("projects/pyregence-ee/assets/conus/landfire/fvh", "v200"),
+    "evc": ("projects/pyregence-ee/assets/conus/landfire/fvc", "v200"),
+    "fvc_mid": ("projects/pyregence-ee/assets/conus/fuels/Midpoint_CC", "v200"),
+    "fvh_mid": ("projects/pyregence-ee/assets/conus/fuels/Midpoint_CH", "v200"),
+    "zone": ("projects/pyregence-ee/assets/conus/landfire/zones_image", "image"),
+    "cg": ("projects/pyregence-ee/assets/conus/fuels/canopy_guide_2021_12_v1", "mosaic"),
+}
+
+# baseline fuels of each fuels source, same assets as the EE scripts
+EE_BASELINES = {
+    "firefactor": {
+        "cc": "projects/pyregence-ee/assets/conus/fuels/Fuels_CC_2021_12",
+        "ch": "projects/pyregence-ee/assets/conus/fuels/Fuels_CH_2021_12",
+        "cbh": "projects/pyregence-ee/assets/conus/fuels/Fuels_CBH_2021_12",
+        "cbd": "projects/pyregence-ee/assets/conus/fuels/Fuels_CBD_2021_12",
+        "fm40": "projects/pyregence-ee/assets/conus/fuels/Fuels_FM40_WUI_IrrigatedConversion_2022_10",
+    },
+    "pyrologix": {
+        "cc": "projects/pyregence-ee/assets/subconus/california/pyrologix/cc/cc2022",
+        "ch": "projects/pyregence-ee/assets/subconus/california/pyrologix/ch/ch2022",
+        "cbh": "projects/pyregence-ee/assets/subconus/california/pyrologix/cbh/cbh2022",
+        "cbd": "projects/pyregence-ee/assets/subconus/california/pyrologix/cbd/cbd2022",
+        "fm40": "projects/pyregence-ee/assets/subconus/california/pyrologix/fm40/fm402022",
+    },
+}
+
+# memory maps opened by this process, {file path: ((st_ino, st_mtime_ns), np.memmap)}
+_maps = {}
+
+
+def is_cache(path: str) -> bool:
+    """Helper function to check whether a folder is a baseline cache (holds a registry)"""
+    return os.path.exists(os.path.join(path, REGISTRY))
+
+
+def load_registry(cache_dir: str) -> dict:
+    """Function to read the registry of a cache, an empty one if the folder is not a cache yet"""
+    if not is_cache(cache_dir):
+        return {"version": REGISTRY_VERSION, "layers": {}}
+    with open(os.path.join(cache_dir, REGISTRY)) as file:
+        return json.load(file)
+
+
+def save_registry(cache_dir: str, registry: dict):
+    """Helper function to replace the registry in one step, readers never see a partial file"""
+    tmp_path = os.path.join(cache_dir, f"{REGISTRY}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(registry, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(cache_dir, REGISTRY))
+
+
+def layer_key(name: str, fuels_source: str, window) -> str:
+    """Helper function to get the registry key (and file stem) of a layer over a grid window"""
+    prefix = name if fuels_source is None else f"{name}_{fuels_source}"
+    return f"{prefix}__r{int(window.row_off)}_c{int(window.col_off)}_h{int(window.height)}_w{int(window.width)}"
+
+
+def cached_version(cache_dir: str, name: str, source: str, window, fuels_source: str = None) -> str:
+    """Function to get the source version a layer is cached at over a window, None if it is not cached"""
+    entry = load_registry(cache_dir)["layers"].get(layer_key(name, fuels_source, window))
+    if entry is None or entry["source"] != source:
+        return None
+    return entry["version"]
+
+
+def cache_layer(
+    cache_dir: str,
+    name: str,
+    array: np.ndarray,
+    geo_info: dict,
+    window,
+    source: str,
+    version: str,
+    fuels_source: str = None,
+) -> dict:
+    """Function to store a layer over a grid window and register it
+    args:
+        cache_dir (str): cache folder
+        name (str): key of local_inputs.LANDFIRE_INPUTS or BASELINE_INPUTS
+        array (np.ndarray): 2D array of the layer over the window, nodata already filled with 0
+        geo_info (dict): geo section of the config file
+        window (Window): window of the config grid the array covers
+        source (str): asset id or file path the layer was read from
+        version (str): version of the source, e.g. the asset updateTime
+        fuels_source (str): firefactor or pyrologix for the baseline fuel layers. default = None
+    returns:
+        dict: registry entry of the layer
+    """
+    if array.shape != (int(window.height), int(window.width)):
+        raise ValueError(f"{name} array shape {array.shape} does not match the window {window}")
+    os.makedirs(cache_dir, exist_ok=True)
+    key = layer_key(name, fuels_source, window)
+    file_name = f"{key}.npy"
+    # written next to the final file and moved in place, a memory map of the old file stays valid
+    tmp_path = os.path.join(cache_dir, f"{key}.tmp.npy")
+    np.save(tmp_path, np.ascontiguousarray(array))
+    os.replace(tmp_path, os.path.join(cache_dir, file_name))
+    _maps.pop(os.path.join(cache_dir, file_name), None)
+
+    transform = Affine(*geo_info["crsTransform"]) * Affine.translation(int(window.col_off), int(window.row_off))
+    entry = {
+        "name": name,
+        "fuels_source": fuels_source,
+        "source": source,
+        "version": version,
+        "file": file_name,
+        "dtype": str(array.dtype),
+        "shape": list(array.shape),
+        "transform": list(transform)[:6],
+        "crs": geo_info["crs"],
+        "cached_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    registry = load_registry(cache_dir)
+    registry["layers"][key] = entry
+    save_registry(cache_dir, registry)
+    return entry
+
+
+def _memmap(path: str) -> np.ndarray:
+    """Helper function to memory-map a cached layer once per version of its file
+    cache_layer moves a new file in place of the old one, its inode and mtime differ so it is mapped again
+    """
+    stat = os.stat(path)
+    version = (stat.st_ino, stat.st_mtime_ns)
+    if path not in _maps or _maps[path][0] != version:
+        _maps[path] = (version, np.load(path, mmap_mode="r"))
+    return _maps[path][1]
+
+
+def _pixel_window(entry: dict, bounds: tuple) -> tuple:
+    """Helper function to get the (row, col, height, width) of bounds in the pixels of a cached layer"""
+    inv = ~Affine(*entry["transform"])
+    left, bottom, right, top = bounds
+    col0, row0 = inv * (left, top)
+    col1, row1 = inv * (right, bottom)
+    # same rounding as raster_io.read_window (round_offsets / round_lengths)
+    row, col = int(np.floor(row0 + 0.1)), int(np.floor(col0 + 0.1))
+    return row, col, int(np.floor(row1 - row0 + 0.5)), int(np.floor(col1 - col0 + 0.5))
+
+
+def find_layer(registry: dict, name: str, bounds: tuple, fuels_source: str = None) -> dict:
+    """Function to pick the cached layer covering bounds, the one with the largest overlap if none covers them all
+    args:
+        registry (dict): registry from load_registry
+        name (str): key of local_inputs.LANDFIRE_INPUTS or BASELINE_INPUTS
+        bounds (tuple): (left, bottom, right, top) in the config crs
+        fuels_source (str): firefactor or pyrologix for the baseline fuel layers
+    returns:
+        dict: registry entry
+    """
+    best, best_overlap = None, 0
+    for entry in registry["layers"].values():
+        if entry["name"] != name or entry["fuels_source"] != fuels_source:
+            continue
+        row, col, height, width = _pixel_window(entry, bounds)
+        rows, cols = entry["shape"]
+        overlap = max(min(row + height, rows) - max(row, 0), 0) * max(min(col + width, cols) - max(col, 0), 0)
+        if overlap == height * width:
+            return entry
+        if overlap > best_overlap:
+            best, best_overlap = entry, overlap
+    if best is None:
+        label = name if fuels_source is None else f"{name} ({fuels_source})"
+        raise KeyError(f"no cached {label} layer overlaps {bounds}, run cache_baselines.py for this AOI")
+    return best
+
+
+def cached_versions(cache_dir: str, names: list, bounds: tuple, fuels_source: str = None) -> dict:
+    """Function to get the source versions of the cached layers read_cached reads over bounds
+    returns:
+        dict: {name: "<source>@<version>"}
+    """
+    registry = load_registry(cache_dir)
+    versions = {}
+    for name in names:
+        entry = find_layer(registry, name, bounds, None if name in EE_LAYERS else fuels_source)
+        versions[name] = f"{entry['source']}@{entry['version']}"
+    return versions
+
+
+def read_cached(cache_dir: str, names: list, bounds: tuple, fuels_source: str = None, fill_value: int = 0) -> dict:
+    """Function to read a set of named layers over the same bounds from the cache, same result as local_inputs.read_inputs
+    windows inside the cached extent are read-only views of the memory-mapped files
+    args:
+        cache_dir (str): cache folder
+        names (list): keys of local_inputs.LANDFIRE_INPUTS or BASELINE_INPUTS
+        bounds (tuple): (left, bottom, right, top) in the config crs
+        fuels_source (str): firefactor or pyrologix, needed for the baseline layers
+        fill_value (int): value of the pixels outside of the cached extent. default = 0
+    returns:
+        dict: {name: 2D np.ndarray}
+    """
+    registry = load_registry(cache_dir)
+    arrays = {}
+    for name in names:
+        # the LANDFIRE layers are shared by both fuels sources
+        entry = find_layer(registry, name, bounds, None if name in EE_LAYERS else fuels_source)
+        data = _memmap(os.path.join(cache_dir, entry["file"]))
+        row, col, height, width = _pixel_window(entry, bounds)
+        rows, cols = data.shape
+        if row >= 0 and col >= 0 and row + height <= rows and col + width <= cols:
+            arrays[name] = data[row:row + height, col:col + width]
+            continue
+        # boundless read, like read_window
+        out = np.full((height, width), fill_value, dtype=data.dtype)
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + height, rows), min(col + width, cols)
+        if r1 > r0 and c1 > c0:
+            out[r0 - row:r1 - row, c0 - col:c1 - col] = data[r0:r1, c0:c1]
+        arrays[name] = out
+    return arrays
+
+
+def ee_layer(name: str, fuels_source: str = None) -> tuple:
+    """Function to get the Earth Engine image of a layer and the asset it comes from
+    args:
+        name (str): key of EE_LAYERS or of the EE_BASELINES of the fuels source
+        fuels_source (str): firefactor or pyrologix for the baseline fuel layers
+    returns:
+        tuple: (single band ee.Image with masked pixels set to 0, asset id)
+    """
+    # imported here so reading the cache works without earthengine-api
+    import ee
+
+    if name in EE_LAYERS:
+        asset_id, kind = EE_LAYERS[name]
+    else:
+        if fuels_source not in EE_BASELINES:
+            raise ValueError(f"{fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+        asset_id, kind = EE_BASELINES[fuels_source][name], "image"
+
+    if kind == "v200":
+        # same selection as the EE scripts
+        image = ee.Image(
+            ee.ImageCollection(asset_id).filter(ee.Filter.eq("version", 200)).limit(1, "system:time_start").first()
+        )
+    elif kind == "mosaic":
+        image = ee.ImageCollection(asset_id).select("newCanopy").mosaic()
+    else:
+        image = ee.Image(asset_id)
+    return image.select(0).unmask(0), asset_id
+
+
+def fetch_ee_layer(image, geo_info: dict, window, chunk_size: int = 2048, workers: int = 4, client=None) -> np.ndarray:
+    """Function to download an Earth Engine image over a grid window with computePixels, chunk by chunk
+    args:
+        image (ee.Image): single band image
+        geo_info (dict): geo section of the config file
+        window (Window): window of the config grid
+        chunk_size (int): chunk edge in pixels, keeps each request under the computePixels size limit. default = 2048
+        workers (int): chunk requests in flight. default = 4
+        client: computePixels client, see pixel_fetch.py. default = Earth Engine
+    returns:
+        np.ndarray: 2D array over the window
+    """
+    band = "layer"
+    return fetch_window(image.rename(band), geo_info, window, [band], client, chunk_size, workers)[band]
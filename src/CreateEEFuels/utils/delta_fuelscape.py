@@ -0,0 +1,184 @@
+"""
+Script for defining the sparse delta format of the local fuel stack and its window reader
+Only disturbed pixels differ from the baseline fuels, so instead of a full 5 band int16 raster per scenario
+a delta file stores the pixels that differ from the reference (the baseline FM40/CC/CH/CBH/CBD GeoTIFFs
+masked outside of CONUS) plus a pointer to those baseline files. Size then follows the treated area.
+
+File layout (zip, deflated):
+    meta.json                                  grid, bands, baseline reference and the list of chunks
+the baseline reference holds the version of every baseline layer (see local_inputs.input_versions), a delta read
+against baseline layers that changed since it was written raises instead of rebuilding a wrong stack
+    {band}/{row}_{col}_{height}_{width}/idx.npy     uint32 flat indices of the changed pixels in the chunk window
+    {band}/{row}_{col}_{height}_{width}/values.npy  int16 values of the changed pixels
+chunk windows are the tiles the engine wrote, in pixel coordinates of the delta extent
+"""
+
+import io
+import os
+import json
+import zipfile
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from utils.local_fuels import NODATA_INT16, STACK_BANDS
+from utils.local_inputs import read_inputs, input_versions
+
+DELTA_VERSION = 2
+
+# marker the kernel puts on pixels equal to the reference, fuel values never get this low
+UNCHANGED = -32767
+
+# baseline input of each stack band, see local_inputs.BASELINE_INPUTS
+BAND_INPUTS = {"FM40": "fm40", "CC": "cc", "CH": "ch", "CBH": "cbh", "CBD": "cbd"}
+
+# inputs the reference is built from
+REFERENCE_INPUTS = list(BAND_INPUTS.values()) + ["zone"]
+
+
+def reference_stack(arrays: dict) -> np.ndarray:
+    """Function to build the reference the deltas are taken against from the baseline inputs
+    args:
+        arrays (dict): {name: 2D array} holding "zone" and the BAND_INPUTS baseline layers
+    returns:
+        np.ndarray: (5, rows, cols) int16 baseline stack, NODATA_INT16 outside of CONUS
+    """
+    stack = np.stack([arrays[BAND_INPUTS[band]] for band in STACK_BANDS]).astype(np.int16)
+    stack[:, arrays["zone"] == 0] = NODATA_INT16
+    return stack
+
+
+def baseline_reference(inputs_dir: str, fuels_source: str, bounds: tuple) -> dict:
+    """Function to describe the baseline a delta file is taken against, stored in its metadata
+    args:
+        inputs_dir (str): folder of the baseline GeoTIFFs or a baseline cache folder
+        fuels_source (str): firefactor or pyrologix
+        bounds (tuple): (left, bottom, right, top) of the delta extent in the config crs
+    returns:
+        dict: {"inputs_dir", "fuels_source", "versions": {input name: version}}
+    """
+    return {
+        "inputs_dir": os.path.abspath(inputs_dir),
+        "fuels_source": fuels_source,
+        "versions": input_versions(inputs_dir, REFERENCE_INPUTS, bounds, fuels_source),
+    }
+
+
+def to_delta(values: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Helper function to replace the pixels equal to the reference with UNCHANGED"""
+    return np.where(values == reference, UNCHANGED, values).astype(np.int16)
+
+
+def _write_npy(archive: zipfile.ZipFile, name: str, arr: np.ndarray):
+    """Helper function to write an array as a .npy member of the archive"""
+    buf = io.BytesIO()
+    np.save(buf, arr, allow_pickle=False)
+    archive.writestr(name, buf.getvalue())
+
+
+def _read_npy(archive: zipfile.ZipFile, name: str) -> np.ndarray:
+    """Helper function to read a .npy member of the archive"""
+    return np.load(io.BytesIO(archive.read(name)), allow_pickle=False)
+
+
+class DeltaWriter:
+    """Writer of a delta file, takes the same windowed band writes as a rasterio dataset
+    so utils/tile_engine.py run_tiles can stream into it. Pixels equal to UNCHANGED are not stored.
+
+    args:
+        path (str): local output file path
+        profile (dict): from tile_engine.window_profile, holds crs/transform/shape of the extent
+        baseline (dict): from baseline_reference, what the reader rebuilds the reference from
+    """
+
+    def __init__(self, path: str, profile: dict, baseline: dict):
+        self.name = path
+        self.dtypes = ["int16"] * len(STACK_BANDS)
+        self.meta = {
+            "version": DELTA_VERSION,
+            "crs": str(profile["crs"]),
+            "transform": list(profile["transform"])[:6],
+            "height": int(profile["height"]),
+            "width": int(profile["width"]),
+            "bands": list(STACK_BANDS),
+            "nodata": NODATA_INT16,
+            "baseline": baseline,
+            "chunks": [],
+        }
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, arr: np.ndarray, band: int, window: Window):
+        """Function to store the changed pixels of one band over a window of the extent"""
+        idx = np.flatnonzero(arr != UNCHANGED).astype(np.uint32)
+        if idx.size == 0:
+            return
+        row, col, height, width = int(window.row_off), int(window.col_off), int(window.height), int(window.width)
+        prefix = f"{STACK_BANDS[band - 1]}/{row}_{col}_{height}_{width}"
+        _write_npy(self.archive, f"{prefix}/idx.npy", idx)
+        _write_npy(self.archive, f"{prefix}/values.npy", arr.reshape(-1)[idx].astype(np.int16))
+        self.meta["chunks"].append(
+            {"band": STACK_BANDS[band - 1], "row": row, "col": col, "height": height, "width": width, "count": int(idx.size)}
+        )
+
+    def close(self):
+        """Function to write the metadata and close the file"""
+        if self.archive is None:
+            return
+        self.archive.writestr("meta.json", json.dumps(self.meta))
+        self.archive.close()
+        self.archive = None
+
+
+def read_meta(path: str) -> dict:
+    """Function to read the metadata of a delta file"""
+    with zipfile.ZipFile(path) as archive:
+        return json.loads(archive.read("meta.json"))
+
+
+def read_delta_window(path: str, window: Window = None, inputs_dir: str = None) -> np.ndarray:
+    """Function to rebuild the full fuel stack of a delta file over a window
+    only the chunks overlapping the window are read
+    args:
+        path (str): local delta file path
+        window (Window): window in pixel coordinates of the delta extent. default = whole extent
+        inputs_dir (str): folder of the baseline GeoTIFFs, overrides the one stored in the file
+    returns:
+        np.ndarray: (5, rows, cols) int16 fuel stack in STACK_BANDS order
+    """
+    with zipfile.ZipFile(path) as archive:
+        meta = json.loads(archive.read("meta.json"))
+        if meta["version"] != DELTA_VERSION:
+            raise ValueError(f"{path} is delta version {meta['version']}, expected {DELTA_VERSION}")
+        if window is None:
+            window = Window(0, 0, meta["width"], meta["height"])
+        row0, col0 = int(window.row_off), int(window.col_off)
+        row1, col1 = row0 + int(window.height), col0 + int(window.width)
+
+        baseline = meta["baseline"]
+        inputs_dir = inputs_dir or baseline["inputs_dir"]
+        bounds = rasterio.windows.bounds(window, Affine(*meta["transform"]))
+        versions = input_versions(inputs_dir, REFERENCE_INPUTS, bounds, baseline["fuels_source"])
+        changed = [name for name in REFERENCE_INPUTS if versions[name] != baseline["versions"].get(name)]
+        if changed:
+            raise ValueError(
+                f"baseline layers {changed} in {inputs_dir} changed since {path} was written "
+                f"({[baseline['versions'].get(name) for name in changed]} -> {[versions[name] for name in changed]})"
+            )
+        arrays = read_inputs(inputs_dir, REFERENCE_INPUTS, bounds, baseline["fuels_source"])
+        stack = reference_stack(arrays)
+
+        for chunk in meta["chunks"]:
+            # skip chunks that do not overlap the window
+            r0, c0 = max(chunk["row"], row0), max(chunk["col"], col0)
+            r1, c1 = min(chunk["row"] + chunk["height"], row1), min(chunk["col"] + chunk["width"], col1)
+            if r1 <= r0 or c1 <= c0:
+                continue
+            prefix = f"{chunk['band']}/{chunk['row']}_{chunk['col']}_{chunk['height']}_{chunk['width']}"
+            idx = _read_npy(archive, f"{prefix}/idx.npy")
+            values = _read_npy(archive, f"{prefix}/values.npy")
+            rows = chunk["row"] + idx // chunk["width"]
+            cols = chunk["col"] + idx % chunk["width"]
+            inside = (rows >= row0) & (rows < row1) & (cols >= col0) & (cols < col1)
+            band = meta["bands"].index(chunk["band"])
+            stack[band, rows[inside] - row0, cols[inside] - col0] = values[inside]
+    return stack
@@ -3,7 +3,7 @@ Script for defining functions for parsing csv data in earth engine
 """
 
 import ee
-ee.Initialize()
+
 
 def parse_txt(blob: ee.Blob, delim: str = ",", qualifier: str = '"') -> ee.Dictionary:
     """Function to parse csv objects from Cloud storage on EE
@@ -50,4 +50,14 @@ def to_numeric(list: ee.List) -> ee.List:
     returns
         ee.List: list containing numeric values
     """
-    return list.map(lambda x: ee.Number.parse(ee.String(x)))
\ No newline at end of file
+    return list.map(lambda x: ee.Number.parse(ee.String(x)))
+
+def fetch_table(uri: str) -> dict:
+    """Helper function to parse a csv on cloud storage and bring it client-side
+    args:
+        uri (str): gs:// uri of the csv
+    returns:
+        dict: dictionary representation of csv where keys are column names
+            and values are list of string values
+    """
+    return parse_txt(ee.Blob(uri)).getInfo()
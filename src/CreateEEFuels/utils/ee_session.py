@@ -0,0 +1,43 @@
+"""
+Script for defining the lazy, once per process Earth Engine initialization of the pipeline
+Nothing authenticates at import time: the EE stages call initialize() when they start, the first call
+authenticates (service account key if present, default credentials otherwise) and later calls are free,
+so running every stage of every scenario in one process (optx.py) pays for a single initialization
+"""
+
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# service account key used on the processing VM, default credentials are used when it is missing
+KEY_FILE = "/home/private-key.json"
+
+_state = {"initialized": False}
+_lock = threading.Lock()
+
+
+def initialize(project: str = None):
+    """Function to initialize Earth Engine once for this process, stages running in threads share it
+    args:
+        project (str): cloud project for the default credentials. default = the credentials' project
+    """
+    if _state["initialized"]:
+        return
+    with _lock:
+        if _state["initialized"]:
+            return
+        import ee
+
+        try:
+            credentials = ee.ServiceAccountCredentials(email=None, key_file=KEY_FILE)
+            ee.Initialize(credentials)
+        except Exception:
+            ee.Initialize(project=project)
+        _state["initialized"] = True
+        logger.info("Earth Engine initialized")
+
+
+def is_initialized() -> bool:
+    """Helper function to check whether initialize has run in this process"""
+    return _state["initialized"]
@@ -0,0 +1,364 @@
+"""
+Script for defining functions that build the Earth Engine images of each fuel stage from ee.Image inputs
+The stage scripts export these images to assets, calc_fuelscape_interactive.py chains them into one graph
+(canopy guide -> FM40, CC, CH -> CBH, CBD) and pulls the pixels without any intermediate asset
+"""
+
+import math
+import ee
+from utils.key_packing import pack_image, zone_packing, merge_zone_lookups
+from utils.table_bundle import disturbance_lookup
+
+# CC and CH regressions are binned to the midpoints of the LANDFIRE classes
+# {var: [(count, bin value)]} runs over the integer regression output starting at 0
+REGRESSION_BINS = {
+    "Cover": [(10, 0), (10, 15), (10, 25), (10, 35), (10, 45), (10, 55), (10, 65), (10, 75), (10, 85), (11, 95)],
+    "Height": [(1, 0)] + [(4, value) for value in range(3, 51, 4)] + [(3, 51)],
+}
+
+# EVT values of the pinyon/juniper types, they get their own CBD coefficient
+PJ_EVTS = [2017, 2019, 2025, 2059, 2115, 2116, 2119]
+
+
+def v200_image(collection_id: str) -> ee.Image:
+    """Helper function to get the version 200 (year 2016) image of a LANDFIRE collection
+    sometimes the date metadata is not actually 2016 so we filter by version and select the first image in time
+    """
+    return ee.Image(
+        ee.ImageCollection(collection_id)
+        .filter(ee.Filter.eq("version", 200))
+        .limit(1, "system:time_start")
+        .first()
+    )
+
+
+def disturbance_encoding(dist_img: ee.Image, evt_img: ee.Image) -> ee.Image:
+    """Helper function to encode DIST and EVT into the DIST*1e4 + EVT code of the disturbance tables"""
+    return dist_img.expression("a*as + b*bs", {"a": dist_img, "as": 1e4, "b": evt_img, "bs": 1e0})
+
+
+def bundle_regression_lookup(bundle: dict, var: str) -> tuple:
+    """Helper function to get the regression lookup of a disturbance table from a table bundle
+    returns:
+        tuple: (from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes) lists
+    """
+    lookup = disturbance_lookup(bundle, var)
+    return (
+        lookup["keys"].tolist(),
+        lookup["intercept"].tolist(),
+        lookup["HT_coef"].tolist(),
+        lookup["CC_coef"].tolist(),
+    )
+
+
+def merged_zone_remap(packing: dict, zone_lookups: dict, images: dict) -> ee.Image:
+    """Function to remap the pixels of every zone in one pass with the zone folded into the lookup key
+    args:
+        packing (dict): packing layout of the table fields
+        zone_lookups (dict): {zone number: (keys, values)} packed with packing
+        images (dict): {"ZONE", "DIST", "BPS", "EVH", "EVC", "EVT": ee.Image}
+    returns:
+        ee.Image: remapped values, masked where the key is not in a table
+    """
+    merged_packing = zone_packing(packing, sorted(zone_lookups))
+    from_codes, to_codes = merge_zone_lookups(merged_packing, zone_lookups)
+    zone_encoded_img = pack_image(merged_packing, images)
+    return zone_encoded_img.remap(from_codes.tolist(), to_codes.tolist()) #non-matches return null (masked) value
+
+
+def merged_canopy_guide(
+    packing: dict,
+    zone_lookups: dict,
+    zones: list,
+    dist_img: ee.Image,
+    images: dict,
+    old_cg: ee.Image,
+) -> ee.Image:
+    """Function to build the merged canopy guide of every zone of the region
+    args:
+        packing (dict): packing layout of the CMB tables
+        zone_lookups (dict): {zone number: (keys, NewCanopy values)} of the disturbed zones
+        zones (list): every zone of the region, undisturbed zones keep the baseline
+        dist_img (ee.Image): DIST image, unmasked to 0
+        images (dict): {"ZONE", "BPS", "EVH", "EVC", "EVT": ee.Image}
+        old_cg (ee.Image): baseline canopy guide
+    returns:
+        ee.Image: newCanopy and qa_flags bands
+    """
+    zone_img = images["ZONE"]
+    newcanopy_remapped = merged_zone_remap(packing, zone_lookups, dict(images, DIST=dist_img))
+
+    dist_high_harvest = dist_img.selfMask().lte(333).bitwiseAnd(dist_img.selfMask().gte(331)) # high harvest = 1
+
+    # 1 where the pixel falls in one of the zones of the region, undisturbed zones keep the baseline
+    in_zones = zone_img.remap(zones, [1] * len(zones), 0)
+
+    merged_newcanopy = (
+        old_cg
+        .where(dist_img.selfMask(), newcanopy_remapped)
+        .where(dist_high_harvest.eq(1),0) # zero out CG in high harvest disturbed areas
+        .updateMask(in_zones)
+        .rename("newCanopy")
+        .byte() #valid values are 0-3
+    )
+
+    # same qa flags as the zone-wise export, flag 3 is outside of the processed zones
+    # flag 2 is disturbed without a remapped code, the remap is masked there and the output falls back to the baseline
+    flags = (
+        dist_img.Not()
+        .where(dist_img.neq(0).And(newcanopy_remapped.mask().Not()), 2)
+        .where(in_zones.Not(), 3)
+        .updateMask(zone_img.selfMask())
+        .uint8()
+        .rename("qa_flags")
+    )
+
+    return ee.Image.cat([merged_newcanopy, flags]).set("zones", sorted(zone_lookups))
+
+
+def merged_fm40(
+    packing: dict,
+    zone_lookups: dict,
+    zones: list,
+    dist_img: ee.Image,
+    images: dict,
+    oldfm40_img: ee.Image,
+) -> ee.Image:
+    """Function to build the merged FM40 of every zone of the region
+    args:
+        packing (dict): packing layout of the CMB tables
+        zone_lookups (dict): {zone number: (keys, NewFBFM40 values)} of the disturbed zones
+        zones (list): every zone of the region, undisturbed zones keep the baseline
+        dist_img (ee.Image): DIST image, masked outside of disturbed pixels
+        images (dict): {"ZONE", "BPS", "EVH", "EVC", "EVT": ee.Image}
+        oldfm40_img (ee.Image): baseline FM40 of the fuels source
+    returns:
+        ee.Image: new_fbfm40 and qa_flags bands
+    """
+    zone_img = images["ZONE"]
+    fm40_remapped = merged_zone_remap(packing, zone_lookups, dict(images, DIST=dist_img))
+
+    # 1 where the pixel falls in one of the zones of the region, undisturbed zones keep the baseline
+    in_zones = zone_img.remap(zones, [1] * len(zones), 0)
+
+    # replace all values in old fm40 raster that are disturbed with new fm40 values
+    # then mask areas that are not in a processed zone
+    new_fm40 = (
+        oldfm40_img.where(dist_img.selfMask(), fm40_remapped)
+        .updateMask(in_zones)
+        .rename("new_fbfm40")
+        .uint16()
+    )
+
+    # same qa flags as the zone-wise export, flag 3 is outside of the processed zones
+    # flag 2 is disturbed without a remapped code, the remap is masked there and the output falls back to the baseline
+    flags = (
+        dist_img.Not()
+        .where(dist_img.neq(0).And(fm40_remapped.mask().Not()), 2)
+        .where(in_zones.Not(), 3)
+        .updateMask(zone_img.selfMask())
+        .uint8()
+        .rename("qa_flags")
+    )
+
+    return ee.Image.cat([new_fm40, flags]).set("zones", sorted(zone_lookups))
+
+
+def regression_coefficients(encoded_img: ee.Image, lookup: tuple) -> tuple:
+    """Helper function to remap the DIST/EVT codes to the (intercept, height scale, cover scale) images of a table"""
+    from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes = lookup
+    intercept = encoded_img.remap(from_codes, intercept_codes)
+    hgt_scale = encoded_img.remap(from_codes, hgt_scale_codes)
+    cc_scale = encoded_img.remap(from_codes, cc_scale_codes)
+    return intercept, hgt_scale, cc_scale
+
+
+def regression_bins(var: str) -> tuple:
+    """Helper function to get the (values, bins) remap lists of the CC or CH regression"""
+    values = ee.List.sequence(0, sum(count for count, _ in REGRESSION_BINS[var]) - 1)
+    bins = ee.List([])
+    for count, value in REGRESSION_BINS[var]:
+        bins = bins.cat(ee.List.repeat(value, count))
+    return values, bins
+
+
+def cc_ch_image(
+    var: str,
+    encoded_img: ee.Image,
+    lookup: tuple,
+    dist_img: ee.Image,
+    fvh_mid_img: ee.Image,
+    fvc_mid_img: ee.Image,
+    canopy_guide: ee.Image,
+    cc_img: ee.Image,
+    fill_img: ee.Image,
+    zone_img: ee.Image,
+) -> ee.Image:
+    """Function to build the new CC (var Cover) or CH (var Height) from the disturbance regression
+    args:
+        var (str): Cover or Height
+        encoded_img (ee.Image): DIST/EVT codes from disturbance_encoding
+        lookup (tuple): (from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes) of the var table
+        dist_img (ee.Image): DIST image
+        fvh_mid_img (ee.Image): FVH midpoint image
+        fvc_mid_img (ee.Image): FVC midpoint image
+        canopy_guide (ee.Image): newCanopy of the scenario
+        cc_img (ee.Image): baseline CC
+        fill_img (ee.Image): baseline of var, fills the undisturbed pixels
+        zone_img (ee.Image): LANDFIRE zones
+    returns:
+        ee.Image: single band image named cover or height
+    """
+    intercept, hgt_scale, cc_scale = regression_coefficients(encoded_img, lookup)
+
+    # apply the regression equation for the variable
+    regress = intercept.expression(
+        "b+(m1*x1)+(m2*x2)",
+        {
+            "b": intercept,
+            "m1": hgt_scale,
+            "x1": fvh_mid_img,
+            "m2": cc_scale,
+            "x2": fvc_mid_img,
+        }
+    )
+    values, bins = regression_bins(var)
+
+    if var == "Cover": # CC
+        binned = regress.updateMask(dist_img).clamp(0,100).toInt16().remap(values,bins,0)
+    else: # CH
+        binned = regress.updateMask(dist_img).toInt16().remap(values,bins,0).multiply(10).clamp(0,510)
+
+    return (
+        binned
+        .where(canopy_guide.eq(0), 0) # zero out where CG is 0
+        .where(cc_img.eq(0), 0) # zero out where baseline CC is 0
+        .unmask(fill_img) # fill un-disturbed pixels with pre- fuel value
+        .updateMask(zone_img)
+        .rename(var.lower())
+    )
+
+
+def cbh_image(
+    encoded_img: ee.Image,
+    lookup: tuple,
+    dist_img: ee.Image,
+    new_cc: ee.Image,
+    new_ch: ee.Image,
+    canopy_guide: ee.Image,
+    cc_img: ee.Image,
+    cbh_img: ee.Image,
+    zone_img: ee.Image,
+) -> ee.Image:
+    """Function to build the new CBH from the disturbance regression on the new CC and CH
+    args:
+        encoded_img (ee.Image): DIST/EVT codes from disturbance_encoding
+        lookup (tuple): (from_codes, intercept_codes, hgt_scale_codes, cc_scale_codes) of the CBH table
+        dist_img (ee.Image): DIST image
+        new_cc (ee.Image): CC of the scenario, already binned to midpoints
+        new_ch (ee.Image): CH of the scenario (x10), already binned to midpoints
+        canopy_guide (ee.Image): newCanopy of the scenario
+        cc_img (ee.Image): baseline CC
+        cbh_img (ee.Image): baseline CBH, fills the undisturbed pixels
+        zone_img (ee.Image): LANDFIRE zones
+    returns:
+        ee.Image: single band image named CBH
+    """
+    intercept, hgt_scale, cc_scale = regression_coefficients(encoded_img, lookup)
+
+    cbh = (
+        intercept.expression(
+            "b+(m1*x1)+(m2*x2)",
+            {
+                "b": intercept,
+                "m1": hgt_scale,
+                "x1": new_ch.divide(10),
+                "m2": cc_scale,
+                "x2": new_cc,
+            }
+        )
+        .updateMask(dist_img)
+        .multiply(10) #scale decimal regress output
+        .toInt16()
+        .clamp(0,100)
+        .where(canopy_guide.eq(0), 0) # 0 where CG is 0
+        .where(canopy_guide.eq(2), 100) # 100 (10m) where CG is 2
+        .where(cc_img.eq(0), 0) # 0 where CC is 0
+        .rename('CBH')
+    )
+    cbh = cbh.where(cbh.gt(new_ch), new_ch.multiply(0.7).toInt16()).rename('CBH') # CBH can't be larger than CH; where it is, reduce CBH to 2/3 of CH
+    return (
+        cbh.unmask(cbh_img) # fill un-disturbed pixels with baseline fuel value
+        .updateMask(zone_img) # cleans up CONUS-wide boundaries
+    )
+
+
+def cbd_image(
+    evt_img: ee.Image,
+    dist_img: ee.Image,
+    new_cc: ee.Image,
+    new_ch: ee.Image,
+    canopy_guide: ee.Image,
+    cc_img: ee.Image,
+    cbd_img: ee.Image,
+    zone_img: ee.Image,
+) -> ee.Image:
+    """Function to build the new CBD from the new CC and CH
+    args:
+        evt_img (ee.Image): EVT (FVT) image, pinyon/juniper types get their own coefficient
+        dist_img (ee.Image): DIST image
+        new_cc (ee.Image): CC of the scenario, already binned to midpoints
+        new_ch (ee.Image): CH of the scenario (x10), already binned to midpoints
+        canopy_guide (ee.Image): newCanopy of the scenario
+        cc_img (ee.Image): baseline CC
+        cbd_img (ee.Image): baseline CBD, fills the undisturbed pixels
+        zone_img (ee.Image): LANDFIRE zones
+    returns:
+        ee.Image: single band image named CBD
+    """
+    # get coefficients if pinion/juniper by conditional equation
+    # 2017, 2019, 2025, 2059, 2115, 2116, 2119 values are 1
+    pj = evt_img.expression(" : ".join(f"(b('FVT') == {evt}) ? 1" for evt in PJ_EVTS) + " : 0")
+
+    # calculate the sh coefficients based on the unscaled canopy height midpoint
+    # uses conditional equation to check different levels
+    post_height_mid_img = new_ch.divide(10)
+    sh1 = post_height_mid_img.expression(
+        "(b('height') < 15) ? 0 : (b('height') < 30) ? 1 : 0"
+    )
+    sh2 = post_height_mid_img.expression(
+        "(b('height') < 15) ? 0 : (b('height')) < 30 ? 0 : 1"
+    )
+
+    return (
+        ee.Image()
+        .expression(
+            " e ** (-2.4887057 + (0.0335917 * cov) + "
+            "(-0.356861 * sh1) + -(0.6006381 * sh2) + "
+            "(-1.10691 * pj) + (-0.0010804 * (cov * sh1)) "
+            "+ (-0.0018324 * (cov * sh2)))",
+            {
+                "e": ee.Image.constant(math.e),
+                "cov": new_cc,
+                "pj": pj,
+                "sh1": sh1,
+                "sh2": sh2,
+            },
+        )
+        .updateMask(dist_img)
+        .multiply(100)
+        .clamp(0,45)
+        .toInt16()
+        .where(canopy_guide.eq(0), 0) # 0 where CG is 0
+        .where(canopy_guide.eq(2), 1) # 1 (0.012kg/m^3) where CG is 2
+        .where(canopy_guide.eq(3), 1) # 1 (0.012kg/m^3) where CG is 3
+        .where(cc_img.eq(0), 0) # 0 where CC is 0
+        .unmask(cbd_img) # fill un-disturbed pixels with pre- fuel value
+        .updateMask(zone_img)
+        .rename("CBD")
+    )
+
+
+def fuel_stack(fm40: ee.Image, cc: ee.Image, ch: ee.Image, cbh: ee.Image, cbd: ee.Image) -> ee.Image:
+    """Function to collate the 5 fuel layers into the int16 stack of the Drive export"""
+    return fm40.addBands(cc).addBands(ch).addBands(cbh).addBands(cbd).rename('FM40','CC','CH', 'CBH','CBD').toInt16()
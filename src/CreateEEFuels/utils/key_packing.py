@@ -0,0 +1,176 @@
+"""
+Script for defining functions to pack the DIST, BPS, EVH, EVC, and EVT values into exact integer keys
+Replaces the 16 digit decimal encoding (DIST*1e13 + BPS*1e10 + ...) which goes past 2^53 and needs a float64 per pixel
+
+Each field is mapped to a dense ordinal index (1..n, 0 = value not in the table) from the sorted unique
+values found in the lookup table(s), then the indices are bit-packed into one int32 or int64 key.
+The same packing is applied to the table rows and to the images so the remap lookups are exact.
+"""
+
+import numpy as np
+
+# fields of the CMB tables in packing order, {field: table column}
+CMB_FIELDS = {
+    "DIST": "DIST",
+    "BPS": "BPSRF",
+    "EVH": "EVHR",
+    "EVC": "EVCR",
+    "EVT": "EVTR",
+}
+
+# largest key width that ee.Image.remap can still hold exactly (EE lists are doubles)
+MAX_BITS = 53
+
+
+def build_packing(columns: dict) -> dict:
+    """Function to build the packing layout from the table columns
+    args:
+        columns (dict): {field: array of table values} in packing order,
+            most significant field first
+    returns:
+        dict: packing layout, see vocab_packing
+    """
+    return vocab_packing(
+        {name: np.unique(np.rint(np.asarray(values, dtype=np.float64)).astype(np.int64)) for name, values in columns.items()}
+    )
+
+
+def vocab_packing(vocabs: dict) -> dict:
+    """Function to build the packing layout from the sorted unique values of each field
+    args:
+        vocabs (dict): {field: sorted unique int64 values} in packing order, most significant field first
+    returns:
+        dict: packing layout with keys
+            fields (list): [(field, sorted unique values, shift, bits)], most significant first
+            bits (int): total number of bits used by a key
+            dtype (str): int32 or int64, smallest signed type that holds the keys
+    """
+    fields = []
+    shift = 0
+    # pack from the least significant (last) field up
+    for name, vocab in reversed(list(vocabs.items())):
+        # + 1 because index 0 is reserved for values that are not in the table
+        bits = max(int(vocab.size).bit_length(), 1)
+        fields.append((name, vocab, shift, bits))
+        shift += bits
+
+    if shift > MAX_BITS:
+        raise ValueError(f"packed key needs {shift} bits, more than the {MAX_BITS} that can be remapped exactly")
+
+    return {
+        "fields": fields[::-1],
+        "bits": shift,
+        "dtype": "int32" if shift <= 31 else "int64",
+    }
+
+
+def table_packing(tables: list, fields: dict = CMB_FIELDS) -> dict:
+    """Helper function to build one packing layout shared by a list of parsed tables
+    args:
+        tables (list): list of {column: list of values} dictionaries, e.g. from parse_csv or parse_txt().getInfo()
+        fields (dict): {field: table column} in packing order. default = CMB_FIELDS
+    returns:
+        dict: packing layout, see build_packing
+    """
+    columns = {
+        field: np.concatenate([np.asarray(table[col], dtype=np.float64) for table in tables] or [np.empty(0)])
+        for field, col in fields.items()
+    }
+    return build_packing(columns)
+
+
+def pack_arrays(packing: dict, arrays: dict) -> np.ndarray:
+    """Function to pack arrays of field values into integer keys
+    values that are not in the packing vocabulary get an index of 0 so the key can never match a table row
+    args:
+        packing (dict): packing layout from build_packing
+        arrays (dict): {field: array of values}, all the same shape
+    returns:
+        np.ndarray: int32 or int64 array of packed keys
+    """
+    dtype = np.dtype(packing["dtype"])
+    key = None
+    for name, vocab, shift, bits in packing["fields"]:
+        values = np.asarray(arrays[name], dtype=np.int64)
+        idx = np.searchsorted(vocab, values)
+        idx = np.clip(idx, 0, max(vocab.size - 1, 0))
+        found = vocab[idx] == values if vocab.size else np.zeros(values.shape, dtype=bool)
+        ordinal = np.where(found, idx + 1, 0).astype(dtype)
+        key = ordinal << shift if key is None else key | (ordinal << shift)
+    return key
+
+
+def pack_table(packing: dict, table: dict, fields: dict = CMB_FIELDS) -> np.ndarray:
+    """Helper function to pack the key columns of a parsed table
+    args:
+        packing (dict): packing layout from build_packing
+        table (dict): {column: list of values}
+        fields (dict): {field: table column}. default = CMB_FIELDS
+    returns:
+        np.ndarray: packed keys, one per table row
+    """
+    arrays = {field: np.rint(np.asarray(table[col], dtype=np.float64)) for field, col in fields.items()}
+    return pack_arrays(packing, arrays)
+
+
+def pack_image(packing: dict, images: dict):
+    """Function to pack ee.Images of field values into an integer key image
+    mirrors pack_arrays server-side: each band is remapped to its ordinal index (0 if not in the vocabulary)
+    and shifted into place
+    args:
+        packing (dict): packing layout from build_packing
+        images (dict): {field: ee.Image}
+    returns:
+        ee.Image: int32 or int64 image of packed keys
+    """
+    key = None
+    for name, vocab, shift, bits in packing["fields"]:
+        ordinal = images[name].remap(vocab.tolist(), list(range(1, vocab.size + 1)), 0)
+        ordinal = ordinal.toInt64().leftShift(shift)
+        key = ordinal if key is None else key.bitwiseOr(ordinal)
+    key = key.toInt32() if packing["dtype"] == "int32" else key.toInt64()
+    return key.rename("key")
+
+
+def zone_packing(packing: dict, zones: list) -> dict:
+    """Function to extend a packing layout with the LANDFIRE zone as the most significant field
+    so the lookups of all zones can be folded into one table and one remap
+    args:
+        packing (dict): packing layout of the table fields, from build_packing
+        zones (list): zone numbers that get a lookup
+    returns:
+        dict: packing layout with a leading ZONE field
+    """
+    vocab = np.unique(np.asarray(zones, dtype=np.int64))
+    bits = max(int(vocab.size).bit_length(), 1)
+    total = packing["bits"] + bits
+    if total > MAX_BITS:
+        raise ValueError(f"packed key needs {total} bits, more than the {MAX_BITS} that can be remapped exactly")
+    return {
+        "fields": [("ZONE", vocab, packing["bits"], bits)] + list(packing["fields"]),
+        "bits": total,
+        "dtype": "int32" if total <= 31 else "int64",
+    }
+
+
+def merge_zone_lookups(packing: dict, zone_lookups: dict) -> tuple:
+    """Function to fold per zone lookups into one sorted lookup keyed on zone + table fields
+    args:
+        packing (dict): packing layout from zone_packing
+        zone_lookups (dict): {zone number: (keys, values)} packed without the zone field
+    returns:
+        tuple: (sorted keys, values aligned to keys)
+    """
+    name, vocab, shift, bits = packing["fields"][0]
+    dtype = np.dtype(packing["dtype"])
+    keys, values = [], []
+    for zone, (zone_keys, zone_values) in zone_lookups.items():
+        ordinal = int(np.searchsorted(vocab, zone)) + 1
+        keys.append(np.asarray(zone_keys).astype(dtype) | (dtype.type(ordinal) << dtype.type(shift)))
+        values.append(np.asarray(zone_values))
+    if not keys:
+        return np.empty(0, dtype=dtype), np.empty(0, dtype=np.uint16)
+    keys = np.concatenate(keys)
+    values = np.concatenate(values)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], values[order]
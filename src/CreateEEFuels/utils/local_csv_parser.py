@@ -0,0 +1,61 @@
+"""
+Script for defining functions for parsing the LFTFCT csv tables locally
+(mirrors utils/ee_csv_parser.py without the Earth Engine round trips)
+"""
+
+import numpy as np
+
+
+def parse_csv(path: str, delim: str = ",", qualifier: str = '"') -> dict:
+    """Function to parse a csv file from local disk
+    Expects data be formatted with no missing values and the first row be the column headers
+    args:
+        path (str): local file path of csv to parse
+        delim (str): string used to differentiate colummns. default = ,
+        qualifier (str): string used to wrap values in column. default - "
+    returns:
+        dict: dictionary representation of csv where keys are column names
+            and values are list of string values
+    """
+
+    def clean_string(x: str) -> str:
+        """Closure function used to strip the qualifier and white space"""
+        x = x.strip()
+        if x.startswith(qualifier):
+            x = x[len(qualifier):]
+        if x.endswith(qualifier):
+            x = x[: -len(qualifier)]
+        return x.strip()
+
+    with open(path) as file:
+        lines = [line.rstrip("\r\n") for line in file]
+
+    # drop trailing empty lines so they do not end up as rows
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+
+    # get the first row and set aside as header values
+    header = [clean_string(x) for x in lines[0].split(delim)]
+
+    # loop over the rows and split into columns
+    data = [[clean_string(x) for x in line.split(delim)] for line in lines[1:]]
+
+    # columns come out formatted as [[row],[row],..] so use zip to convert to [[col],[col],..]
+    columns = list(zip(*data)) if data else [()] * len(header)
+
+    return {name: list(col) for name, col in zip(header, columns)}
+
+
+def to_numeric(values: list, dtype=np.float64) -> np.ndarray:
+    """Helper function to convert parsed col list from string to numeric values
+    args:
+        values (list): list of strings to convert to numeric values
+        dtype (np.dtype): output dtype. integer dtypes are parsed via float
+            so values like "131.0" are accepted. default = np.float64
+    returns
+        np.ndarray: array containing numeric values
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        arr = np.rint(arr)
+    return arr.astype(dtype)
@@ -0,0 +1,382 @@
+"""
+Script for defining the NumPy versions of the fuels calculations used by the local backend
+Each function mirrors the ee.Image graph of the matching script in src/CreateEEFuels
+"""
+
+import numpy as np
+from utils.key_packing import pack_arrays
+from utils.table_bundle import encode_disturbance, DISTURBANCE_COEFS
+
+# nodata value of the local uint16 outputs, stands in for masked pixels of the EE images
+NODATA = 65535
+# nodata value of the int16 fuel layers (CC, CH, CBH, CBD and the fuel stack)
+NODATA_INT16 = -32768
+
+# pinyon/juniper FVT values used by the CBD equation in calc_CBD_CBH.py
+PJ_EVT = [2017, 2019, 2025, 2059, 2115, 2116, 2119]
+
+# band order of the fuel stack, same as the notebook Drive export
+STACK_BANDS = ["FM40", "CC", "CH", "CBH", "CBD"]
+
+
+def build_lookup(from_codes: np.ndarray, to_codes: np.ndarray) -> tuple:
+    """Function to build a sorted lookup from a pair of remap lists
+    duplicated from codes keep their first occurrence
+    args:
+        from_codes (np.ndarray): codes to remap from
+        to_codes (np.ndarray): values to remap to, must match sequence of from_codes
+    returns:
+        tuple: (sorted unique keys, values aligned to keys)
+    """
+    keys, first = np.unique(np.asarray(from_codes), return_index=True)
+    return keys, np.asarray(to_codes)[first]
+
+
+def remap(codes: np.ndarray, keys: np.ndarray, values: np.ndarray) -> tuple:
+    """Function to remap codes through a sorted lookup with binary search
+    equivalent of ee.Image.remap where non-matches come back masked
+    args:
+        codes (np.ndarray): array of codes to look up
+        keys (np.ndarray): sorted unique keys from build_lookup
+        values (np.ndarray): values aligned to keys
+    returns:
+        tuple: (remapped values, boolean array of where a match was found)
+    """
+    if keys.size == 0:
+        return np.zeros(codes.shape, dtype=values.dtype), np.zeros(codes.shape, dtype=bool)
+    idx = np.searchsorted(keys, codes)
+    idx = np.clip(idx, 0, keys.size - 1)
+    matched = keys[idx] == codes
+    out = np.where(matched, values[idx], 0).astype(values.dtype)
+    return out, matched
+
+
+def zone_remap(keys: np.ndarray, zone: np.ndarray, zone_lookups: dict) -> tuple:
+    """Function to remap packed keys with the lookup of the zone each pixel falls in
+    args:
+        keys (np.ndarray): DIST, BPS, FVH, FVC, FVT values packed with utils/key_packing.py
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+        zone_lookups (dict): {zone number: (keys, values)} with the same packing as keys
+    returns:
+        tuple: (uint16 remapped values, where a match was found, where the pixel is in a zone of zone_lookups)
+    """
+    out = np.zeros(keys.shape, dtype=np.uint16)
+    matched = np.zeros(keys.shape, dtype=bool)
+    processed = np.zeros(keys.shape, dtype=bool)
+    for zone_num, (zone_keys, zone_values) in zone_lookups.items():
+        in_zone = zone == zone_num
+        if not in_zone.any():
+            continue
+        out[in_zone], matched[in_zone] = remap(keys[in_zone], zone_keys, zone_values)
+        processed |= in_zone
+    return out, matched, processed
+
+
+def qa_flags(disturbed: np.ndarray, matched: np.ndarray, processed: np.ndarray) -> np.ndarray:
+    """Function to build the qa flags of the zone stages (calc_FM40.py, create_canopy_guide.py)
+    if disturbed and has new value flag = 0
+    if not distubed (ie old value) flag = 1
+    if disturbed and has no remapped code flag = 2 (the value falls back to the baseline)
+    pixels outside of the processed zones are NODATA
+    same flags as the EE zone stages, which take flag 2 from the mask of their remap
+    """
+    flags = np.where(disturbed, np.where(matched, 0, 2), 1).astype(np.uint16)
+    flags[~processed] = NODATA
+    return flags
+
+
+def calc_fm40(
+    dist: np.ndarray,
+    keys: np.ndarray,
+    old_fm40: np.ndarray,
+    zone: np.ndarray,
+    zone_lookups: dict,
+) -> tuple:
+    """Function to calculate the new FM40 and qa flags for a block of pixels
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        keys (np.ndarray): DIST, BPS, FVH, FVC, FVT values packed with utils/key_packing.py
+        old_fm40 (np.ndarray): baseline FM40 array
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+        zone_lookups (dict): {zone number: (keys, values)} built from the zone CMB tables
+            with the same packing as keys
+    returns:
+        tuple: (new_fbfm40 uint16 array, qa_flags uint16 array)
+            pixels in zones without a lookup are NODATA in both arrays
+    """
+    remapped, matched, processed = zone_remap(keys, zone, zone_lookups)
+    disturbed = dist != 0
+
+    # replace old fm40 values that are disturbed and have a remapped value
+    new_fm40 = np.where(disturbed & matched, remapped, old_fm40).astype(np.uint16)
+    new_fm40[~processed] = NODATA
+
+    return new_fm40, qa_flags(disturbed, matched, processed)
+
+
+def calc_canopy_guide(
+    dist: np.ndarray,
+    keys: np.ndarray,
+    old_cg: np.ndarray,
+    zone: np.ndarray,
+    zone_lookups: dict,
+) -> tuple:
+    """Function to calculate the new canopy guide and qa flags for a block of pixels
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        keys (np.ndarray): DIST, BPS, FVH, FVC, FVT values packed with utils/key_packing.py
+        old_cg (np.ndarray): baseline canopy guide (newCanopy) array
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+        zone_lookups (dict): {zone number: (keys, NewCanopy values)} with the same packing as keys
+    returns:
+        tuple: (newCanopy uint16 array, qa_flags uint16 array)
+            pixels in zones without a lookup are NODATA in both arrays
+    """
+    remapped, matched, processed = zone_remap(keys, zone, zone_lookups)
+    disturbed = dist != 0
+
+    # burn remapped CG values over the baseline CG
+    new_cg = np.where(disturbed & matched, remapped, old_cg)
+    # zero out CG in high harvest disturbed areas
+    new_cg = np.where((dist >= 331) & (dist <= 333), 0, new_cg).astype(np.uint16)
+    new_cg[~processed] = NODATA
+
+    return new_cg, qa_flags(disturbed, matched, processed)
+
+
+def regress(dist: np.ndarray, evt: np.ndarray, lookup: dict, height: np.ndarray, cover: np.ndarray) -> tuple:
+    """Function to apply a disturbance regression b+(m1*x1)+(m2*x2)
+    coefficients are remapped from the DIST*1e4 + EVT code
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        evt (np.ndarray): FVT codes
+        lookup (dict): {"keys", "intercept", "HT_coef", "CC_coef"} from table_bundle.disturbance_lookup
+        height (np.ndarray): height values (x1)
+        cover (np.ndarray): cover values (x2)
+    returns:
+        tuple: (float64 regression values, where the pixel is disturbed and has coefficients)
+    """
+    codes = encode_disturbance(dist, evt)
+    keys = np.asarray(lookup["keys"])
+    coefs = {}
+    for col in DISTURBANCE_COEFS:
+        coefs[col], matched = remap(codes, keys, np.asarray(lookup[col], dtype=np.float64))
+    values = coefs["intercept"] + coefs["HT_coef"] * height + coefs["CC_coef"] * cover
+    return values, matched & (dist != 0)
+
+
+def _to_int16(values: np.ndarray) -> np.ndarray:
+    """Helper function to cast like ee.Image.toInt16 (truncates toward zero)"""
+    return np.trunc(values).astype(np.int16)
+
+
+def _fill_baseline(values: np.ndarray, valid: np.ndarray, baseline: np.ndarray, zone: np.ndarray) -> np.ndarray:
+    """Helper function to fill un-disturbed pixels with the baseline value and mask outside of CONUS"""
+    out = np.where(valid, values, baseline).astype(np.int16)
+    out[zone == 0] = NODATA_INT16
+    return out
+
+
+def bin_cover(cover: np.ndarray) -> np.ndarray:
+    """Helper function to bin 0-100 cover values to the class midpoints used in calc_CC_CH.py
+    0-9 -> 0, 10-19 -> 15, ..., 80-89 -> 85, 90-100 -> 95
+    """
+    return np.where(cover < 10, 0, np.minimum(cover // 10, 9) * 10 + 5).astype(np.int16)
+
+
+def bin_height(height: np.ndarray) -> np.ndarray:
+    """Helper function to bin 0-51 height values to the class midpoints used in calc_CC_CH.py
+    0 -> 0, 1-4 -> 3, 5-8 -> 7, ..., 49-51 -> 51, anything outside 0-51 -> 0
+    """
+    binned = np.minimum(4 * ((height + 3) // 4) - 1, 51)
+    return np.where((height >= 1) & (height <= 51), binned, 0).astype(np.int16)
+
+
+def calc_cc_ch(
+    dist: np.ndarray,
+    evt: np.ndarray,
+    fvh_mid: np.ndarray,
+    fvc_mid: np.ndarray,
+    cg: np.ndarray,
+    base_cc: np.ndarray,
+    base_ch: np.ndarray,
+    zone: np.ndarray,
+    cover_lookup: dict,
+    height_lookup: dict,
+) -> tuple:
+    """Function to calculate the new CC and CH for a block of pixels
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        evt (np.ndarray): FVT codes
+        fvh_mid (np.ndarray): FVH midpoint array
+        fvc_mid (np.ndarray): FVC midpoint array
+        cg (np.ndarray): new canopy guide from calc_canopy_guide
+        base_cc (np.ndarray): baseline CC array
+        base_ch (np.ndarray): baseline CH array
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+        cover_lookup (dict): Cover disturbance table lookup
+        height_lookup (dict): Height disturbance table lookup
+    returns:
+        tuple: (CC int16 array, CH int16 array), NODATA_INT16 outside of CONUS
+    """
+    cover, cover_valid = regress(dist, evt, cover_lookup, fvh_mid, fvc_mid)
+    cc = bin_cover(_to_int16(np.clip(cover, 0, 100)))
+    cc = np.where(cg == 0, 0, cc)  # zero out where CG is 0
+    cc = np.where(base_cc == 0, 0, cc)  # zero out where baseline CC is 0
+
+    height, height_valid = regress(dist, evt, height_lookup, fvh_mid, fvc_mid)
+    ch = np.clip(bin_height(_to_int16(height)) * 10, 0, 510)
+    ch = np.where(cg == 0, 0, ch)  # zero out where CG is 0
+    ch = np.where(base_cc == 0, 0, ch)  # zero out where baseline CC is 0
+
+    return (
+        _fill_baseline(cc, cover_valid, base_cc, zone),
+        _fill_baseline(ch, height_valid, base_ch, zone),
+    )
+
+
+def calc_cbh(
+    dist: np.ndarray,
+    evt: np.ndarray,
+    new_cc: np.ndarray,
+    new_ch: np.ndarray,
+    cg: np.ndarray,
+    base_cc: np.ndarray,
+    base_cbh: np.ndarray,
+    zone: np.ndarray,
+    cbh_lookup: dict,
+) -> np.ndarray:
+    """Function to calculate the new CBH for a block of pixels
+    new CC and CH are already binned to midpoint values, CH only needs dividing by 10
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        evt (np.ndarray): FVT codes
+        new_cc (np.ndarray): CC from calc_cc_ch
+        new_ch (np.ndarray): CH from calc_cc_ch
+        cg (np.ndarray): new canopy guide from calc_canopy_guide
+        base_cc (np.ndarray): baseline CC array
+        base_cbh (np.ndarray): baseline CBH array
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+        cbh_lookup (dict): CBH disturbance table lookup
+    returns:
+        np.ndarray: CBH int16 array, NODATA_INT16 outside of CONUS
+    """
+    values, valid = regress(dist, evt, cbh_lookup, new_ch / 10, new_cc)
+    cbh = np.clip(_to_int16(values * 10), 0, 100)  # scale decimal regress output
+    cbh = np.where(cg == 0, 0, cbh)  # 0 where CG is 0
+    cbh = np.where(cg == 2, 100, cbh)  # 100 (10m) where CG is 2
+    cbh = np.where(base_cc == 0, 0, cbh)  # 0 where baseline CC is 0
+    # CBH can't be larger than CH; where it is, reduce CBH to 0.7 of CH
+    cbh = np.where(cbh > new_ch, _to_int16(new_ch * 0.7), cbh)
+    return _fill_baseline(cbh, valid, base_cbh, zone)
+
+
+def calc_cbd(
+    dist: np.ndarray,
+    evt: np.ndarray,
+    new_cc: np.ndarray,
+    new_ch: np.ndarray,
+    cg: np.ndarray,
+    base_cc: np.ndarray,
+    base_cbd: np.ndarray,
+    zone: np.ndarray,
+) -> np.ndarray:
+    """Function to calculate the new CBD for a block of pixels
+    args:
+        dist (np.ndarray): DIST codes, 0 where not disturbed
+        evt (np.ndarray): FVT codes
+        new_cc (np.ndarray): CC from calc_cc_ch
+        new_ch (np.ndarray): CH from calc_cc_ch
+        cg (np.ndarray): new canopy guide from calc_canopy_guide
+        base_cc (np.ndarray): baseline CC array
+        base_cbd (np.ndarray): baseline CBD array
+        zone (np.ndarray): LANDFIRE zone numbers, 0 outside of CONUS
+    returns:
+        np.ndarray: CBD int16 array, NODATA_INT16 outside of CONUS
+    """
+    cov = new_cc.astype(np.float64)
+    height = new_ch / 10
+    pj = np.isin(evt, PJ_EVT).astype(np.float64)  # pinyon/juniper EVT
+    sh1 = ((height >= 15) & (height < 30)).astype(np.float64)  # 15m <= CH < 30m
+    sh2 = (height >= 30).astype(np.float64)  # CH >= 30m
+
+    cbd = np.exp(
+        -2.4887057
+        + (0.0335917 * cov)
+        + (-0.356861 * sh1)
+        + (-0.6006381 * sh2)
+        + (-1.10691 * pj)
+        + (-0.0010804 * (cov * sh1))
+        + (-0.0018324 * (cov * sh2))
+    )
+    cbd = _to_int16(np.clip(cbd * 100, 0, 45))
+    cbd = np.where(cg == 0, 0, cbd)  # 0 where CG is 0
+    cbd = np.where((cg == 2) | (cg == 3), 1, cbd)  # 1 (0.012kg/m^3) where CG is 2 or 3
+    cbd = np.where(base_cc == 0, 0, cbd)  # 0 where baseline CC is 0
+    return _fill_baseline(cbd, dist != 0, base_cbd, zone)
+
+
+def calc_fuelscape(arrays: dict, lookups: dict) -> dict:
+    """Function to calculate the canopy guide and all five fuel layers for a block of pixels in a single pass
+    the canopy guide, CC and CH stay in memory for the stages that need them instead of
+    being exported and read back as assets between stages
+    args:
+        arrays (dict): {name: 2D array} holding "dist" plus every name of
+            local_inputs.LANDFIRE_INPUTS and local_inputs.BASELINE_INPUTS
+        lookups (dict): from table_bundle.fuel_lookups
+    returns:
+        dict: {"canopy_guide": uint16 array, "FM40", "CC", "CH", "CBH", "CBD": int16 arrays}
+    """
+    dist = arrays["dist"]
+    evt = arrays["evt"]
+    zone = arrays["zone"]
+    keys = pack_arrays(
+        lookups["packing"],
+        {"DIST": dist, "BPS": arrays["bps"], "EVH": arrays["evh"], "EVC": arrays["evc"], "EVT": evt},
+    )
+
+    cg, _ = calc_canopy_guide(dist, keys, arrays["cg"], zone, lookups["NewCanopy"])
+    fm40, _ = calc_fm40(dist, keys, arrays["fm40"], zone, lookups["NewFBFM40"])
+    cc, ch = calc_cc_ch(
+        dist, evt, arrays["fvh_mid"], arrays["fvc_mid"], cg,
+        arrays["cc"], arrays["ch"], zone, lookups["Cover"], lookups["Height"],
+    )
+    cbh = calc_cbh(dist, evt, cc, ch, cg, arrays["cc"], arrays["cbh"], zone, lookups["CBH"])
+    cbd = calc_cbd(dist, evt, cc, ch, cg, arrays["cc"], arrays["cbd"], zone)
+
+    fm40 = np.where(fm40 == NODATA, NODATA_INT16, fm40).astype(np.int16)
+    return {"canopy_guide": cg, "FM40": fm40, "CC": cc, "CH": ch, "CBH": cbh, "CBD": cbd}
+
+
+def calc_fuelscape_batch(arrays: dict, dists: list, lookups: dict) -> list:
+    """Function to calculate the fuelscape of K DIST scenarios against one read of the baseline inputs
+    the undisturbed result is calculated once, then the disturbed pixels of every scenario are stacked
+    along a flat scenario axis and evaluated in a single calc_fuelscape call,
+    so the cost grows with the disturbed pixels of all scenarios instead of K full runs
+    args:
+        arrays (dict): {name: 2D array} of the shared inputs, same as calc_fuelscape without "dist"
+        dists (list): DIST arrays of each scenario, shaped like the inputs
+        lookups (dict): from table_bundle.fuel_lookups
+    returns:
+        list: calc_fuelscape outputs of each scenario, in the order of dists
+    """
+    arrays = {name: arr for name, arr in arrays.items() if name != "dist"}
+    base = calc_fuelscape(dict(arrays, dist=np.zeros_like(dists[0])), lookups)
+
+    # every pixel is independent, so the disturbed pixels of all scenarios can go through as one 1D block
+    disturbed = [dist != 0 for dist in dists]
+    stacked = {name: np.concatenate([arr[mask] for mask in disturbed]) for name, arr in arrays.items()}
+    stacked["dist"] = np.concatenate([dist[mask] for dist, mask in zip(dists, disturbed)])
+    batch = calc_fuelscape(stacked, lookups)
+
+    outputs = []
+    start = 0
+    for mask in disturbed:
+        stop = start + int(mask.sum())
+        scenario = {}
+        for name, values in base.items():
+            scenario[name] = values.copy()
+            scenario[name][mask] = batch[name][start:stop]
+        outputs.append(scenario)
+        start = stop
+    return outputs
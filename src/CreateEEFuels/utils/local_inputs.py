@@ -0,0 +1,88 @@
+"""
+Script for defining the local input rasters of the local backend and reading them over a window
+Each name maps to the GeoTIFF (on the config geo grid) exported from the EE asset the scripts use
+"""
+
+import os
+from utils.raster_io import read_window
+from utils.baseline_cache import is_cache, read_cached, cached_versions
+
+# version 200 LANDFIRE inputs, {array name: file name}
+# the tables have EVH, EVC, EVT but the values are actually the F* layers (same as the EE scripts)
+LANDFIRE_INPUTS = {
+    "bps": "BPS.tif",
+    "evt": "FVT.tif",
+    "evh": "FVH.tif",
+    "evc": "FVC.tif",
+    "fvc_mid": "Midpoint_CC.tif",
+    "fvh_mid": "Midpoint_CH.tif",
+    "zone": "zones_image.tif",
+    # canopy_guide_2021_12_v1 newCanopy mosaic, baseline of create_canopy_guide.py
+    "cg": "canopy_guide.tif",
+}
+
+# baseline fuel layers, file names get the fuels source appended, e.g. CC_pyrologix.tif
+BASELINE_INPUTS = {
+    "cc": "CC",
+    "ch": "CH",
+    "cbh": "CBH",
+    "cbd": "CBD",
+    "fm40": "FM40",
+}
+
+FUELS_SOURCES = ["firefactor", "pyrologix"]
+
+
+def input_path(inputs_dir: str, name: str, fuels_source: str = None) -> str:
+    """Helper function to get the file path of a named input
+    args:
+        inputs_dir (str): folder holding the input GeoTIFFs
+        name (str): key of LANDFIRE_INPUTS or BASELINE_INPUTS
+        fuels_source (str): firefactor or pyrologix, needed for the baseline layers
+    returns:
+        str: file path
+    """
+    if name in LANDFIRE_INPUTS:
+        return os.path.join(inputs_dir, LANDFIRE_INPUTS[name])
+    if fuels_source not in FUELS_SOURCES:
+        raise ValueError(f"{fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+    return os.path.join(inputs_dir, f"{BASELINE_INPUTS[name]}_{fuels_source}.tif")
+
+
+def file_version(path: str) -> str:
+    """Helper function to get the version of an exported GeoTIFF, its size and modification time"""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def input_versions(inputs_dir: str, names: list, bounds: tuple, fuels_source: str = None) -> dict:
+    """Function to get the version of each named input, so data derived from them can tell when they changed
+    args:
+        inputs_dir (str): folder holding the input GeoTIFFs, or a baseline cache folder
+        names (list): keys of LANDFIRE_INPUTS or BASELINE_INPUTS
+        bounds (tuple): (left, bottom, right, top) in the config crs, picks the cached layer like read_inputs
+        fuels_source (str): firefactor or pyrologix, needed for the baseline layers
+    returns:
+        dict: {name: file_version of the GeoTIFF, or "<source>@<version>" of the cached layer}
+    """
+    if is_cache(inputs_dir):
+        return cached_versions(inputs_dir, names, bounds, fuels_source)
+    return {name: file_version(input_path(inputs_dir, name, fuels_source)) for name in names}
+
+
+def read_inputs(inputs_dir: str, names: list, bounds: tuple, fuels_source: str = None) -> dict:
+    """Function to read a set of named inputs over the same bounds
+    a baseline cache folder (see baseline_cache.py) is read through memory maps instead of the GeoTIFFs
+    args:
+        inputs_dir (str): folder holding the input GeoTIFFs, or a baseline cache folder
+        names (list): keys of LANDFIRE_INPUTS or BASELINE_INPUTS
+        bounds (tuple): (left, bottom, right, top) in the config crs
+        fuels_source (str): firefactor or pyrologix, needed for the baseline layers
+    returns:
+        dict: {name: 2D np.ndarray}
+    """
+    if is_cache(inputs_dir):
+        if any(name not in LANDFIRE_INPUTS for name in names) and fuels_source not in FUELS_SOURCES:
+            raise ValueError(f"{fuels_source} not a valid fuels data source. Valid data sources: firefactor, pyrologix")
+        return read_cached(inputs_dir, names, bounds, fuels_source)
+    return {name: read_window(input_path(inputs_dir, name, fuels_source), bounds) for name in names}
@@ -0,0 +1,126 @@
+"""
+Script for defining functions to pull computed Earth Engine pixels over a window of the config grid without export tasks
+The window is split into tiles aligned to the config crsTransform grid, each tile is one computePixels request
+and the requests run on a bounded thread pool (they are network bound) before being assembled into one array.
+Requests go through a client object with a compute_pixels(request) method, EEPixelClient by default,
+so a fake client can stand in for Earth Engine in tests and benchmarks.
+"""
+
+import time
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils.tile_engine import grid_tiles
+
+logger = logging.getLogger(__name__)
+
+# computePixels rejects requests over 48 MB or 32768 px on a side, 512 px tiles of a few bands stay well under
+DEFAULT_TILE_SIZE = 512
+# Earth Engine allows 40 concurrent interactive requests per project, leave room for other clients
+DEFAULT_WORKERS = 8
+
+
+class EEPixelClient:
+    """Client sending computePixels requests to Earth Engine, ee has to be initialized first"""
+
+    def compute_pixels(self, request: dict) -> np.ndarray:
+        # imported here so the fetch logic works with a fake client and no earthengine-api
+        import ee
+
+        return ee.data.computePixels(request)
+
+
+def tile_request(expression, geo_info: dict, tile, band_ids: list = None) -> dict:
+    """Function to build the computePixels request of one grid tile
+    args:
+        expression (ee.Image): image to compute
+        geo_info (dict): geo section of the config file
+        tile (Window): tile in grid pixel coordinates
+        band_ids (list): bands to return. default = all bands of the image
+    returns:
+        dict: computePixels request returning a structured NumPy array
+    """
+    x_scale, x_shear, x0, y_shear, y_scale, y0 = geo_info["crsTransform"]
+    request = {
+        "expression": expression,
+        "fileFormat": "NUMPY_NDARRAY",
+        "grid": {
+            "dimensions": {"width": int(tile.width), "height": int(tile.height)},
+            "affineTransform": {
+                "scaleX": x_scale,
+                "shearX": x_shear,
+                "translateX": x0 + int(tile.col_off) * x_scale,
+                "shearY": y_shear,
+                "scaleY": y_scale,
+                "translateY": y0 + int(tile.row_off) * y_scale,
+            },
+            "crsCode": geo_info["crs"],
+        },
+    }
+    if band_ids is not None:
+        request["bandIds"] = list(band_ids)
+    return request
+
+
+def fetch_tile(client, request: dict, retries: int = 3, backoff: float = 1.0) -> np.ndarray:
+    """Function to send one request, retrying with exponential backoff (e.g. on too many concurrent requests)
+    args:
+        client: object with a compute_pixels(request) method
+        request (dict): from tile_request
+        retries (int): attempts after the first one. default = 3
+        backoff (float): seconds waited before the first retry, doubled after each one. default = 1.0
+    returns:
+        np.ndarray: structured array with one field per band
+    """
+    for attempt in range(retries + 1):
+        try:
+            return client.compute_pixels(request)
+        except Exception as error:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            logger.warning(f"computePixels failed ({error}), retrying in {wait:.0f} seconds")
+            time.sleep(wait)
+
+
+def fetch_window(
+    image,
+    geo_info: dict,
+    window,
+    band_names: list,
+    client=None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = 3,
+) -> dict:
+    """Function to compute an image over a grid window tile by tile on a thread pool
+    args:
+        image (ee.Image): image to compute, masked pixels come back as 0 so unmask it to a nodata value first
+        geo_info (dict): geo section of the config file
+        window (Window): window in grid pixel coordinates, e.g. from tile_engine.grid_window
+        band_names (list): bands to return
+        client: object with a compute_pixels(request) method. default = EEPixelClient()
+        tile_size (int): tile edge in pixels. default = 512
+        workers (int): requests in flight. default = 8
+        retries (int): retries of each failed request. default = 3
+    returns:
+        dict: {band name: 2D np.ndarray over the window}
+    """
+    client = EEPixelClient() if client is None else client
+    tiles = grid_tiles(window, tile_size)
+    logger.info(f"fetching {int(window.width)} x {int(window.height)} px in {len(tiles)} tiles on {workers} threads")
+
+    def fetch(tile):
+        return tile, fetch_tile(client, tile_request(image, geo_info, tile, band_names), retries)
+
+    out = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # tiles are assembled as they come back, the pool bounds how many requests are in flight
+        for tile, pixels in pool.map(fetch, tiles):
+            row, col = int(tile.row_off - window.row_off), int(tile.col_off - window.col_off)
+            for name in band_names:
+                band = pixels[name]
+                if name not in out:
+                    out[name] = np.zeros((int(window.height), int(window.width)), dtype=band.dtype)
+                out[name][row:row + band.shape[0], col:col + band.shape[1]] = band
+    return out
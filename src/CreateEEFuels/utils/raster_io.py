@@ -0,0 +1,70 @@
+"""
+Script for defining functions for windowed GeoTIFF reads and writes used by the local fuels backend
+All inputs are expected to be snapped to the config geo grid (EPSG:5070, 30m) like the EE exports are
+"""
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window, from_bounds
+
+
+def read_window(path: str, bounds: tuple, fill_value: int = 0) -> np.ndarray:
+    """Function to read the first band of a raster over the given bounds
+    Pixels outside of the raster extent or flagged as nodata are returned as fill_value
+    args:
+        path (str): local file path of GeoTIFF to read
+        bounds (tuple): (left, bottom, right, top) in the raster crs
+        fill_value (int): value used for nodata and out of extent pixels. default = 0
+    returns:
+        np.ndarray: 2D array of the windowed band
+    """
+    with rasterio.open(path) as src:
+        window = from_bounds(*bounds, transform=src.transform)
+        window = window.round_offsets().round_lengths()
+        arr = src.read(1, window=window, boundless=True, fill_value=fill_value, masked=True)
+    return arr.filled(fill_value)
+
+
+def window_bounds(path: str, window: Window = None) -> tuple:
+    """Helper function to get the bounds and shape of a raster (or a window of it)
+    args:
+        path (str): local file path of GeoTIFF
+        window (Window): optional window within the raster. default = full extent
+    returns:
+        tuple: ((left, bottom, right, top), (rows, cols), profile)
+    """
+    with rasterio.open(path) as src:
+        if window is None:
+            window = Window(0, 0, src.width, src.height)
+        profile = src.profile.copy()
+        transform = src.window_transform(window)
+        bounds = rasterio.windows.bounds(window, src.transform)
+    profile.update(height=int(window.height), width=int(window.width), transform=transform)
+    return bounds, (int(window.height), int(window.width)), profile
+
+
+def write_geotiff(path: str, bands: list, band_names: list, profile: dict, dtype: str, nodata: int = 0):
+    """Function to write a list of 2D arrays as a multiband tiled GeoTIFF
+    args:
+        path (str): local output file path
+        bands (list): list of 2D np.ndarrays, all the same shape
+        band_names (list): band descriptions, must match sequence of bands
+        profile (dict): rasterio profile holding crs/transform/shape of the output
+        dtype (str): output data type
+        nodata (int): nodata value written to the header. default = 0
+    """
+    profile = profile.copy()
+    profile.update(
+        driver="GTiff",
+        count=len(bands),
+        dtype=dtype,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        for i, (band, name) in enumerate(zip(bands, band_names), start=1):
+            dst.write(band.astype(dtype), i)
+            dst.set_band_description(i, name)
@@ -0,0 +1,33 @@
+"""
+Script for defining the log file setup of the scripts when they run inside another script's process
+logging.basicConfig only takes effect once per process, so when optx.py or schedule_stages.py import and call
+a script's main, the basicConfig of that script does nothing and its messages would only reach optx.log or
+schedule_stages.log. attach_log_file gives the script's logger its own <script>.log again, messages still
+propagate to the log file of the process as well
+"""
+
+import os
+import logging
+
+# same format as the basicConfig of the scripts
+LOG_FORMAT = "%(asctime)s %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %I:%M:%S %p"
+
+
+def attach_log_file(logger: logging.Logger, log_path: str) -> bool:
+    """Function to make a script's logger write to the script's log file when another script configured logging first
+    args:
+        logger (logging.Logger): logger of the script module
+        log_path (str): the script's log file, the same file as in its basicConfig
+    returns:
+        bool: True if a handler was added, False if the file already gets the logger's messages
+    """
+    log_path = os.path.abspath(log_path)
+    handlers = logging.getLogger().handlers + logger.handlers
+    # run as a script its basicConfig already writes there, and a second main call in process adds nothing
+    if any(getattr(handler, "baseFilename", None) == log_path for handler in handlers):
+        return False
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+    logger.addHandler(handler)
+    return True
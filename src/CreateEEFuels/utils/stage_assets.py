@@ -0,0 +1,141 @@
+"""
+Script for defining where each stage writes its outputs inside a scenario fuelscape folder
+and helpers for reading them back whether they were exported zone-wise or merged
+"""
+
+import ee
+from utils.fuel_graph import fuel_stack
+
+# zone-wise exports go into image collections (one image per LANDFIRE zone)
+CANOPY_GUIDE_COLLECTION = "canopy_guide_collection"
+FM40_COLLECTION = "fm40_collection"
+
+# merged exports (-m/--merge_zones) are a single image
+MERGED_CANOPY_GUIDE = "canopy_guide"
+MERGED_FM40 = "FM40"
+
+# baselines the zone stages update from, zones skipped for having no disturbed pixels read back as these
+BASELINE_CANOPY_GUIDE = "projects/pyregence-ee/assets/conus/fuels/canopy_guide_2021_12_v1"
+BASELINE_FM40 = {
+    "firefactor": "projects/pyregence-ee/assets/conus/fuels/Fuels_FM40_WUI_IrrigatedConversion_2022_10", # Firefactor as baseline, pre Custom fuels edit
+    "pyrologix": "projects/pyregence-ee/assets/subconus/california/pyrologix/fm40/fm402022", #Pyrologix as baseline
+}
+
+
+def asset_exists(asset_id: str) -> bool:
+    """Helper function to check whether an EE asset exists"""
+    try:
+        ee.data.getAsset(asset_id)
+    except ee.EEException:
+        return False
+    return True
+
+
+def ensure_folder(folder_id: str) -> bool:
+    """Function to create an EE folder if it does not exist yet, in process instead of `earthengine create folder`
+    returns:
+        bool: True if the folder was created
+    """
+    if asset_exists(folder_id):
+        return False
+    ee.data.createAsset({"type": "FOLDER"}, folder_id)
+    return True
+
+
+def ensure_collection(collection_id: str) -> bool:
+    """Function to create an EE image collection if it does not exist yet, in process instead of `earthengine create collection`
+    returns:
+        bool: True if the collection was created
+    """
+    if asset_exists(collection_id):
+        return False
+    ee.data.createAsset({"type": "IMAGE_COLLECTION"}, collection_id)
+    return True
+
+
+def baseline_fm40(fuels_source: str) -> ee.Image:
+    """Helper function to get the baseline FM40 image of a fuels source"""
+    if fuels_source not in BASELINE_FM40:
+        raise ValueError(f"{fuels_source} not a valid fuels data source. Valid data sources: {', '.join(BASELINE_FM40)}")
+    return ee.Image(BASELINE_FM40[fuels_source])
+
+
+def zone_output_source(out_folder_path: str, merged_name: str, collection_name: str):
+    """Helper function to get the merged image of a zone stage if it exists, else its zone-wise image collection
+    only one of them exists, the stage deletes the output of the other export mode (stage_cache.remove_output)
+    """
+    merged_path = f"{out_folder_path}/{merged_name}"
+    if asset_exists(merged_path):
+        return ee.Image(merged_path)
+    return ee.ImageCollection(f"{out_folder_path}/{collection_name}")
+
+
+def read_zone_output(out_folder_path: str, merged_name: str, collection_name: str, band: str, fill: ee.Image = None) -> ee.Image:
+    """Function to read a zone stage output, preferring the merged image when it exists
+    args:
+        out_folder_path (str): asset path of the scenario fuelscape folder
+        merged_name (str): asset name of the merged image
+        collection_name (str): asset name of the zone-wise image collection
+        band (str): band to select
+        fill (ee.Image): baseline filling the zones the collection has no image for. default = None
+    returns:
+        ee.Image: single band image of the stage output
+    """
+    source = zone_output_source(out_folder_path, merged_name, collection_name)
+    if isinstance(source, ee.Image):
+        return source.select(band)
+    mosaic = source.select(band).mosaic()
+    # zones without disturbed pixels are not exported, they keep the baseline
+    return mosaic if fill is None else mosaic.unmask(fill.rename(band))
+
+
+def read_canopy_guide(out_folder_path: str) -> ee.Image:
+    """Helper function to read the newCanopy band of a scenario's canopy guide"""
+    old_cg = ee.ImageCollection(BASELINE_CANOPY_GUIDE).select("newCanopy").mosaic()
+    return read_zone_output(out_folder_path, MERGED_CANOPY_GUIDE, CANOPY_GUIDE_COLLECTION, "newCanopy", fill=old_cg)
+
+
+def canopy_guide_source(out_folder_path: str):
+    """Helper function to get the canopy guide asset of a scenario (merged image or zone collection)"""
+    return zone_output_source(out_folder_path, MERGED_CANOPY_GUIDE, CANOPY_GUIDE_COLLECTION)
+
+
+def read_fm40(out_folder_path: str, fuels_source: str = None) -> ee.Image:
+    """Helper function to read the new_fbfm40 band of a scenario's FM40
+    pass the fuels_source the FM40 stage ran with so zones it skipped read back as the baseline FM40
+    """
+    fill = None if fuels_source is None else baseline_fm40(fuels_source)
+    return read_zone_output(out_folder_path, MERGED_FM40, FM40_COLLECTION, "new_fbfm40", fill=fill)
+
+
+def export_fuel_stack(out_folder_path: str, aoi: ee.Geometry, crs: str, scale: int, folder: str, fuels_source: str = None) -> str:
+    """Function to collate a scenario's 5 fuel layers into one multiband image and export it to Google Drive
+    args:
+        out_folder_path (str): asset path of the scenario fuelscape folder
+        aoi (ee.Geometry): export region
+        crs (str): export crs
+        scale (int): export scale
+        folder (str): Google Drive folder
+        fuels_source (str): baseline fuels of the FM40 stage, fills the zones it skipped. default = None
+    returns:
+        str: id of the started export task
+    """
+    fm40 = read_fm40(out_folder_path, fuels_source)
+    cc = ee.Image(f"{out_folder_path}/CC")
+    ch = ee.Image(f"{out_folder_path}/CH")
+    cbh = ee.Image(f"{out_folder_path}/CBH")
+    cbd = ee.Image(f"{out_folder_path}/CBD")
+    stack = fuel_stack(fm40, cc, ch, cbh, cbd)
+
+    scn_id = out_folder_path.split('/')[-1]
+    task = ee.batch.Export.image.toDrive(
+        image=stack,
+        description=f"export_{scn_id}",
+        folder=folder,
+        fileNamePrefix=scn_id,
+        region=aoi,
+        scale=scale,
+        crs=crs,
+    )
+    task.start()
+    return task.id
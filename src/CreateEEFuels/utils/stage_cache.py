@@ -0,0 +1,172 @@
+"""
+Script for defining functions to memoize the stage exports by content
+Every output asset is keyed by a hash of what it is computed from: the versions of its input assets
+(system:version, or the key of an upstream stage output), the table bundle hash, fuels_source, the config grid,
+the export region and the code of the stage. The key and that provenance are set as properties of the exported image,
+so a rerun skips every output whose key already exists and only recomputes what changed.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import logging
+import ee
+
+logger = logging.getLogger(__name__)
+
+# image properties holding the content key and the json provenance it was hashed from
+KEY_PROPERTY = "optx_key"
+PROVENANCE_PROPERTY = "optx_provenance"
+
+
+def code_version(script_path: str) -> str:
+    """Function to hash the code of a stage, the script and every utils module next to it
+    args:
+        script_path (str): path of the stage script, i.e. __file__
+    returns:
+        str: sha256 of the source files
+    """
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    paths = [os.path.abspath(script_path)] + sorted(glob.glob(os.path.join(script_dir, "utils", "*.py")))
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.relpath(path, script_dir).encode())
+        with open(path, "rb") as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+def geometry_digest(geometry: ee.Geometry) -> str:
+    """Helper function to hash a client-side geometry (e.g. the export region) without a round trip"""
+    return hashlib.sha256(geometry.serialize().encode()).hexdigest()[:16]
+
+
+def input_versions(inputs: dict) -> dict:
+    """Function to get the versions of the input assets of a stage in one round trip
+    args:
+        inputs (dict): {name: ee.Image or ee.ImageCollection loaded from an asset}
+    returns:
+        dict: {name: {"id", "version", "key"}}, lists of versions and keys for collections
+            key is set when the input is the output of an earlier stage
+    """
+    versions = {}
+    for name, asset in inputs.items():
+        if isinstance(asset, ee.ImageCollection):
+            versions[name] = ee.Dictionary({
+                "id": asset.get("system:id"),
+                "version": asset.aggregate_array("system:version"),
+                "key": asset.aggregate_array(KEY_PROPERTY),
+            })
+        else:
+            versions[name] = ee.Dictionary({
+                "id": asset.get("system:id"),
+                "version": asset.get("system:version"),
+                "key": asset.get(KEY_PROPERTY),
+            })
+    return ee.Dictionary(versions).getInfo()
+
+
+def stage_provenance(stage: str, script_path: str, inputs: dict, region: ee.Geometry, **params) -> dict:
+    """Function to describe everything the outputs of a stage are computed from
+    args:
+        stage (str): stage name, e.g. "calc_FM40"
+        script_path (str): path of the stage script, i.e. __file__
+        inputs (dict): {name: ee.Image or ee.ImageCollection} input assets
+        region (ee.Geometry): export region
+        **params: anything else the outputs depend on, e.g. tables=<bundle hash>, fuels_source, grid
+    returns:
+        dict: json serializable provenance
+    """
+    return {
+        "stage": stage,
+        "code": code_version(script_path),
+        "inputs": input_versions(inputs),
+        "region": geometry_digest(region),
+        "params": params,
+    }
+
+
+def output_key(provenance: dict, asset_id: str) -> str:
+    """Function to get the content key of one output of a stage"""
+    content = json.dumps(dict(provenance, output=asset_id.split("/")[-1]), sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def existing_key(asset_id: str) -> str:
+    """Helper function to get the key of an existing output, "" if it has none, None if the asset does not exist"""
+    try:
+        asset = ee.data.getAsset(asset_id)
+    except ee.EEException:
+        return None
+    return asset.get("properties", {}).get(KEY_PROPERTY, "")
+
+
+def up_to_date(asset_id: str, key: str, force: bool = False) -> bool:
+    """Function to check whether an output already exists with the key, removing it if it is stale
+    an asset can not be exported over, so a stale (or unkeyed) output is deleted for the export to write it again
+    args:
+        asset_id (str): asset id of the output
+        key (str): content key from output_key
+        force (bool): treat the output as stale whatever its key. default = False
+    returns:
+        bool: True if the export can be skipped
+    """
+    existing = existing_key(asset_id)
+    if existing is None:
+        return False
+    if existing == key and not force:
+        logger.info(f"{asset_id} is up to date ({key}), skipping")
+        return True
+    logger.info(f"{asset_id} is stale ({existing or 'no key'} != {key}), deleting it")
+    ee.data.deleteAsset(asset_id)
+    return False
+
+
+def with_provenance(image: ee.Image, key: str, provenance: dict) -> ee.Image:
+    """Function to set the content key and provenance on an image before it is exported"""
+    return image.set({
+        KEY_PROPERTY: key,
+        PROVENANCE_PROPERTY: json.dumps(provenance, sort_keys=True, default=str),
+    })
+
+
+def prune_collection(collection_id: str, keep: list) -> list:
+    """Function to delete the images of an output collection that the current run does not produce
+    e.g. the zone images of zones that no longer hold disturbed pixels, the mosaic would pick them up otherwise
+    args:
+        collection_id (str): asset id of the image collection
+        keep (list): asset ids of the images to keep
+    returns:
+        list: asset ids of the deleted images
+    """
+    try:
+        images = ee.data.listAssets({"parent": collection_id}).get("assets", [])
+    except ee.EEException:
+        return []
+    keep = set(keep)
+    removed = [image["id"] for image in images if image["id"] not in keep]
+    for asset_id in removed:
+        logger.info(f"{asset_id} is not part of this run, deleting it")
+        ee.data.deleteAsset(asset_id)
+    return removed
+
+
+def remove_output(asset_id: str) -> bool:
+    """Function to delete an output of the other export mode of a zone stage (merged image or zone-wise collection)
+    the merged image is read in preference to the collection, so one left from an earlier run would shadow a new one
+    args:
+        asset_id (str): asset id of the merged image or of the image collection
+    returns:
+        bool: True if the asset existed and was deleted
+    """
+    try:
+        asset = ee.data.getAsset(asset_id)
+    except ee.EEException:
+        return False
+    # EE only deletes empty collections
+    if asset.get("type") == "IMAGE_COLLECTION":
+        prune_collection(asset_id, [])
+    logger.info(f"{asset_id} is from the other export mode, deleting it")
+    ee.data.deleteAsset(asset_id)
+    return True
@@ -0,0 +1,387 @@
+"""
+Script for defining the dependency-aware stage scheduler used to chain the fuel update scripts
+Each scenario is a small DAG:
+    canopy guide -> CC/CH -> CBH/CBD -> fuel stack export
+    FM40 ----------------------------------^
+A stage is launched as soon as every stage it depends on has all of its export tasks COMPLETED,
+so the wall time is bounded by the critical path instead of by when someone checks the notebook
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import importlib
+import contextvars
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from utils.tracing import span, record_span, child_env
+
+logger = logging.getLogger(__name__)
+
+# EE task states, the local backend uses the same names
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+RUNNING = "RUNNING"
+READY = "READY"
+DONE_STATES = (COMPLETED, FAILED, CANCELLED)
+# stages downstream of a failure are not launched
+SKIPPED = "SKIPPED"
+
+# prefix of the stdout line a stage script run as a subprocess reports its export tasks on
+REPORT_PREFIX = "STAGE_REPORT "
+
+
+def stage_report(task_ids: list, skipped: list) -> dict:
+    """Function to build what a stage script's main returns to the scheduler
+    every output of the stage is either exported (its task id is listed) or skipped as up to date
+    args:
+        task_ids (list): ids of the export tasks the script started
+        skipped (list): asset ids of the outputs that were up to date
+    returns:
+        dict: {"task_ids", "skipped"}
+    """
+    return {"task_ids": list(task_ids), "skipped": list(skipped)}
+
+
+def print_report(report: dict):
+    """Function to print the report of a stage script on stdout, read back by the scheduler in subprocess mode"""
+    print(REPORT_PREFIX + json.dumps(report), flush=True)
+
+
+def parse_report(stdout: str) -> dict:
+    """Helper function to get the report printed by a stage script, None if it printed none"""
+    reports = [line[len(REPORT_PREFIX):] for line in stdout.splitlines() if line.startswith(REPORT_PREFIX)]
+    return json.loads(reports[-1]) if reports else None
+
+
+def make_stage(name: str, deps: list = None, command: list = None, func=None) -> dict:
+    """Function to define a stage of the DAG
+    args:
+        name (str): unique stage name, e.g. "DIST_Alt4/canopy_guide"
+        deps (list): names of the stages that must complete first
+        command (list): argv of the script to run for the stage (in process or as a subprocess, see EETaskBackend)
+            the script's main returns a stage_report, printed with print_report when it runs as a script
+        func (callable): alternative to command, called with no args and returning a list of started task ids
+    returns:
+        dict: stage definition
+    """
+    return {
+        "name": name,
+        "deps": list(deps or []),
+        "command": command,
+        "func": func,
+    }
+
+
+def run_in_process(command: list):
+    """Function to run a stage script command in this process, calling the script's main with its args
+    the script module is imported once per process, so later stages pay no interpreter, import or EE auth startup
+    args:
+        command (list): argv from scenario_stages, [python, script path, *args]
+    returns:
+        what the script's main returns, a stage_report for the stage scripts
+    """
+    script_path = command[1]
+    scripts_dir = os.path.dirname(os.path.abspath(script_path))
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    module = importlib.import_module(os.path.splitext(os.path.basename(script_path))[0])
+    try:
+        return module.main(list(command[2:]))
+    except SystemExit as err:
+        # an argparse error or sys.exit in the script fails its stage instead of ending the scheduler
+        raise RuntimeError(f"{os.path.basename(script_path)} exited with status {err.code}") from err
+
+
+class EETaskBackend:
+    """Task backend that runs the stage scripts and polls Earth Engine for the export task states
+
+    args:
+        in_process (bool): call the scripts' main in this process instead of starting a python process per stage. default = True
+    """
+
+    def __init__(self, in_process: bool = True):
+        # imported here so the local backend works without earthengine-api
+        import ee
+        self.ee = ee
+        self.in_process = in_process
+        # last status of every polled task, holds the timestamps the export spans are built from
+        self.statuses = {}
+
+    def launch(self, stage: dict) -> dict:
+        """Function to start a stage and return the stage_report of the export tasks it started"""
+        if stage["func"] is not None:
+            return stage_report(stage["func"](), [])
+
+        # the script writes its spans into the same trace, under the current launch span
+        if self.in_process:
+            report = run_in_process(stage["command"])
+        else:
+            proc = subprocess.run(stage["command"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=child_env())
+            stdout = proc.stdout.decode(errors="replace")
+            if proc.returncode != 0:
+                logger.info(stdout)
+                raise RuntimeError(f"{stage['name']} failed to launch: {' '.join(stage['command'])}")
+            report = parse_report(stdout)
+
+        # the task ids come from the script itself, tasks of other runs are never picked up
+        if not isinstance(report, dict):
+            raise RuntimeError(f"{stage['name']} did not report its export tasks: {' '.join(stage['command'])}")
+        return report
+
+    def status(self, task_ids: list) -> dict:
+        """Function to get the state of each task id"""
+        statuses = self.ee.data.getTaskStatus(task_ids)
+        self.statuses.update({status["id"]: status for status in statuses})
+        return {status["id"]: status["state"] for status in statuses}
+
+    def task_spans(self, task_ids: list) -> list:
+        """Function to get the queued/run times of finished export tasks from their EE status timestamps
+        returns:
+            list: {"start", "end" (epoch seconds), "status", "attrs"} of each task
+        """
+        spans = []
+        for task_id in task_ids:
+            status = self.statuses.get(task_id, {})
+            created = status.get("creation_timestamp_ms", 0) / 1000
+            started = status.get("start_timestamp_ms", 0) / 1000 or created
+            spans.append({
+                "start": started,
+                "end": status.get("update_timestamp_ms", 0) / 1000 or started,
+                "status": "ok" if status.get("state") == COMPLETED else "error",
+                "attrs": {
+                    "task_id": task_id,
+                    "description": status.get("description"),
+                    "state": status.get("state"),
+                    "queued_s": started - created,
+                },
+            })
+        return spans
+
+
+class LocalTaskBackend:
+    """Offline stand-in for EE, tasks complete (or fail) after a set number of seconds
+
+    args:
+        durations (dict): {stage name: seconds the stage's task runs}. default 0
+        failures (list): stage names whose task ends FAILED
+    """
+
+    def __init__(self, durations: dict = None, failures: list = None):
+        self.durations = durations or {}
+        self.failures = set(failures or [])
+        self.tasks = {}
+        self.started = {}
+        self.launched = []
+
+    def launch(self, stage: dict) -> dict:
+        """Function to register a fake task for the stage"""
+        task_id = f"local_{len(self.tasks)}"
+        state = FAILED if stage["name"] in self.failures else COMPLETED
+        duration = self.durations.get(stage["name"], 0)
+        self.tasks[task_id] = (time.monotonic() + duration, state)
+        self.started[task_id] = (time.time(), duration)
+        self.launched.append(stage["name"])
+        if stage["func"] is not None:
+            stage["func"]()
+        return stage_report([task_id], [])
+
+    def status(self, task_ids: list) -> dict:
+        """Function to get the state of each fake task"""
+        now = time.monotonic()
+        return {
+            task_id: (self.tasks[task_id][1] if now >= self.tasks[task_id][0] else RUNNING)
+            for task_id in task_ids
+        }
+
+    def task_spans(self, task_ids: list) -> list:
+        """Function to get the run times of finished fake tasks, same as EETaskBackend.task_spans"""
+        spans = []
+        for task_id in task_ids:
+            start, duration = self.started[task_id]
+            state = self.tasks[task_id][1]
+            spans.append({
+                "start": start,
+                "end": start + duration,
+                "status": "ok" if state == COMPLETED else "error",
+                "attrs": {"task_id": task_id, "state": state, "queued_s": 0.0},
+            })
+        return spans
+
+
+async def _run_stage(stage: dict, backend, poll_interval: float) -> str:
+    """Coroutine to launch one stage and poll its tasks until they are all done
+    the stage, its launch (script run and task submission) and every export task are traced as spans
+    """
+    logger.info(f"launching {stage['name']}")
+    with span("stage", stage=stage["name"], deps=stage["deps"]) as stage_span:
+        try:
+            # to_thread copies the context, so the launch span is the parent of the script's spans
+            with span("launch", stage=stage["name"]):
+                report = await asyncio.to_thread(backend.launch, stage)
+        except Exception as err:
+            logger.info(f"{stage['name']} {FAILED}: {err}")
+            stage_span.set(state=FAILED)
+            return FAILED
+
+        task_ids = report["task_ids"]
+        # a stage that started no task is only done if it skipped every output as up to date
+        if not task_ids and not report["skipped"]:
+            logger.info(f"{stage['name']} {FAILED}: started no export task and skipped no output")
+            stage_span.set(state=FAILED, tasks=0)
+            return FAILED
+        if not task_ids:
+            logger.info(f"{stage['name']} started no export task, {report['skipped']} are up to date")
+
+        polls = 0
+        states = {}
+        while task_ids:
+            states = await asyncio.to_thread(backend.status, task_ids)
+            polls += 1
+            if all(state in DONE_STATES for state in states.values()):
+                break
+            await asyncio.sleep(poll_interval)
+
+        for task in backend.task_spans(task_ids):
+            record_span("export", task["start"], task["end"], status=task["status"], stage=stage["name"], **task["attrs"])
+
+        final = COMPLETED if all(state == COMPLETED for state in states.values()) else FAILED
+        stage_span.set(state=final, tasks=len(task_ids), polls=polls)
+    logger.info(f"{stage['name']} {final}")
+    return final
+
+
+async def run_dag(stages: list, backend, poll_interval: float = 30) -> dict:
+    """Coroutine to run the stages, launching each one the moment its dependencies complete
+    a failed stage skips everything downstream of it, independent branches keep going
+    args:
+        stages (list): stage definitions from make_stage
+        backend: EETaskBackend or LocalTaskBackend
+        poll_interval (float): seconds between task status polls. default = 30
+    returns:
+        dict: {stage name: COMPLETED | FAILED | SKIPPED}
+    """
+    by_name = {stage["name"]: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage["deps"] if dep not in by_name]
+        if missing:
+            raise ValueError(f"{stage['name']} depends on unknown stages {missing}")
+
+    results = {}
+    running = {}
+
+    def ready(stage):
+        return all(results.get(dep) == COMPLETED for dep in stage["deps"])
+
+    def blocked(stage):
+        return any(results.get(dep) in (FAILED, SKIPPED) for dep in stage["deps"])
+
+    while len(results) < len(stages):
+        progressed = False
+        for name, stage in by_name.items():
+            if name in results or name in running:
+                continue
+            if blocked(stage):
+                results[name] = SKIPPED
+                logger.info(f"{name} {SKIPPED}")
+                progressed = True
+            elif ready(stage):
+                running[name] = asyncio.create_task(_run_stage(stage, backend, poll_interval))
+                progressed = True
+
+        if progressed:
+            continue
+        if not running:
+            raise ValueError(f"dependency cycle between {sorted(set(by_name) - set(results))}")
+
+        done, _ = await asyncio.wait(running.values(), return_when=asyncio.FIRST_COMPLETED)
+        for name in [name for name, task in running.items() if task in done]:
+            results[name] = running.pop(name).result()
+
+    return results
+
+
+def run_stages(stages: list, backend, poll_interval: float = 30) -> dict:
+    """Function to run the stage DAG to completion from synchronous code, e.g. a script or a notebook cell
+    asyncio.run can not be called while an event loop runs in the thread (a notebook kernel), the DAG then
+    runs on its own loop in a worker thread, with the current trace context
+    args:
+        stages (list): stage definitions from make_stage
+        backend: EETaskBackend or LocalTaskBackend
+        poll_interval (float): seconds between task status polls. default = 30
+    returns:
+        dict: {stage name: COMPLETED | FAILED | SKIPPED}
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_dag(stages, backend, poll_interval=poll_interval))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        context = contextvars.copy_context()
+        return pool.submit(context.run, asyncio.run, run_dag(stages, backend, poll_interval=poll_interval)).result()
+
+
+def scenario_stages(
+    scenario: str,
+    config_path: str,
+    dist_img_path: str,
+    out_folder_path: str,
+    fuels_source: str,
+    scripts_dir: str,
+    python: str = "python",
+    extra_args: list = None,
+    stack_export=None,
+) -> list:
+    """Function to build the stage DAG of one scenario
+    args:
+        scenario (str): scenario id used as the stage name prefix
+        config_path (str): path to config file
+        dist_img_path (str): asset path of the scenario DIST img
+        out_folder_path (str): asset path of the scenario fuelscape folder
+        fuels_source (str): firefactor or pyrologix
+        scripts_dir (str): folder holding the CreateEEFuels scripts
+        python (str): python executable. default = python
+        extra_args (list): extra args passed to every script, e.g. ["-t", bundle]
+        stack_export (callable): optional function starting the fuel stack export, returns task ids
+    returns:
+        list: stage definitions
+    """
+    extra_args = list(extra_args or [])
+    base = ["-c", config_path, "-d", dist_img_path, "-o", out_folder_path]
+
+    def script(name, *args):
+        return [python, f"{scripts_dir}/{name}"] + base + list(args) + extra_args
+
+    stages = [
+        make_stage(
+            f"{scenario}/canopy_guide",
+            command=script("create_canopy_guide.py", "-m"),
+        ),
+        make_stage(
+            f"{scenario}/FM40",
+            command=script("calc_FM40.py", "-f", fuels_source, "-m"),
+        ),
+        make_stage(
+            f"{scenario}/CC_CH",
+            deps=[f"{scenario}/canopy_guide"],
+            command=script("calc_CC_CH.py", "-f", fuels_source),
+        ),
+        make_stage(
+            f"{scenario}/CBH_CBD",
+            deps=[f"{scenario}/CC_CH"],
+            command=script("calc_CBD_CBH.py", "-f", fuels_source),
+        ),
+    ]
+    if stack_export is not None:
+        stages.append(
+            make_stage(
+                f"{scenario}/stack_export",
+                deps=[f"{scenario}/FM40", f"{scenario}/CBH_CBD"],
+                func=stack_export,
+            )
+        )
+    return stages
@@ -0,0 +1,303 @@
+"""
+Script for defining functions to write and read the compiled lookup-table bundle
+The bundle holds the CMB and disturbance regression tables as pre-encoded sorted keys and value columns
+so the EE and local backends do not have to parse the csv tables on every run
+
+File layout:
+    8 bytes magic, 8 bytes little-endian header length, utf-8 JSON header,
+    then each array as raw little-endian bytes, the data section and every array start on 64 byte boundaries
+    (array offsets in the header are relative to the start of the data section)
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from utils.local_csv_parser import parse_csv, to_numeric
+from utils.key_packing import CMB_FIELDS, table_packing, pack_table, vocab_packing
+
+MAGIC = b"OPTXTBL\x00"
+BUNDLE_VERSION = 1
+ALIGN = 64
+
+# disturbance regression tables, {variable: file name} as found in gs://landfire/LFTFCT_tables
+# CBH was preprocessed and QA'ed so points to the filled table
+DISTURBANCE_TABLES = {
+    "Cover": "Cover_Disturbance_Tbl.csv",
+    "Height": "Height_Disturbance_Tbl.csv",
+    "CBH": "CBH_Disturbance_Tbl_filled.csv",
+}
+
+# value columns carried for each table type
+CMB_VALUES = ["NewFBFM40", "NewCanopy"]
+DISTURBANCE_COEFS = ["intercept", "HT_coef", "CC_coef"]
+
+
+def file_hash(path: str) -> str:
+    """Helper function to get the sha256 of a file"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def encode_disturbance(dist: np.ndarray, evt: np.ndarray) -> np.ndarray:
+    """Function to encode DIST and EVT values into the 7 digit disturbance table code
+    same as the `expression` in calc_CC_CH.py and calc_CBD_CBH.py, but as exact int32
+    args:
+        dist (np.ndarray): DIST codes
+        evt (np.ndarray): EVT (FVT) codes
+    returns:
+        np.ndarray: int32 array of encoded values
+    """
+    return dist.astype(np.int32) * 10**4 + evt.astype(np.int32)
+
+
+def _sorted_unique(keys: np.ndarray, columns: dict) -> tuple:
+    """Helper function to sort keys and drop duplicates (keeping the first row), carrying the columns along"""
+    keys, first = np.unique(keys, return_index=True)
+    return keys, {name: col[first] for name, col in columns.items()}
+
+
+def compile_bundle(cmb_tables: dict, disturbance_tables: dict, source_hashes: dict) -> tuple:
+    """Function to build the arrays and metadata of a bundle from parsed tables
+    args:
+        cmb_tables (dict): {zone number: parsed z{NN}_CMB table}
+        disturbance_tables (dict): {variable: parsed disturbance table}
+        source_hashes (dict): {source file name: sha256}, used for the content hash
+    returns:
+        tuple: (meta dict, {array name: np.ndarray})
+    """
+    arrays = {}
+
+    # CMB tables share one key packing so keys of all zones are comparable
+    packing = table_packing(list(cmb_tables.values()))
+    for name, vocab, shift, bits in packing["fields"]:
+        arrays[f"cmb/vocab/{name}"] = vocab
+
+    # zone tables are stored back to back, zone_starts gives where each zone begins
+    zones = sorted(cmb_tables)
+    zone_keys, zone_values, starts = [], {col: [] for col in CMB_VALUES}, [0]
+    for zone in zones:
+        table = cmb_tables[zone]
+        keys, values = _sorted_unique(
+            pack_table(packing, table),
+            {col: to_numeric(table[col], np.uint16) for col in CMB_VALUES},
+        )
+        zone_keys.append(keys)
+        for col in CMB_VALUES:
+            zone_values[col].append(values[col])
+        starts.append(starts[-1] + keys.size)
+
+    arrays["cmb/zones"] = np.asarray(zones, dtype=np.int32)
+    arrays["cmb/zone_starts"] = np.asarray(starts, dtype=np.int64)
+    arrays["cmb/keys"] = np.concatenate(zone_keys or [np.empty(0)]).astype(packing["dtype"])
+    for col in CMB_VALUES:
+        arrays[f"cmb/{col}"] = np.concatenate(zone_values[col] or [np.empty(0)]).astype(np.uint16)
+
+    for var, table in disturbance_tables.items():
+        keys, coefs = _sorted_unique(
+            encode_disturbance(to_numeric(table["HDist"], np.int32), to_numeric(table["EVT_Fill"], np.int32)),
+            {col: to_numeric(table[col], np.float64) for col in DISTURBANCE_COEFS},
+        )
+        arrays[f"disturbance/{var}/keys"] = keys
+        for col in DISTURBANCE_COEFS:
+            arrays[f"disturbance/{var}/{col}"] = coefs[col]
+
+    content = hashlib.sha256()
+    for name in sorted(source_hashes):
+        content.update(f"{name}:{source_hashes[name]}\n".encode())
+
+    meta = {
+        "version": BUNDLE_VERSION,
+        "content_hash": content.hexdigest(),
+        "sources": source_hashes,
+        "cmb_fields": list(CMB_FIELDS),
+        "cmb_bits": packing["bits"],
+        "cmb_dtype": packing["dtype"],
+        "disturbance_vars": list(disturbance_tables),
+    }
+    return meta, arrays
+
+
+def _data_start(header_len: int) -> int:
+    """Helper function to get the aligned start of the data section"""
+    return -(-(len(MAGIC) + 8 + header_len) // ALIGN) * ALIGN
+
+
+def write_bundle(path: str, meta: dict, arrays: dict):
+    """Function to write a bundle to disk
+    args:
+        path (str): output file path
+        meta (dict): bundle metadata from compile_bundle
+        arrays (dict): {array name: np.ndarray} from compile_bundle
+    """
+    entries = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder("<"))
+        arrays[name] = arr
+        offset = -(-offset // ALIGN) * ALIGN
+        entries[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+
+    header_bytes = json.dumps(dict(meta, arrays=entries), sort_keys=True).encode("utf-8")
+    data_start = _data_start(len(header_bytes))
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        for name, arr in arrays.items():
+            file.seek(data_start + entries[name]["offset"])
+            file.write(arr.tobytes())
+
+
+def load_bundle(path: str) -> dict:
+    """Function to open a bundle with memory-mapped arrays
+    args:
+        path (str): file path of the bundle
+    returns:
+        dict: bundle metadata with an `arrays` entry holding {array name: read-only np.ndarray view}
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compiled table bundle")
+        header_len = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_len).decode("utf-8"))
+
+    if header["version"] != BUNDLE_VERSION:
+        raise ValueError(f"{path} is bundle version {header['version']}, expected {BUNDLE_VERSION}")
+
+    data_start = _data_start(header_len)
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"])) if entry["shape"] else 1
+        start = data_start + entry["offset"]
+        arrays[name] = mm[start : start + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+    header["arrays"] = arrays
+    return header
+
+
+def bundle_packing(bundle: dict) -> dict:
+    """Helper function to rebuild the CMB key packing layout stored in a bundle
+    returns:
+        dict: packing layout usable with utils/key_packing.py
+    """
+    return vocab_packing({name: bundle["arrays"][f"cmb/vocab/{name}"] for name in bundle["cmb_fields"]})
+
+
+def table_lookups(tables: dict, packing: dict, to_col: str) -> dict:
+    """Function to turn parsed zone CMB tables into the same sorted packed-key lookups a bundle holds
+    args:
+        tables (dict): {zone number: parsed table}
+        packing (dict): packing layout shared by all the tables, from utils/key_packing.py
+        to_col (str): column of the table to remap to, i.e. NewFBFM40 or NewCanopy
+    returns:
+        dict: {zone number: (keys, values)}
+    """
+    lookups = {}
+    for zone, table in tables.items():
+        keys, values = _sorted_unique(pack_table(packing, table), {to_col: to_numeric(table[to_col], np.uint16)})
+        lookups[zone] = (keys, values[to_col])
+    return lookups
+
+
+def cmb_lookup(bundle: dict, zone: int, to_col: str) -> tuple:
+    """Helper function to get the sorted packed keys and values of one zone CMB table
+    args:
+        bundle (dict): bundle from load_bundle
+        zone (int): LANDFIRE zone number
+        to_col (str): value column, i.e. NewFBFM40 or NewCanopy
+    returns:
+        tuple: (keys, values), empty arrays if the zone is not in the bundle
+    """
+    arrays = bundle["arrays"]
+    zones = arrays["cmb/zones"]
+    idx = np.searchsorted(zones, zone)
+    if idx >= zones.size or zones[idx] != zone:
+        return arrays["cmb/keys"][:0], arrays[f"cmb/{to_col}"][:0]
+    start, stop = arrays["cmb/zone_starts"][idx], arrays["cmb/zone_starts"][idx + 1]
+    return arrays["cmb/keys"][start:stop], arrays[f"cmb/{to_col}"][start:stop]
+
+
+def disturbance_lookup(bundle: dict, var: str) -> dict:
+    """Helper function to get the sorted keys and coefficient columns of a disturbance table
+    args:
+        bundle (dict): bundle from load_bundle
+        var (str): one of Cover, Height, CBH
+    returns:
+        dict: {"keys": keys, "intercept": .., "HT_coef": .., "CC_coef": ..}
+    """
+    arrays = bundle["arrays"]
+    out = {"keys": arrays[f"disturbance/{var}/keys"]}
+    for col in DISTURBANCE_COEFS:
+        out[col] = arrays[f"disturbance/{var}/{col}"]
+    return out
+
+
+def read_source_tables(tables_dir: str, cmb_subdir: str = "cmb_zones_wneighbors") -> tuple:
+    """Function to read the csv tables from a local copy of gs://landfire/LFTFCT_tables
+    args:
+        tables_dir (str): local folder holding the disturbance tables and the cmb subfolder
+        cmb_subdir (str): subfolder holding the z{NN}_CMB.csv tables. default = cmb_zones_wneighbors
+    returns:
+        tuple: (cmb tables, disturbance tables, {source file: sha256})
+    """
+    hashes = {}
+    cmb_tables = {}
+    cmb_dir = os.path.join(tables_dir, cmb_subdir)
+    for file_name in sorted(os.listdir(cmb_dir)):
+        match = re.fullmatch(r"z(\d{2})_CMB\.csv", file_name)
+        if match is None:
+            continue
+        path = os.path.join(cmb_dir, file_name)
+        cmb_tables[int(match.group(1))] = parse_csv(path)
+        hashes[f"{cmb_subdir}/{file_name}"] = file_hash(path)
+
+    disturbance_tables = {}
+    for var, file_name in DISTURBANCE_TABLES.items():
+        path = os.path.join(tables_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        disturbance_tables[var] = parse_csv(path)
+        hashes[file_name] = file_hash(path)
+
+    return cmb_tables, disturbance_tables, hashes
+
+
+def open_tables(path: str) -> dict:
+    """Function to get a bundle from either a compiled bundle file or a local copy of the tables folder
+    a folder is compiled in memory, so both give the same lookups
+    args:
+        path (str): file path of a bundle from compile_tables.py or folder for read_source_tables
+    returns:
+        dict: bundle metadata with an `arrays` entry, same as load_bundle
+    """
+    if os.path.isfile(path):
+        return load_bundle(path)
+    meta, arrays = compile_bundle(*read_source_tables(path))
+    return dict(meta, arrays=arrays)
+
+
+def fuel_lookups(bundle: dict, zones: list) -> dict:
+    """Function to gather every lookup the fused local kernel needs
+    args:
+        bundle (dict): bundle from load_bundle or open_tables
+        zones (list): LANDFIRE zone numbers in the window, zones without a table get empty lookups
+    returns:
+        dict: {"packing": packing layout, "NewFBFM40"/"NewCanopy": {zone: (keys, values)},
+            "Cover"/"Height"/"CBH": disturbance lookups}
+    """
+    lookups = {"packing": bundle_packing(bundle)}
+    for col in CMB_VALUES:
+        lookups[col] = {int(zone): cmb_lookup(bundle, int(zone), col) for zone in zones}
+    for var in DISTURBANCE_TABLES:
+        if var not in bundle["disturbance_vars"]:
+            raise ValueError(f"{var} disturbance table missing from bundle {bundle['content_hash']}")
+        lookups[var] = disturbance_lookup(bundle, var)
+    return lookups
@@ -0,0 +1,194 @@
+"""
+Script for defining the tiled execution engine of the local backend
+The config geo grid (crsTransform + dimensions) is split into blocks aligned to the grid origin,
+each block is computed on a process pool from windowed reads and streamed into the output GeoTIFFs
+as soon as it finishes, so no full extent array is ever held in memory.
+The number of blocks in flight is capped so that workers * block size stays under a memory budget.
+"""
+
+import math
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+logger = logging.getLogger(__name__)
+
+# tile edges are multiples of the GeoTIFF block size so tile writes never share a block
+BLOCK_SIZE = 256
+
+# rough peak bytes per pixel of the fused fuelscape kernel
+# (13 input arrays, packed keys, float64 coefficients/regressions and the int16 outputs)
+FUELSCAPE_BYTES_PER_PIXEL = 200
+
+
+def grid_transform(geo_info: dict) -> Affine:
+    """Helper function to get the affine transform of the config geo grid"""
+    return Affine(*geo_info["crsTransform"])
+
+
+def grid_window(geo_info: dict, bounds: tuple = None) -> Window:
+    """Function to get the window of the config grid covering bounds, snapped outward to whole pixels
+    args:
+        geo_info (dict): geo section of the config file
+        bounds (tuple): (left, bottom, right, top) in the config crs. default = whole grid
+    returns:
+        Window: window in grid pixel coordinates, clipped to the grid dimensions
+    """
+    x_size, y_size = geo_info["dimensions"]
+    if bounds is None:
+        return Window(0, 0, x_size, y_size)
+    inv = ~grid_transform(geo_info)
+    left, bottom, right, top = bounds
+    col0, row0 = inv * (left, top)
+    col1, row1 = inv * (right, bottom)
+    # small tolerance so bounds already on the grid do not grow by a pixel
+    col0, row0 = max(math.floor(col0 + 1e-6), 0), max(math.floor(row0 + 1e-6), 0)
+    col1, row1 = min(math.ceil(col1 - 1e-6), x_size), min(math.ceil(row1 - 1e-6), y_size)
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError(f"bounds {bounds} do not overlap the config grid")
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def tile_size_for_budget(memory_mb: float, workers: int, bytes_per_pixel: int = FUELSCAPE_BYTES_PER_PIXEL) -> int:
+    """Function to get the largest tile edge (a multiple of BLOCK_SIZE) that fits the memory budget
+    two tiles per worker are allowed in flight (one computing, one waiting to be written)
+    args:
+        memory_mb (float): memory budget in MB for all tiles in flight
+        workers (int): number of worker processes
+        bytes_per_pixel (int): peak bytes the kernel needs per pixel
+    returns:
+        int: tile edge in pixels, never less than BLOCK_SIZE
+    """
+    pixels = memory_mb * 2**20 / (2 * workers * bytes_per_pixel)
+    return max(int(math.sqrt(pixels)) // BLOCK_SIZE, 1) * BLOCK_SIZE
+
+
+def grid_tiles(window: Window, tile_size: int) -> list:
+    """Function to split a grid window into tiles aligned to multiples of tile_size from the grid origin
+    args:
+        window (Window): window in grid pixel coordinates, from grid_window
+        tile_size (int): tile edge in pixels
+    returns:
+        list: Windows in grid pixel coordinates, row major
+    """
+    col_start, row_start = int(window.col_off), int(window.row_off)
+    col_stop, row_stop = col_start + int(window.width), row_start + int(window.height)
+    tiles = []
+    for row in range(row_start - row_start % tile_size, row_stop, tile_size):
+        for col in range(col_start - col_start % tile_size, col_stop, tile_size):
+            r0, c0 = max(row, row_start), max(col, col_start)
+            r1, c1 = min(row + tile_size, row_stop), min(col + tile_size, col_stop)
+            tiles.append(Window(c0, r0, c1 - c0, r1 - r0))
+    return tiles
+
+
+def tile_bounds(geo_info: dict, tile: Window) -> tuple:
+    """Helper function to get the (left, bottom, right, top) bounds of a grid tile"""
+    return rasterio.windows.bounds(tile, grid_transform(geo_info))
+
+
+def window_profile(geo_info: dict, window: Window) -> dict:
+    """Function to build the rasterio profile of an output covering a grid window
+    args:
+        geo_info (dict): geo section of the config file
+        window (Window): window in grid pixel coordinates
+    returns:
+        dict: profile with crs, transform and shape of the window
+    """
+    return {
+        "driver": "GTiff",
+        "crs": geo_info["crs"],
+        "transform": rasterio.windows.transform(window, grid_transform(geo_info)),
+        "height": int(window.height),
+        "width": int(window.width),
+    }
+
+
+def open_output(path: str, profile: dict, band_names: list, dtype: str, nodata: int):
+    """Function to create an empty tiled GeoTIFF to stream tiles into
+    args:
+        path (str): local output file path
+        profile (dict): from window_profile
+        band_names (list): band descriptions
+        dtype (str): output data type
+        nodata (int): nodata value written to the header
+    returns:
+        rasterio dataset opened for writing, caller closes it
+    """
+    profile = dict(
+        profile,
+        count=len(band_names),
+        dtype=dtype,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=BLOCK_SIZE,
+        blockysize=BLOCK_SIZE,
+        compress="deflate",
+        BIGTIFF="IF_SAFER",
+    )
+    dst = rasterio.open(path, "w", **profile)
+    for i, name in enumerate(band_names, start=1):
+        dst.set_band_description(i, name)
+    return dst
+
+
+def run_tiles(
+    kernel,
+    tiles: list,
+    outputs: dict,
+    origin: Window,
+    workers: int = 1,
+    initializer=None,
+    initargs: tuple = (),
+) -> int:
+    """Function to run a kernel over every tile on a process pool and stream the results to the outputs
+    args:
+        kernel (callable): picklable function taking a grid tile Window and returning
+            {output name: list of 2D arrays (one per band)} shaped like the tile
+        tiles (list): Windows in grid pixel coordinates, from grid_tiles
+        outputs (dict): {output name: dataset from open_output}
+        origin (Window): grid window the outputs cover, tiles are written relative to it
+        workers (int): number of worker processes, 1 runs in process. default = 1
+        initializer (callable): optional per-worker setup, e.g. opening the lookup tables
+        initargs (tuple): arguments of initializer
+    returns:
+        int: number of tiles written
+    """
+
+    def write(tile, result):
+        out_window = Window(tile.col_off - origin.col_off, tile.row_off - origin.row_off, tile.width, tile.height)
+        for name, bands in result.items():
+            dst = outputs[name]
+            for i, band in enumerate(bands, start=1):
+                dst.write(band.astype(dst.dtypes[i - 1]), i, window=out_window)
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for n, tile in enumerate(tiles, start=1):
+            write(tile, kernel(tile))
+            logger.info(f"tile {n}/{len(tiles)} done")
+        return len(tiles)
+
+    # keep at most 2 tiles per worker in flight so memory stays inside the budget used for the tile size
+    max_pending = 2 * workers
+    done_count = 0
+    remaining = iter(tiles)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = {}
+        for tile in remaining:
+            pending[pool.submit(kernel, tile)] = tile
+            if len(pending) < max_pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(pending.pop(future), future.result())
+                done_count += 1
+                logger.info(f"tile {done_count}/{len(tiles)} done")
+        for future in list(pending):
+            write(pending.pop(future), future.result())
+            done_count += 1
+            logger.info(f"tile {done_count}/{len(tiles)} done")
+    return done_count
@@ -0,0 +1,178 @@
+"""
+Script for defining the tracing layer used to time the stages and their sub-steps
+A span is a named, timed block with attributes (zone, scenario, pixel count, table rows, ...).
+Every span is appended as one JSON line to the trace file of the run when it ends:
+    {"run_id", "span_id", "parent_id", "name", "start", "end", "duration_s", "pid", "status", "attrs"}
+start/end are epoch seconds, status is "ok" or "error" (with attrs.error holding the exception)
+
+The trace file and run id are handed to child processes through environment variables, so the scripts the
+scheduler launches (and their worker processes) write into the same trace, under the span that launched them.
+Tracing is off unless init_tracing is given a path or OPTX_TRACE is set, spans are then only timed.
+"""
+
+import os
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# environment variables read by child processes
+TRACE_ENV = "OPTX_TRACE"
+RUN_ENV = "OPTX_TRACE_RUN"
+PARENT_ENV = "OPTX_TRACE_PARENT"
+
+_trace = {"path": None, "run_id": None}
+_current = contextvars.ContextVar("optx_span", default=None)
+_lock = threading.Lock()
+
+
+def init_tracing(path: str = None, run_id: str = None) -> str:
+    """Function to turn tracing on for this process and the processes it starts
+    args:
+        path (str): JSON-lines trace file, spans are appended. default = OPTX_TRACE environment variable
+        run_id (str): id shared by every span of the run. default = OPTX_TRACE_RUN or a new id
+    returns:
+        str: run id, None if no trace path was given or set
+    """
+    path = path or os.environ.get(TRACE_ENV)
+    if not path:
+        return None
+    run_id = run_id or os.environ.get(RUN_ENV) or uuid.uuid4().hex[:16]
+    _trace.update(path=os.path.abspath(path), run_id=run_id)
+    os.environ[TRACE_ENV] = _trace["path"]
+    os.environ[RUN_ENV] = run_id
+    return run_id
+
+
+def tracing_enabled() -> bool:
+    """Helper function to check if spans are written, turns tracing on if a parent process set OPTX_TRACE"""
+    if _trace["path"] is None and os.environ.get(TRACE_ENV):
+        init_tracing()
+    return _trace["path"] is not None
+
+
+class Span:
+    """Named, timed block of work, see span()
+
+    args:
+        name (str): span name, e.g. "load_tables"
+        parent_id (str): span id of the enclosing span, None for a root span
+        attrs (dict): attributes of the span
+    """
+
+    def __init__(self, name: str, parent_id: str = None, attrs: dict = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = dict(attrs or {})
+        self.status = "ok"
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs):
+        """Function to add or overwrite attributes of the span"""
+        self.attrs.update(attrs)
+        return self
+
+    def finish(self):
+        """Function to close the span and write it to the trace"""
+        duration = time.perf_counter() - self._t0
+        self.end = self.start + duration
+        _write(self.name, self.span_id, self.parent_id, self.start, self.end, self.status, self.attrs)
+
+
+def _write(name: str, span_id: str, parent_id: str, start: float, end: float, status: str, attrs: dict):
+    """Helper function to append one span to the trace file"""
+    if not tracing_enabled():
+        return
+    record = {
+        "run_id": _trace["run_id"],
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "start": start,
+        "end": end,
+        "duration_s": end - start,
+        "pid": os.getpid(),
+        "status": status,
+        "attrs": attrs,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    # one write per line in append mode, so lines of concurrent processes do not interleave
+    with _lock, open(_trace["path"], "a") as file:
+        file.write(line)
+
+
+def current_span() -> Span:
+    """Helper function to get the innermost open span of this thread/task, None outside of any span"""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, parent_id: str = None, **attrs):
+    """Context manager timing a block of work as a span
+    the span nests under the enclosing span, or under the span of the process that launched this one
+    args:
+        name (str): span name
+        parent_id (str): explicit parent span id, e.g. for work handed to a worker process. default = enclosing span
+        **attrs: attributes of the span, more can be added with Span.set
+    yields:
+        Span: the open span
+    """
+    if parent_id is None:
+        parent = _current.get()
+        parent_id = parent.span_id if parent is not None else os.environ.get(PARENT_ENV)
+    current = Span(name, parent_id, attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as err:
+        current.status = "error"
+        current.attrs["error"] = repr(err)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+
+
+def traced(name: str = None):
+    """Decorator running a function inside a span named after it (or name)"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_span(name: str, start: float, end: float, parent_id: str = None, status: str = "ok", **attrs):
+    """Function to write a span of work timed elsewhere, e.g. an EE export task from its status timestamps
+    args:
+        name (str): span name
+        start (float): start time, epoch seconds
+        end (float): end time, epoch seconds
+        parent_id (str): parent span id. default = enclosing span
+        status (str): ok or error. default = ok
+        **attrs: attributes of the span
+    """
+    if parent_id is None:
+        parent = _current.get()
+        parent_id = parent.span_id if parent is not None else os.environ.get(PARENT_ENV)
+    _write(name, uuid.uuid4().hex[:16], parent_id, start, end, status, attrs)
+
+
+def child_env() -> dict:
+    """Function to get the environment of a child process so its spans nest under the current span"""
+    env = dict(os.environ)
+    parent = _current.get()
+    if parent is not None:
+        env[PARENT_ENV] = parent.span_id
+    return env
@@ -1,4 +1,5 @@
 #%%
+import bisect
 import numpy as np
 # Generalized point sampling overshoot multipliers used by the ee_treatments() function in main notebook, 
 # we adjust these multipliers to oversample certain number of points so that ee_treatments() can 
@@ -39,32 +40,62 @@ _dict = {"log":
          }
         }
 
-def setall(d, keys, value):
-    for k in keys:
-        d[k] = value
+# names of the dials, in the order get_dials returns them
+DIAL_NAMES = ["sm_overshoot", "med_overshoot", "default_overshoot", "mask_spacing", "pt_spacing"]
 
+# lower edges of the percent treatment bins, a value in [edge i, edge i+1) gets the dials of BIN_KEYS[i]
+# i.e. 0.00-0.049.. -> "0.05", 0.05-0.099.. -> "0.10", ..., 0.55-0.599.. -> "0.60", 0.60-0.649.. -> "0.60"
+BIN_EDGES = [round(i * 0.05, 2) for i in range(14)]
+BIN_KEYS = [f"{min(i + 1, 12) * 0.05:.2f}" for i in range(13)]
 
-def get_dials(pct_trt:float,distro:str):
-    _dict_distro = _dict[distro]
-    _dict_distro_all_keys = {}
-    # bin all possible floats within defined range to the generalized binned keys in _dict
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.0, 0.05, 0.001)], _dict_distro["0.05"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.05, 0.1, 0.001)], _dict_distro["0.10"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.1, 0.15, 0.001)], _dict_distro["0.15"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.15, 0.2, 0.001)], _dict_distro["0.20"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.2, 0.25, 0.001)], _dict_distro["0.25"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.25, 0.3, 0.001)], _dict_distro["0.30"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.3, 0.35, 0.001)], _dict_distro["0.35"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.35, 0.4, 0.001)], _dict_distro["0.40"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.4, 0.45, 0.001)], _dict_distro["0.45"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.45, 0.5, 0.001)], _dict_distro["0.50"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.5, 0.55, 0.001)], _dict_distro["0.55"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.55, 0.6, 0.001)], _dict_distro["0.60"])
-    setall(_dict_distro_all_keys, [round(i,3) for i in np.arange(0.6, 0.65, 0.001)], _dict_distro["0.60"])
-    if pct_trt not in _dict_distro_all_keys.keys():
-        raise ValueError("percent treatment value {pct_trt} is not in all_keys dictionary")
-    indexed_dict = _dict_distro_all_keys[pct_trt]
-    return indexed_dict.values()
+# precomputed (n bins, n dials) tables of each distro
+_DIAL_TABLES = {
+    distro: np.array([[bins[key][name] for name in DIAL_NAMES] for key in BIN_KEYS], dtype=np.float64)
+    for distro, bins in _dict.items()
+}
+
+
+def _dial_table(distro:str) -> np.ndarray:
+    """Helper function to get the precomputed dial table of a distro"""
+    if distro not in _DIAL_TABLES:
+        raise ValueError(f"{distro} is not a valid distro. Valid distros: {list(_DIAL_TABLES)}")
+    return _DIAL_TABLES[distro]
+
+
+def get_dials(pct_trt:float,distro:str) -> tuple:
+    """Function to look up the point sampling dials for a percent treatment
+    args:
+        pct_trt (float): percent treatment as a fraction, 0 <= pct_trt < 0.65
+        distro (str): one of log, norm
+    returns:
+        tuple: (sm_overshoot, med_overshoot, default_overshoot, mask_spacing, pt_spacing)
+    """
+    table = _dial_table(distro)
+    # bisect over the bin edges, any float in range finds its bin
+    i = bisect.bisect_right(BIN_EDGES, pct_trt) - 1
+    if i < 0 or i >= len(BIN_KEYS):
+        raise ValueError(f"percent treatment value {pct_trt} is outside of the calibrated range [{BIN_EDGES[0]}, {BIN_EDGES[-1]})")
+    return tuple(float(v) for v in table[i])
+
+
+def get_dials_batch(pct_trt:np.ndarray, distro:str) -> tuple:
+    """Function to look up the point sampling dials for an array of percent treatments in one call
+    args:
+        pct_trt (np.ndarray): percent treatments as fractions, 0 <= pct_trt < 0.65
+        distro (str): one of log, norm
+    returns:
+        tuple: (sm_overshoot, med_overshoot, default_overshoot, mask_spacing, pt_spacing) arrays shaped like pct_trt
+    """
+    table = _dial_table(distro)
+    pct_trt = np.asarray(pct_trt, dtype=np.float64)
+    idx = np.searchsorted(BIN_EDGES, pct_trt, side="right") - 1
+    out_of_range = (idx < 0) | (idx >= len(BIN_KEYS)) | np.isnan(pct_trt)
+    if out_of_range.any():
+        raise ValueError(
+            f"{int(out_of_range.sum())} percent treatment values outside of the calibrated range "
+            f"[{BIN_EDGES[0]}, {BIN_EDGES[-1]}), e.g. {pct_trt[out_of_range].flat[0]}"
+        )
+    return tuple(table[idx, j] for j in range(len(DIAL_NAMES)))
 
 #%%
 # test
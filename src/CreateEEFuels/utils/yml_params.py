@@ -1,13 +1,35 @@
 #%%
+"""
+Script for defining functions for reading the config file
+The config is parsed once per version of the file and copied to each caller, so stages run in one process (optx.py)
+share it and an edited config is parsed again
+"""
+
+import os
+import copy
+import functools
 import yaml
-import ee
-ee.Initialize()
 
-def get_export_params(yml):
+
+@functools.lru_cache(maxsize=None)
+def _parse_config(yml: str, mtime_ns: int) -> dict:
+    """Helper function to parse a config file once per modification time"""
     with open(yml) as file:
-            config = yaml.full_load(file)
+        return yaml.full_load(file)
+
 
-    geo_info = config["geo"]
+def load_config(yml: str) -> dict:
+    """Function to read a config file, parsed on the first call after each change and copied after
+    args:
+        yml (str): path to config file
+    returns:
+        dict: parsed config, safe to modify
+    """
+    return copy.deepcopy(_parse_config(yml, os.stat(yml).st_mtime_ns))
+
+
+def get_export_params(yml):
+    geo_info = load_config(yml)["geo"]
     #print(geo_info)
     crs = geo_info["crs"]
     scale = geo_info["scale"]
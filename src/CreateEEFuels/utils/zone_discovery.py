@@ -0,0 +1,122 @@
+"""
+Script for defining functions to find the LANDFIRE zones a scenario has to be computed for
+One frequency histogram of the zone image over the export region, unmasked and masked to the disturbed pixels,
+gives every zone in the region and how many of its pixels are disturbed in a single round trip.
+Zones without a disturbed pixel keep their baseline values, so the zone stages can skip them.
+The result is cached as json by DIST asset id, keyed on the asset's updateTime and the export region,
+so re-running a stage (or the other zone stage of the same scenario) does not recompute it.
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import ee
+
+logger = logging.getLogger(__name__)
+
+# repo level data folder, same place the treatment crosswalk cache lives
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "data", "zone_cache"
+)
+
+# 0 is outside of every zone and there is no zone 11
+MISSING_ZONES = (0, 11)
+
+
+def zone_histograms(zone_img: ee.Image, dist_img: ee.Image, region: ee.Geometry, geo_t: list, crs: str) -> tuple:
+    """Function to count the pixels and disturbed pixels of each zone in the export region
+    args:
+        zone_img (ee.Image): LANDFIRE zones image
+        dist_img (ee.Image): DIST image of the scenario, non-zero where disturbed
+        region (ee.Geometry): export region from aoi.export_region
+        geo_t (list): config crsTransform, the counts are on the export grid
+        crs (str): config crs
+    returns:
+        tuple: ({zone: pixels}, {zone: disturbed pixels}), zones without a disturbed pixel are left out of the second
+    """
+    disturbed = dist_img.unmask(0).neq(0)
+    counts = (
+        zone_img.rename("zone")
+        .addBands(zone_img.updateMask(disturbed).rename("disturbed"))
+        .reduceRegion(
+            reducer=ee.Reducer.frequencyHistogram(),
+            geometry=region,
+            crs=crs,
+            crsTransform=geo_t,
+            maxPixels=1e13,
+            tileScale=4,
+        )
+        .getInfo()
+    )
+    # histogram keys are the zone numbers as strings, a band with no pixels comes back as None
+    return tuple(
+        {int(float(zone)): int(count) for zone, count in (counts.get(band) or {}).items()}
+        for band in ("zone", "disturbed")
+    )
+
+
+def cache_path(cache_dir: str, dist_img_path: str, revision: str, region: ee.Geometry) -> str:
+    """Helper function to get the cache file of a DIST asset, revision and export region"""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", dist_img_path).strip("_")
+    # the region is built client-side, serializing it does not need a round trip
+    digest = hashlib.sha1(f"{revision}|{region.serialize()}".encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{slug}__{digest}.json")
+
+
+def discover_zones(
+    dist_img_path: str,
+    dist_img: ee.Image,
+    zone_img: ee.Image,
+    region: ee.Geometry,
+    geo_t: list,
+    crs: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+) -> dict:
+    """Function to find the zones in the export region and which of them hold disturbed pixels
+    args:
+        dist_img_path (str): asset path of the scenario DIST img, the cache key
+        dist_img (ee.Image): DIST image of the scenario
+        zone_img (ee.Image): LANDFIRE zones image
+        region (ee.Geometry): export region from aoi.export_region
+        geo_t (list): config crsTransform
+        crs (str): config crs
+        cache_dir (str): folder holding the cached results, None to always recompute. default = data/zone_cache
+    returns:
+        dict: {"zones": sorted zones in the region, "disturbed": {zone: disturbed pixels}, "cached": bool}
+    """
+    path = None
+    if cache_dir is not None:
+        # an overwritten DIST asset gets a new updateTime, so its stale entry is never read
+        revision = ee.data.getAsset(dist_img_path).get("updateTime")
+        path = cache_path(cache_dir, dist_img_path, revision, region)
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    cached = json.load(file)
+                logger.info(f"read zones of {dist_img_path} from {path}")
+                return {
+                    "zones": cached["zones"],
+                    "disturbed": {int(zone): count for zone, count in cached["disturbed"].items()},
+                    "cached": True,
+                }
+            except (OSError, ValueError, KeyError, AttributeError) as err:
+                # an unreadable entry is a miss, it is recomputed and written again
+                logger.info(f"ignoring unreadable zone cache {path}: {err!r}")
+
+    pixels, disturbed = zone_histograms(zone_img, dist_img, region, geo_t, crs)
+    result = {
+        "zones": sorted(zone for zone in pixels if zone not in MISSING_ZONES),
+        "disturbed": {zone: count for zone, count in sorted(disturbed.items()) if zone not in MISSING_ZONES},
+    }
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written next to the entry and moved in place, the other zone stage of the scenario may be reading it
+        # (the scheduler runs them at once), a unique temp name per writer keeps concurrent writes apart
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(dict(result, dist_img_path=dist_img_path, revision=revision), file, indent=2)
+        os.replace(tmp_path, path)
+    return dict(result, cached=False)